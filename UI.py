@@ -1,4 +1,5 @@
 from importer import *
+from logbuffer import SEVERITIES, LogBuffer
 from tkinter.font import Font
 from typing import Tuple
 import threading
@@ -14,6 +15,8 @@ from tkinter import (
     Tk,
     Checkbutton,
     BooleanVar,
+    StringVar,
+    OptionMenu,
     Frame,
     messagebox,
     ttk,
@@ -25,11 +28,21 @@ from pathlib import Path
 from catppuccin import Flavour
 from dataclasses import dataclass, field
 import argparse
+import re
+from datetime import datetime
+
+# The number of lines kept in the log panel of the GUI, the full log can be exported
+LOG_LINES = 5000
+# Matches the terminal color codes of the importer messages
+ANSI_CODE = re.compile(r"\x1b\[[0-9;]*m")
 
 
 def main():
     args = GetArgs()
     imp = Importer()
+    if args.cache_info or args.cache_prune or args.cache_clear:
+        ManageCache(args)
+        return
     if args.gui:
         if args.src is not None or args.src is not None:
             print(
@@ -37,13 +50,24 @@ def main():
             )
             return
         gui = GUI(imp)
-    elif args.src is not None and args.dst is not None:
-        src = args.src
-        dst = args.dst
+    elif (args.src is not None and args.dst is not None) or args.execute_plan is not None:
+        src = args.src or ""
+        dst = args.dst or ""
 
-        print(
-            f"\033[1;31mWARNING\033[1;33m this scrip assumes, that \033[1;31mALL\033[1;33m files in the \033[1;34m{src}\033[1;33m folder are images\033[1;0m"
-        )
+        if args.plan is not None and args.execute_plan is not None:
+            print(
+                "\033[1;31m[ERROR]: \033[1;0mEither --plan or --execute-plan can be specified. Not both!"
+            )
+            return
+        if args.watch and (args.plan is not None or args.execute_plan is not None):
+            print(
+                "\033[1;31m[ERROR]: \033[1;0m--watch can not be used with --plan or --execute-plan!"
+            )
+            return
+        if not (args.include or args.exclude or args.min_size or args.max_size or args.sniff):
+            print(
+                f"\033[1;31mWARNING\033[1;33m this scrip assumes, that \033[1;31mALL\033[1;33m files in the \033[1;34m{src}\033[1;33m folder are images\033[1;0m"
+            )
         print(
             f"The source directory: \033[1;34m{src}\n\033[1;0mThe destination directory: \033[1;34m{dst}\033[1;0m"
         )
@@ -52,17 +76,70 @@ def main():
         imp.events.__isub__(Msg.PrintLvl3, 3)
         imp.Import(
             Options(
-                source=src, destination=dst, recursive=args.r, force_overwrite=args.f
+                source=src,
+                destination=dst,
+                recursive=args.r,
+                force_overwrite=args.f,
+                exiftool_workers=args.exiftool_workers,
+                metadata_batch_size=args.batch_size,
+                metadata_mode=args.metadata,
+                cache_path=None if args.no_cache else args.cache,
+                cache_max_entries=args.cache_size,
+                metadata_workers=args.metadata_workers,
+                move_workers=args.move_workers,
+                queue_size=args.queue_size,
+                auto_tune=args.auto_tune,
+                min_workers=args.min_workers,
+                max_workers=args.max_workers,
+                copy_buffer_size=args.buffer_size * 1024 * 1024,
+                fsync_batch=args.fsync_batch,
+                keep_source=args.copy,
+                verify=args.copy or args.verify,
+                duplicates=args.duplicates,
+                journal=not args.no_journal,
+                resume=args.resume,
+                plan_path=args.plan,
+                schedule=args.schedule,
+                schedule_window=args.schedule_window,
+                device_workers=args.device_workers,
+                backend=args.backend,
+                process_workers=args.process_workers,
+                execute_plan=args.execute_plan,
+                date_chain=args.date_chain,
+                group_sidecars=args.group_sidecars,
+                include=tuple(args.include),
+                exclude=tuple(args.exclude),
+                min_size=args.min_size,
+                max_size=args.max_size,
+                sniff=args.sniff,
+                rejected=args.rejected,
+                watch=args.watch,
+                settle=args.settle,
+                watch_interval=args.watch_interval,
+                watch_backend=args.watch_backend,
+                profile=args.profile,
+                metrics_json=args.metrics_json,
+                metrics_textfile=args.metrics_textfile,
             )
         )
         print("The process has exited.\nPress \033[1;33mEnter\033[1;0m to continue")
         input()
     else:
         print(
-            "\033[1;31m[ERROR]: \033[1;0mEither --src and --dst or --gui must be specified."
+            "\033[1;31m[ERROR]: \033[1;0mEither --src and --dst, --execute-plan or --gui must be specified."
         )
 
 
+# Parses the value of --date-chain
+def DateChain(value: str) -> tuple[str, ...]:
+    chain = tuple(s.strip() for s in value.split(",") if s.strip())
+    try:
+        DateResolver(chain)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return chain
+
+
 def GetArgs():
     parser = argparse.ArgumentParser(
         description="Application to import images into separet directories based on their creation date."
@@ -97,6 +174,307 @@ def GetArgs():
         required=False,
         default=False,
     )
+    parser.add_argument(
+        "--exiftool-workers",
+        type=int,
+        help="The number of exiftool processes kept running to read the metadata of the files. It's set to 4 by default",
+        required=False,
+        default=4,
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="The maximum number of files whose metadata is read with a single exiftool call. It's set to 200 by default",
+        required=False,
+        default=200,
+    )
+    parser.add_argument(
+        "--metadata",
+        choices=METADATA_MODES,
+        help="Where the filetype and the date are read from. 'fast' parses the headers of common formats (JPEG, PNG, HEIC, TIFF, CR2, NEF, ARW, DNG) and QuickTime videos (MOV, MP4) in python, 'exiftool' uses exiftool for every file and 'hybrid' uses exiftool only for the files the fast path can not handle. It's set to hybrid by default",
+        required=False,
+        default="hybrid",
+    )
+    parser.add_argument(
+        "--metadata-workers",
+        type=int,
+        help="The number of threads reading the metadata of the files. It's set to 4 by default",
+        required=False,
+        default=4,
+    )
+    parser.add_argument(
+        "--move-workers",
+        type=int,
+        help="The number of threads moving the files. It's set to 4 by default",
+        required=False,
+        default=4,
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        help="The number of files that can wait between two stages of the import. It's set to 256 by default",
+        required=False,
+        default=256,
+    )
+    parser.add_argument(
+        "--auto-tune",
+        action="store_true",
+        help="If this option is specified the number of metadata and move threads is adjusted during the import based on the measured throughput",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--min-workers",
+        type=int,
+        help="The minimum number of threads per stage when --auto-tune is used. It's set to 1 by default",
+        required=False,
+        default=1,
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help="The maximum number of threads per stage when --auto-tune is used. It's set to 16 by default",
+        required=False,
+        default=16,
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="If this option is specified the files are copied instead of moved, the source directory is left untouched. Every copy is verified with a checksum",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="If this option is specified the files copied to another device are verified with a checksum before their source is removed",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=SCHEDULE_POLICIES,
+        help="The order the source files are read in. 'walk' is the order they are found in, 'inode' groups them by device and orders them by directory and inode and 'extent' orders them by their location on the disk (Linux only, falls back to inode order). Ordered reads are faster on SD cards, USB hard drives and optical media. It's set to walk by default",
+        required=False,
+        default="walk",
+    )
+    parser.add_argument(
+        "--schedule-window",
+        type=int,
+        help="The number of files ordered at a time by the inode and extent schedules. It's set to 10000 by default",
+        required=False,
+        default=10_000,
+    )
+    parser.add_argument(
+        "--device-workers",
+        type=int,
+        help="The number of files of the same source device moved at the same time, different devices are still moved in parallel. 0 means no limit. It's set to 0 by default",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        help="Where the headers are parsed and the files are hashed. 'process' runs them in a pool of worker processes, so they are not limited by the GIL, 'thread' runs them in the worker threads. It's set to thread by default",
+        required=False,
+        default="thread",
+    )
+    parser.add_argument(
+        "--process-workers",
+        type=int,
+        help="The number of worker processes of the process backend. It's set to the number of CPUs by default",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--plan",
+        type=str,
+        help="If this option is specified nothing is moved, the planned moves (source -> destination/filetype/date/name) are written to this file as JSON Lines. The plan can be reviewed and executed later with --execute-plan",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--execute-plan",
+        type=str,
+        help="Executes the moves of a plan written by --plan instead of searching the source. --src and --dst are taken from the plan",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="If this option is specified an interrupted import into the destination is continued: half-finished copies are cleaned up and only the files that were not imported yet are processed",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--no-journal",
+        action="store_true",
+        help="If this option is specified no journal is written into the destination, the import can not be resumed if it is interrupted",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--duplicates",
+        choices=DUPLICATE_MODES,
+        help="What to do with files that are already in the destination. 'skip' reports and leaves them in the source, 'rename' reports and imports them under a suffixed name (e.g. IMG_0001_1.JPG) and 'import' does not look for duplicates. It's set to import by default",
+        required=False,
+        default="import",
+    )
+    parser.add_argument(
+        "--buffer-size",
+        type=int,
+        help="The buffer size in MiB used when the files have to be copied to another device. It's set to 8 by default",
+        required=False,
+        default=DEFAULT_BUFFER_SIZE // 1024 // 1024,
+    )
+    parser.add_argument(
+        "--fsync-batch",
+        type=int,
+        help="The number of files copied to another device that are synced to the disk at once, before their source is removed. 0 disables syncing. It's set to 64 by default",
+        required=False,
+        default=64,
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help=f"The location of the metadata cache. Files that did not change since a previous run are not read again. It's set to {DEFAULT_CACHE_PATH} by default",
+        required=False,
+        default=DEFAULT_CACHE_PATH,
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="If this option is specified the metadata cache is neither read nor written",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        help="The maximum number of files kept in the metadata cache. The least recently used ones are removed first. It's set to 1000000 by default",
+        required=False,
+        default=1_000_000,
+    )
+    parser.add_argument(
+        "--cache-info",
+        action="store_true",
+        help="Prints information about the metadata cache and exits",
+        required=False,
+    )
+    parser.add_argument(
+        "--cache-prune",
+        action="store_true",
+        help="Removes the files that no longer exist or have changed from the metadata cache and exits",
+        required=False,
+    )
+    parser.add_argument(
+        "--cache-clear",
+        action="store_true",
+        help="Removes every file from the metadata cache and exits",
+        required=False,
+    )
+    parser.add_argument(
+        "--date-chain",
+        type=DateChain,
+        help=f"The sources the capture dates are resolved from, separated by commas, tried in order until one gives a date. The sources are: {', '.join(DATE_SOURCES)}. E.g. 'header,filename,sidecar,exiftool,mtime'. By default the chain follows --metadata",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--group-sidecars",
+        action="store_true",
+        help="Imports files of the same directory and name (e.g. IMG_0001.CR3, IMG_0001.JPG and IMG_0001.xmp) together: the date is read once for the group and all of its files go under the same date, the sidecars (XMP, THM, AAE, ...) next to the RAW",
+        required=False,
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        help="Only imports the files whose name matches this glob (e.g. '*.jpg'), case-insensitively. Can be given multiple times",
+        required=False,
+        default=[],
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        help="Does not import the files whose name matches this glob (e.g. '*.thm', 'Thumbs.db'), case-insensitively. Can be given multiple times",
+        required=False,
+        default=[],
+    )
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        help="Does not import the files smaller than this many bytes",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        help="Does not import the files larger than this many bytes",
+        required=False,
+        default=0,
+    )
+    parser.add_argument(
+        "--sniff",
+        action="store_true",
+        help="Only imports the files whose first bytes look like an image, a RAW, a video or an XMP sidecar",
+        required=False,
+    )
+    parser.add_argument(
+        "--rejected",
+        choices=REJECT_ACTIONS,
+        help="What happens with the files rejected by --include, --exclude, --min-size, --max-size and --sniff. 'skip' leaves them in the source, 'misc' moves them into the misc directory without reading their metadata. It's set to skip by default",
+        required=False,
+        default="skip",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keeps running and imports the files that appear in the source, once they stopped changing. Stop it with Ctrl+C",
+        required=False,
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        help="With --watch, the number of seconds a file's size and modification time must stay the same before it is imported. It's set to 5 by default",
+        required=False,
+        default=5.0,
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        help="With --watch, the longest time in seconds between two checks of the source. It's set to 1 by default",
+        required=False,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--watch-backend",
+        choices=WATCH_BACKENDS,
+        help="With --watch, how changes of the source are noticed. 'inotify' is notified by the kernel (Linux only), 'poll' checks the directories every interval. It's set to auto by default",
+        required=False,
+        default="auto",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Prints the time spent in each stage of the import, the exiftool calls and the queue depths at the end",
+        required=False,
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=str,
+        help="Writes the metrics of the import to this file as JSON",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        type=str,
+        help="Writes the metrics of the import to this file in the Prometheus text format, for the textfile collector of the node exporter",
+        required=False,
+        default=None,
+    )
     parser.add_argument(
         "--gui",
         action="store_true",
@@ -106,6 +484,24 @@ def GetArgs():
     return parser.parse_args()
 
 
+# Runs the metadata cache maintenance commands
+def ManageCache(args):
+    with MetadataCache(args.cache, args.cache_size) as cache:
+        if args.cache_clear:
+            cache.clear()
+            print("\033[1;32m[INFO]: The metadata cache has been cleared\033[1;0m")
+        if args.cache_prune:
+            removed = cache.prune()
+            print(f"\033[1;32m[INFO]: Removed {removed} stale entries\033[1;0m")
+        info = cache.info()
+    print(f"The metadata cache: \033[1;34m{info['path']}\033[1;0m")
+    print(f"Entries: {info['entries']} (at most {info['max_entries']})")
+    print(f"Size: {info['size_bytes'] / 1024 / 1024:.1f} MiB")
+    for key, label in (("oldest_use", "Least recently used"), ("newest_use", "Most recently used")):
+        if info[key] is not None:
+            print(f"{label}: {datetime.fromtimestamp(info[key]):%Y.%m.%d %H:%M:%S}")
+
+
 # A collection of functions used to print multiple levels of logging data
 class Msg:
     def __init__(self, *args):
@@ -161,7 +557,9 @@ class GUI(object):
 
     def __init__(self, imp: Importer):
         self.importer_thread = threading.Thread()
-        self.counter_lock = threading.Lock()
+        # The importer fires its events from worker threads, they are collected here and delivered on the Tk main loop
+        self.event_queue = EventQueue(max_rate=10)
+        self.log = LogBuffer(LOG_LINES)
         self.main_window = Tk()
         self.options = Options(str(Path.home()), str(Path.home()))
         self.label_font = Font(size=11)
@@ -170,6 +568,9 @@ class GUI(object):
         self.flavour = Flavour.mocha()
         self.recusrsive = BooleanVar()
         self.force = BooleanVar()
+        self.keep_source = BooleanVar()
+        self.resume = BooleanVar()
+        self.log_filter = StringVar(value="info")
         self.color_scheme = ColorSchemeHex(
             f"#{self.flavour.base.hex}",
             f"#{self.flavour.text.hex}",
@@ -180,16 +581,24 @@ class GUI(object):
             f"#{self.flavour.yellow.hex}",
         )
         self.init_gui()
-        # Subscribe to events
-        self.importer.new_copied_event.__isub__(self.new_copied)
-        self.importer.copy_failed_event.__isub__(self.copy_error)
-        self.importer.copy_done_event.__isub__(self.copy_done)
-        self.importer.collected_files_event.__isub__(self.found_files)
-        self.importer.completed_event.__isub__(self.on_completion)
-        # self.importer.events.__isub__(self.on_warning, 2)
-        # self.importer.events.__isub__(self.on_error, 3)
+        # Subscribe to events. Only the last file being moved and the number of moved files since the last update are shown
+        self.importer.new_copied_event.subscribeQueued(self.new_copied, self.event_queue, coalesce=True)
+        self.importer.copy_failed_event.subscribeQueued(self.copy_error, self.event_queue)
+        self.importer.copy_done_event.subscribeQueued(self.copy_done, self.event_queue, coalesce=True)
+        self.importer.found_files_event.subscribeQueued(self.found_files, self.event_queue, coalesce=True)
+        self.importer.duplicate_event.subscribeQueued(self.duplicate_found, self.event_queue)
+        self.importer.completed_event.subscribeQueued(self.on_completion, self.event_queue)
+        self.importer.events.subscribeQueued(self.on_warning, self.event_queue, 2)
+        self.importer.events.subscribeQueued(self.on_error, self.event_queue, 3)
+        self.drain_events()
         self.main_window.mainloop()
 
+    # Delivers the events collected since the last call, then schedules itself again. Runs on the Tk main loop
+    def drain_events(self):
+        self.event_queue.drain()
+        self.flush_warn_err()
+        self.main_window.after(round(self.event_queue.min_interval * 1000) or 100, self.drain_events)
+
     def init_gui(self):
         self.main_window.title("File sorter")
         self.main_window.geometry("800x600")
@@ -269,6 +678,36 @@ class GUI(object):
             borderwidth=0,
         )
         force_chckbx.pack(side=LEFT)
+        # Checkbox to specify whether the files are copied (and verified) instead of moved
+        keep_source_chckbx = Checkbutton(
+            chckbox_panel,
+            text="Copy and verify",
+            onvalue=True,
+            offvalue=False,
+            background=self.color_scheme.background,
+            foreground=self.color_scheme.text_color,
+            height=chckbox_height,
+            font=self.label_font,
+            variable=self.keep_source,
+            width=len("Copy and verify"),
+            borderwidth=0,
+        )
+        keep_source_chckbx.pack(side=LEFT)
+        # Checkbox to specify whether an interrupted import is continued
+        resume_chckbx = Checkbutton(
+            chckbox_panel,
+            text="Resume",
+            onvalue=True,
+            offvalue=False,
+            background=self.color_scheme.background,
+            foreground=self.color_scheme.text_color,
+            height=chckbox_height,
+            font=self.label_font,
+            variable=self.resume,
+            width=len("Resume"),
+            borderwidth=0,
+        )
+        resume_chckbx.pack(side=LEFT)
 
     # Infopanel
     # Displays messages generated by the program. Use insert_warn_err to add text to it
@@ -288,6 +727,32 @@ class GUI(object):
             width=200,
         )
         self.warn_err.pack()
+        # The severity filter and the export of the full log
+        log_controls = Frame(info, background=self.color_scheme.background)
+        log_filter = OptionMenu(log_controls, self.log_filter, *SEVERITIES, command=self.filter_log)
+        log_filter.configure(
+            background=self.color_scheme.button_released,
+            foreground=self.color_scheme.text_color,
+            activebackground=self.color_scheme.button_hover,
+            activeforeground=self.color_scheme.text_color,
+            font=self.label_font,
+            highlightthickness=0,
+        )
+        log_filter.pack(side=LEFT)
+        export_button = Button(
+            log_controls,
+            command=self.export_log,
+            text="Export log",
+            background=self.color_scheme.button_released,
+            foreground=self.color_scheme.text_color,
+            activebackground=self.color_scheme.button_hover,
+            activeforeground=self.color_scheme.text_color,
+            font=self.label_font,
+            width=len("Export log"),
+            height=1,
+        )
+        export_button.pack(side=LEFT)
+        log_controls.pack(fill=X)
         info.pack()
 
     def build_start_button_row(self, container: PanedWindow):
@@ -354,7 +819,7 @@ class GUI(object):
     def on_closing(self):
         if messagebox.askokcancel(
             "Exit",
-            "Are you sure, that you want to exit the application?\nThis will stop the sorting and leave already sorted files in their respective directories",
+            "Are you sure, that you want to exit the application?\nThis will stop the sorting and leave already sorted files in their respective directories. The import can be continued later with the Resume option",
         ):
             if self.importer_thread.is_alive():
                 self.importer.cancel()
@@ -381,6 +846,9 @@ class GUI(object):
             self.start_button.configure(state="disabled")
             self.options.recursive = self.recusrsive.get()
             self.options.force_overwrite = self.force.get()
+            self.options.keep_source = self.keep_source.get()
+            self.options.verify = self.keep_source.get()
+            self.options.resume = self.resume.get()
             self.progress_num = 0
             # Start the importer on a different thread to avoid the GUI freezing
             self.importer_thread = threading.Thread(
@@ -487,45 +955,80 @@ class GUI(object):
 
     # Method called when the importer encounters an issue
     def copy_error(self, *args, **kwds):
-        self.insert_warn_err(f"{args[0][0]} {args[0][1]}\n")
+        self.insert_warn_err(f"{args[0][0]} {args[0][1]}\n", "error")
 
     def on_error(self, *args, **kwds):
-        self.insert_warn_err(f"{args[0][0]}\n")
+        self.insert_warn_err(ANSI_CODE.sub("", f"{args[1]['args'][0]}\n"), "error")
 
     def on_warning(self, *args, **kwds):
-        self.insert_warn_err(f"{args[1]['args'][0]}\n")
+        self.insert_warn_err(ANSI_CODE.sub("", f"{args[1]['args'][0]}\n"), "warning")
 
-    # Method called by the importer a file has been copied
+    # Method called by the importer when files have been copied, with the number of copied files since the last call
     def copy_done(self, *args, **kwds):
+        self.progress_num += args[1].get("count", 1)
         if self.num_files == 0:
             return
-        with self.counter_lock:
-            self.progress_num += 1
-            percentage = 100 * self.progress_num / self.num_files
-            self.progressbar["value"] = percentage
+        self.progressbar["value"] = 100 * self.progress_num / self.num_files
         self.progress_percentage.configure(
             text=f"{round(100 * self.progress_num / self.num_files)}%"
         )
 
-    # Method called when the importer has found the files to be imported
+    # Method called when a file is already in the destination
+    def duplicate_found(self, *args, **kwds):
+        self.insert_warn_err(f"{args[0][0]} is a duplicate of {args[0][1]}\n", "info")
+
+    # Method called while the importer is searching for the files to be imported, with the number of files found so far
     def found_files(self, *args, **kwds):
-        self.num_files = len(args[0][0])
+        self.num_files = args[0][0]
 
     # Method called when the importer has finished
     def on_completion(self, *args, **kwds):
         self.start_button.configure(state="normal")
         self.insert_warn_err(
-            f"Done!\n{self.progress_num} out of {self.num_files} were moved.\n"
+            f"Done!\n{self.progress_num} out of {self.num_files} were moved.\n", "info"
         )
         self.progress_num = 0
 
-    # Method used to modify (insert into) the text panel displaying the importer messages
-    def insert_warn_err(self, text: str):
+    # Method used to add a message to the text panel displaying the importer messages.
+    # The message is added to the log and inserted with the rest of the new messages by flush_warn_err
+    def insert_warn_err(self, text: str, severity: str = "warning"):
+        self.log.append(severity, text)
+
+    # Inserts the new messages passing the severity filter at once. Only the last LOG_LINES lines are kept in the panel
+    def flush_warn_err(self):
+        lines = self.log.take(self.log_filter.get())
+        if not lines:
+            return
         self.warn_err.configure(state="normal")
-        self.warn_err.insert(INSERT, text)
+        self.warn_err.insert(END, "".join(f"{line.text}\n" for line in lines))
+        excess = int(self.warn_err.index("end-1c").split(".")[0]) - 1 - self.log.max_lines
+        if excess > 0:
+            self.warn_err.delete("1.0", f"{excess + 1}.0")
         self.warn_err.configure(state="disabled")
         self.warn_err.see(END)
 
+    # Shows the kept messages that pass the newly selected severity filter
+    def filter_log(self, *args):
+        self.log.take()
+        self.warn_err.configure(state="normal")
+        self.warn_err.delete("1.0", END)
+        self.warn_err.insert(END, "".join(f"{line.text}\n" for line in self.log.lines(self.log_filter.get())))
+        self.warn_err.configure(state="disabled")
+        self.warn_err.see(END)
+
+    # Writes every message of the session (not only the ones shown) to a file chosen by the user
+    def export_log(self):
+        path = filedialog.asksaveasfilename(
+            defaultextension=".log", filetypes=[("Log files", "*.log"), ("All files", "*")]
+        )
+        if not path:
+            return
+        try:
+            self.log.export(path)
+            self.insert_warn_err(f"The log was exported to {path}\n", "info")
+        except OSError as e:
+            self.insert_warn_err(f"The log could not be exported: {e}\n", "error")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from instrumentation import Metrics
+from itertools import islice
+from metadata import TAGS, records_from_json
+from transfer import TransferEngine
+
+
+# A progress report of import_async
+# kind is one of: found (a new batch of files was found), moved, failed (message is the reason) and finished
+@dataclass(slots=True, frozen=True)
+class ImportProgress:
+    kind: str
+    src: str | None = field(default=None)
+    dst: str | None = field(default=None)
+    message: str | None = field(default=None)
+    found: int = field(default=0)
+    moved: int = field(default=0)
+    failed: int = field(default=0)
+
+
+# Reads the metadata of files with a single exiftool run, without blocking the event loop. The process is killed if the task is cancelled
+async def readBatchAsync(files: list[str], executable: str = "exiftool") -> dict:
+    if not files:
+        return {}
+    proc = await asyncio.create_subprocess_exec(
+        executable,
+        "-j",
+        "-G",
+        "-n",
+        "-fast",
+        *[f"-{tag}" for tag in TAGS],
+        *files,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        out, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+    # exiftool exits with a non-zero status if a single file failed, the output of the rest is still valid
+    try:
+        found = json.loads(out) if out.strip() else []
+    except json.JSONDecodeError:
+        found = []
+    return records_from_json(files, found)
+
+
+# Runs an import on the running event loop and yields its progress (see Importer.import_async).
+# Discovery, the cache and the header parsing run in threads, exiftool runs as asynchronous subprocesses, and the moves run in threads.
+# At most options.async_concurrency metadata reads and moves are in flight at the same time.
+# Cancelling the task that iterates the progress stops the import: no new files are started, the moves in flight are finished
+async def importAsync(importer, options, executable: str = "exiftool"):
+    loop = asyncio.get_running_loop()
+    progress = asyncio.Queue()
+    counts = {"found": 0, "moved": 0, "failed": 0}
+    importer.metrics = metrics = Metrics()
+    importer.discovery = importer.discoveryFilter(options)
+    importer.resolver = importer.dateResolver(options)
+    routed = importer.discovery.routed if importer.discovery is not None else {}
+    io = asyncio.Semaphore(options.async_concurrency)
+    batches = asyncio.Semaphore(options.async_concurrency)
+    destination = options.destination
+    if destination[-1] != "/":
+        destination += "/"
+    transfer = TransferEngine(
+        destination,
+        options.copy_buffer_size,
+        options.fsync_batch,
+        options.keep_source,
+        options.verify,
+    )
+
+    def report(kind, src=None, dst=None, message=None):
+        if kind in counts and kind != "found":
+            counts[kind] += 1
+        progress.put_nowait(ImportProgress(kind, src, dst, message, **counts))
+
+    # The events are fired by the threads doing the moves
+    def moved(args, kwds):
+        loop.call_soon_threadsafe(report, "moved", args[0], args[1])
+
+    def failed(args, kwds):
+        loop.call_soon_threadsafe(report, "failed", args[0], None, args[1])
+
+    async def readMetadata(paths):
+        # The files the discovery filter routed to misc are not read
+        known = {path: routed.pop(path) for path in paths if path in routed}
+        paths = [path for path in paths if path not in known]
+        if not paths:
+            return known
+        async with io:
+            resolution, stats, missing = await asyncio.to_thread(
+                importer.readKnownMetadata, paths, options.metadata_mode
+            )
+            if missing:
+                start = loop.time()
+                resolution.add(await readBatchAsync(missing, executable), "exiftool")
+                metrics.observe("metadata_seconds", loop.time() - start, source="exiftool")
+                metrics.count("exiftool_calls")
+                metrics.count("metadata_files", len(missing), source="exiftool")
+        records = await asyncio.to_thread(importer.completeMetadata, resolution, stats)
+        records.update(known)
+        return records
+
+    # Runs in a thread. The size is only known once the file is stat-ed, which would block the event loop
+    def moveFile(fromTo):
+        try:
+            fromTo.size = os.path.getsize(fromTo.src)
+        except OSError:
+            pass
+        return fromTo.Move(options.force_overwrite, transfer)
+
+    async def move(fromTo):
+        async with io:
+            moving = asyncio.ensure_future(asyncio.to_thread(moveFile, fromTo))
+            try:
+                await asyncio.shield(moving)
+            except asyncio.CancelledError:
+                # A file being moved can not be interrupted, wait for it so that it is not left half done
+                await moving
+                raise
+
+    async def importBatch(batch):
+        try:
+            paths = [os.fspath(f) for f in batch]
+            try:
+                records = await readMetadata(paths)
+            except Exception as e:
+                # Same as a failed stage of Importer.importImages, the rest of the import goes on
+                importer.events.__call__(3, f"metadata failed for {len(paths)} files: {e}")
+                for path in paths:
+                    report("failed", path, None, str(e))
+                return
+            planned = []
+            for path in paths:
+                fromTo = importer.FromTo.initExif(
+                    path,
+                    destination,
+                    importer.events,
+                    importer.new_copied_event,
+                    importer.copy_failed_event,
+                    importer.copy_done_event,
+                    importer.collected_files_event,
+                    record=records[path],
+                )
+                fromTo.metrics = metrics
+                planned.append(fromTo)
+            await asyncio.gather(*(move(fromTo) for fromTo in planned))
+        finally:
+            batches.release()
+
+    async def run():
+        tasks = set()
+        files = importer.GetFiles(src=options.source, isRecursive=options.recursive)
+        try:
+            while True:
+                batch = await asyncio.to_thread(
+                    lambda: list(islice(files, options.metadata_batch_size))
+                )
+                if not batch:
+                    break
+                counts["found"] += len(batch)
+                report("found")
+                await batches.acquire()
+                task = asyncio.create_task(importBatch(batch))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(transfer.flush)
+            progress.put_nowait(None)
+
+    importer.copy_done_event.__isub__(moved)
+    importer.copy_failed_event.__isub__(failed)
+    producer = asyncio.create_task(run())
+    try:
+        while (item := await progress.get()) is not None:
+            yield item
+        await producer
+        yield ImportProgress("finished", **counts)
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+        importer.copy_done_event.__iunsub__(moved)
+        importer.copy_failed_event.__iunsub__(failed)
+        importer.resolver = None
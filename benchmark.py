@@ -0,0 +1,337 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from exifpool import ExifToolPool
+from headers import QUICKTIME_EPOCH
+from importer import Importer, Options
+from metadata import METADATA_MODES
+
+# The kinds of files of the synthetic corpus and their share of it
+CORPUS_MIX = {"jpeg": 0.6, "tiff": 0.1, "mp4": 0.15, "junk": 0.15}
+# The range the capture dates of the corpus are drawn from
+FIRST_DATE = datetime(2010, 1, 1, tzinfo=timezone.utc)
+LAST_DATE = datetime(2024, 12, 31, tzinfo=timezone.utc)
+# The payloads of the files are cut from a shared block of random bytes, generating a fresh block per file would take longer than importing it
+PAYLOAD_BLOCK = 4 * 1024 * 1024
+
+
+# A generated file and the metadata the import should find for it. filetype and date are None for junk
+class CorpusFile:
+    __slots__ = ("path", "kind", "size", "filetype", "date")
+
+    def __init__(self, path: str, kind: str, size: int, filetype: str | None, date: str | None) -> None:
+        self.path = path
+        self.kind = kind
+        self.size = size
+        self.filetype = filetype
+        self.date = date
+
+
+# Builds a little endian TIFF structure with the camera make in IFD0 and the capture date in the EXIF IFD
+def tiffBlock(make: str, taken: datetime) -> bytes:
+    stamp = taken.strftime("%Y:%m:%d %H:%M:%S").encode() + b"\0"
+    make = make.encode() + b"\0"
+    # header (8), IFD0 with 2 entries (2 + 24 + 4), EXIF IFD with 2 entries (2 + 24 + 4), then the values
+    exif_ifd = 8 + 30
+    values = exif_ifd + 30
+    out = bytearray(b"II*\0" + struct.pack("<I", 8))
+    out += struct.pack("<H", 2)
+    out += struct.pack("<HHII", 0x010F, 2, len(make), values)
+    out += struct.pack("<HHII", 0x8769, 4, 1, exif_ifd)
+    out += struct.pack("<I", 0)
+    out += struct.pack("<H", 2)
+    out += struct.pack("<HHII", 0x9003, 2, len(stamp), values + len(make))
+    out += struct.pack("<HHII", 0x9004, 2, len(stamp), values + len(make) + len(stamp))
+    out += struct.pack("<I", 0)
+    out += make + stamp + stamp
+    return bytes(out)
+
+
+# A JPEG with an EXIF segment, followed by payload as the scan data
+def jpegFile(taken: datetime, payload: bytes) -> bytes:
+    exif = b"Exif\0\0" + tiffBlock("Canon", taken)
+    return (
+        b"\xff\xd8"
+        + b"\xff\xe1"
+        + struct.pack(">H", len(exif) + 2)
+        + exif
+        + b"\xff\xda"
+        + struct.pack(">H", 8)
+        + b"\x03\x01\x00\x02\x11\x03"
+        + payload
+        + b"\xff\xd9"
+    )
+
+
+# A TIFF with the image data (payload) after the EXIF structure
+def tiffFile(taken: datetime, payload: bytes) -> bytes:
+    return tiffBlock("Canon", taken) + payload
+
+
+def _box(btype: bytes, content: bytes) -> bytes:
+    return struct.pack(">I", len(content) + 8) + btype + content
+
+
+# An MP4 container: ftyp, the media data (payload) and a movie header with the creation time, in the order most cameras write them
+def mp4File(taken: datetime, payload: bytes) -> bytes:
+    seconds = int((taken - QUICKTIME_EPOCH).total_seconds())
+    mvhd = struct.pack(">BBBBIIII", 0, 0, 0, 0, seconds, seconds, 1000, 0).ljust(100, b"\0")
+    return (
+        _box(b"ftyp", b"isom" + struct.pack(">I", 0x200) + b"isomiso2mp41")
+        + _box(b"mdat", payload)
+        + _box(b"moov", _box(b"mvhd", mvhd))
+    )
+
+
+# Generates a reproducible corpus of count files under root. The same seed always yields the same files.
+# Sizes are log-uniform between min_size and max_size, files are spread over directories up to max_depth levels deep
+def generateCorpus(
+    root: str,
+    count: int,
+    seed: int = 0,
+    min_size: int = 16 * 1024,
+    max_size: int = 4 * 1024 * 1024,
+    max_depth: int = 3,
+    files_per_dir: int = 50,
+) -> list[CorpusFile]:
+    rnd = random.Random(seed)
+    block = rnd.randbytes(PAYLOAD_BLOCK)
+    kinds = list(CORPUS_MIX)
+    weights = list(CORPUS_MIX.values())
+    span = int((LAST_DATE - FIRST_DATE).total_seconds())
+    dirs = [root]
+    corpus = []
+    for i in range(count):
+        if i % files_per_dir == 0 and i:
+            # A new directory, nested under a random directory that is not too deep
+            parent = rnd.choice([d for d in dirs if d[len(root) :].count(os.sep) < max_depth])
+            dirs.append(os.path.join(parent, f"dir{len(dirs):04}"))
+        directory = dirs[-1]
+        os.makedirs(directory, exist_ok=True)
+        kind = rnd.choices(kinds, weights)[0]
+        size = int(min_size * (max_size / min_size) ** rnd.random())
+        offset = rnd.randrange(PAYLOAD_BLOCK)
+        payload = (block[offset:] + block[:offset]) * (size // PAYLOAD_BLOCK + 1)
+        payload = payload[:size]
+        taken = FIRST_DATE + (LAST_DATE - FIRST_DATE) * (rnd.randrange(span) / span)
+        date = taken.strftime("%Y.%m.%d")
+        if kind == "jpeg":
+            name, data, filetype = f"IMG_{i:06}.JPG", jpegFile(taken, payload), "jpeg"
+        elif kind == "tiff":
+            name, data, filetype = f"SCAN_{i:06}.tif", tiffFile(taken, payload), "tiff"
+        elif kind == "mp4":
+            name, data, filetype = f"MOV_{i:06}.mp4", mp4File(taken, payload), "mp4"
+        else:
+            name = f"junk_{i:06}.{rnd.choice(('dat', 'txt', 'bin'))}"
+            data, filetype, date = payload, None, None
+        path = os.path.join(directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        corpus.append(CorpusFile(path, kind, len(data), filetype, date))
+    return corpus
+
+
+# The rates of a timed run over files files of size bytes
+def rates(seconds: float, files: int, size: int) -> dict:
+    return {
+        "seconds": round(seconds, 6),
+        "files": files,
+        "bytes": size,
+        "files_per_second": round(files / seconds, 2) if seconds > 0 else None,
+        "bytes_per_second": round(size / seconds, 2) if seconds > 0 else None,
+    }
+
+
+def poolCounts(pool: ExifToolPool) -> dict:
+    return {"exiftool_processes": pool.started, "exiftool_calls": pool.checkouts}
+
+
+# Times the discovery of the files of the corpus
+def benchDiscovery(root: str, corpus: list[CorpusFile]) -> dict:
+    imp = Importer()
+    start = time.perf_counter()
+    found = list(imp.GetFiles(root, isRecursive=True))
+    result = rates(time.perf_counter() - start, len(found), sum(f.size for f in corpus))
+    result["missing"] = len(corpus) - len(found)
+    return result
+
+
+# Times the metadata resolution of readMetadata in mode, in batches of batch_size like importImages reads them.
+# The cache is not used, so that every file is read. correct counts the media files whose filetype and date were found
+def benchMetadata(corpus: list[CorpusFile], mode: str, batch_size: int, workers: int) -> dict:
+    imp = Importer()
+    imp.exiftool_pool = ExifToolPool(workers)
+    paths = [f.path for f in corpus]
+    records = {}
+    start = time.perf_counter()
+    try:
+        for i in range(0, len(paths), batch_size):
+            records.update(imp.readMetadata(paths[i : i + batch_size], mode))
+    finally:
+        imp.exiftool_pool.shutdown()
+    result = rates(time.perf_counter() - start, len(paths), sum(f.size for f in corpus))
+    media = [f for f in corpus if f.filetype is not None]
+    result["correct"] = sum(
+        1 for f in media if records[f.path].filetype == f.filetype and records[f.path].date == f.date
+    )
+    result["media"] = len(media)
+    result.update(poolCounts(imp.exiftool_pool))
+    return result
+
+
+# Times the per file whatType/getExifDate calls of the original import, two exiftool calls per file, on the first sample files
+def benchLegacy(corpus: list[CorpusFile], sample: int) -> dict:
+    files = corpus[:sample]
+    pool = ExifToolPool(1)
+    start = time.perf_counter()
+    try:
+        with pool.checkout() as et:
+            for f in files:
+                Importer.FromTo.whatType(f.path, et)
+                Importer.FromTo.getExifDate(f.path, et)
+    finally:
+        pool.shutdown()
+    result = rates(time.perf_counter() - start, len(files), sum(f.size for f in files))
+    result["exiftool_processes"] = pool.started
+    result["exiftool_calls"] = 2 * len(files)
+    return result
+
+
+# Times a whole import (Importer.Import) of the corpus in source into destination, with the given metadata mode
+def benchImport(source: str, destination: str, corpus: list[CorpusFile], mode: str, args) -> dict:
+    imp = Importer()
+    errors = []
+    imp.events.__isub__(lambda args, kwds: errors.append(kwds["args"][0]), 3)
+    moved = []
+    imp.copy_done_event.__isub__(lambda args, kwds: moved.append(args[0]))
+    options = Options(
+        source=source,
+        destination=destination,
+        recursive=True,
+        exiftool_workers=args.exiftool_workers,
+        metadata_batch_size=args.batch_size,
+        metadata_mode=mode,
+        cache_path=None,
+        journal=False,
+        backend=args.backend,
+    )
+    start = time.perf_counter()
+    imp.Import(options)
+    result = rates(time.perf_counter() - start, len(corpus), sum(f.size for f in corpus))
+    result["moved"] = len(moved)
+    result["errors"] = len(errors)
+    result.update(poolCounts(imp.exiftool_pool))
+    result["profile"] = imp.metrics.summary()
+    return result
+
+
+def GetArgs():
+    parser = argparse.ArgumentParser(
+        description="Measures the throughput of the importer on a generated corpus. The results are printed as JSON"
+    )
+    parser.add_argument("--files", type=int, default=1000, help="The number of files of the corpus")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the corpus, the same seed always generates the same corpus")
+    parser.add_argument("--min-size", type=int, default=16 * 1024, help="The size of the smallest file in bytes")
+    parser.add_argument("--max-size", type=int, default=4 * 1024 * 1024, help="The size of the largest file in bytes")
+    parser.add_argument("--max-depth", type=int, default=3, help="The maximum depth of the directories of the corpus")
+    parser.add_argument(
+        "--modes",
+        default=",".join(METADATA_MODES),
+        help="The metadata modes to measure, separated by commas. The modes that need exiftool are skipped if it is not installed",
+    )
+    parser.add_argument("--legacy-sample", type=int, default=100, help="The number of files whatType/getExifDate are timed on, 0 skips them")
+    parser.add_argument("--no-import", action="store_true", help="Do not time the end to end import")
+    parser.add_argument("--batch-size", type=int, default=200, help="The number of files per exiftool call")
+    parser.add_argument("--exiftool-workers", type=int, default=4, help="The number of exiftool processes")
+    parser.add_argument("--backend", default="thread", help="Where header parsing and hashing run (thread or process)")
+    parser.add_argument("--workdir", default=None, help="Where the corpus is generated, a temporary directory by default")
+    parser.add_argument("--keep", action="store_true", help="Do not delete the working directory")
+    parser.add_argument("--output", default=None, help="Write the results to this file instead of the standard output")
+    return parser.parse_args()
+
+
+def main():
+    args = GetArgs()
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    for mode in modes:
+        if mode not in METADATA_MODES:
+            sys.exit(f"Unknown metadata mode: {mode}")
+    exiftool = shutil.which("exiftool")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="exif-image-sorter-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    source = os.path.join(workdir, "source")
+    skipped = []
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "exiftool": exiftool,
+        },
+        "corpus": {},
+        "results": {},
+        "skipped": skipped,
+    }
+    generate = lambda: generateCorpus(
+        source, args.files, args.seed, args.min_size, args.max_size, args.max_depth
+    )
+    try:
+        shutil.rmtree(source, ignore_errors=True)
+        start = time.perf_counter()
+        corpus = generate()
+        report["corpus"] = {
+            "seed": args.seed,
+            "files": len(corpus),
+            "bytes": sum(f.size for f in corpus),
+            "kinds": {kind: sum(1 for f in corpus if f.kind == kind) for kind in CORPUS_MIX},
+            "generated_in": round(time.perf_counter() - start, 6),
+        }
+        results = report["results"]
+        results["discovery"] = benchDiscovery(source, corpus)
+        for mode in modes:
+            if mode != "fast" and exiftool is None:
+                skipped.append(f"metadata:{mode} (exiftool is not installed)")
+                continue
+            results[f"metadata:{mode}"] = benchMetadata(corpus, mode, args.batch_size, args.exiftool_workers)
+        if args.legacy_sample > 0:
+            if exiftool is None:
+                skipped.append("legacy (exiftool is not installed)")
+            else:
+                results["legacy"] = benchLegacy(corpus, args.legacy_sample)
+        if not args.no_import:
+            for mode in modes:
+                if mode != "fast" and exiftool is None:
+                    skipped.append(f"import:{mode} (exiftool is not installed)")
+                    continue
+                # Every import moves the corpus away, so each one gets a fresh copy of the same corpus
+                destination = os.path.join(workdir, f"destination-{mode}")
+                shutil.rmtree(destination, ignore_errors=True)
+                if not os.path.isdir(source):
+                    corpus = generate()
+                results[f"import:{mode}"] = benchImport(source, destination, corpus, mode, args)
+                shutil.rmtree(source, ignore_errors=True)
+                shutil.rmtree(destination, ignore_errors=True)
+    finally:
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    out = json.dumps(report, indent=2)
+    if args.output is None:
+        print(out)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(out + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+import os
+from fnmatch import fnmatchcase
+from metadata import MetaRecord
+
+# What happens with the files the filter rejects:
+# skip: they are left in the source
+# misc: they are imported into destination/misc/ without reading their metadata
+REJECT_ACTIONS = ("skip", "misc")
+# The number of bytes sniff reads from the start of a file
+SNIFF_SIZE = 32
+# Signatures at the start of image, RAW and video files
+MEDIA_MAGIC = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",
+    b"GIF87a",
+    b"GIF89a",
+    b"II*\0",  # TIFF and the TIFF based RAWs (CR2, NEF, ARW, DNG, ...)
+    b"MM\0*",
+    b"IIRO",  # Olympus ORF
+    b"IIRS",
+    b"MMOR",
+    b"IIU\0",  # Panasonic RW2
+    b"FUJIFILMCCD-RAW",
+    b"FOVb",  # Sigma X3F
+    b"\0MRM",  # Minolta MRW
+    b"8BPS",  # Photoshop
+    b"\x1a\x45\xdf\xa3",  # Matroska/WebM
+    b"\0\0\x01\xba",  # MPEG program stream
+    b"\0\0\x01\xb3",
+    b"<?xpacket",  # XMP
+    b"<x:xmpmeta",
+)
+# RIFF containers of media
+RIFF_FORMATS = {b"WEBP", b"AVI ", b"WAVE"}
+# Atoms an ISO base media or QuickTime file (MP4, MOV, HEIC, CR3, 3GP, ...) starts with
+BOX_TYPES = {b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+# The sync byte of MPEG transport streams, M2TS files have a 4 byte time code before it.
+# A single byte says little, so it is only trusted for files with one of the transport stream extensions
+TS_SYNC = 0x47
+TS_EXTENSIONS = {".mts", ".m2ts", ".m2t", ".ts"}
+
+
+# Returns True if the first bytes of a file look like an image, RAW, video or XMP sidecar, False if they do not
+# and None if the file can not be read
+def sniff(path: str) -> bool | None:
+    try:
+        with open(path, "rb") as f:
+            head = f.read(SNIFF_SIZE)
+    except OSError:
+        return None
+    if head.startswith(MEDIA_MAGIC):
+        return True
+    if head[:4] == b"RIFF" and head[8:12] in RIFF_FORMATS:
+        return True
+    if head[4:8] in BOX_TYPES:
+        return True
+    if head[6:14] == b"HEAPCCDR":  # Canon CRW
+        return True
+    if head[:2] == b"BM" and head[6:10] == b"\0\0\0\0":  # BMP, the reserved fields are zero
+        return True
+    ext = os.path.splitext(path)[1].lower()
+    if ext in TS_EXTENSIONS and TS_SYNC in head[0:1] + head[4:5]:
+        return True
+    # XMP sidecars written as plain XML
+    if ext == ".xmp" and head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"<"):
+        return True
+    return False
+
+
+# Decides which of the discovered files are imported. The checks run cheapest first: the name against the globs,
+# the size, then the first bytes of the file (if sniffing is enabled). Globs are matched case-insensitively against the file name.
+# The rejected files are counted by reason (also in metrics, if given), the ones routed to misc are kept in routed with their record
+class DiscoveryFilter:
+    def __init__(
+        self,
+        include: tuple = (),
+        exclude: tuple = (),
+        min_size: int = 0,
+        max_size: int = 0,
+        sniff: bool = False,
+        action: str = "skip",
+        metrics=None,
+    ) -> None:
+        if action not in REJECT_ACTIONS:
+            raise ValueError(f"Unknown action for rejected files: {action}")
+        self.include = tuple(p.lower() for p in include)
+        self.exclude = tuple(p.lower() for p in exclude)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.sniff = sniff
+        self.action = action
+        self.metrics = metrics
+        self.rejected = {}
+        self.routed = {}
+
+    # True if the filter rejects anything
+    def active(self) -> bool:
+        return bool(self.include or self.exclude or self.min_size or self.max_size or self.sniff)
+
+    # Returns the reason a file (a path or an os.DirEntry) is rejected, None if it is accepted
+    def check(self, f) -> str | None:
+        path = os.fspath(f)
+        name = os.path.basename(path).lower()
+        if self.include and not any(fnmatchcase(name, p) for p in self.include):
+            return "include"
+        if any(fnmatchcase(name, p) for p in self.exclude):
+            return "exclude"
+        if self.min_size or self.max_size:
+            try:
+                size = f.stat().st_size if isinstance(f, os.DirEntry) else os.stat(path).st_size
+            except OSError:
+                return "unreadable"
+            if size < self.min_size or (self.max_size and size > self.max_size):
+                return "size"
+        if self.sniff:
+            media = sniff(path)
+            if media is None:
+                return "unreadable"
+            if not media:
+                return "sniff"
+        return None
+
+    # Yields the accepted files. Rejected files are yielded as well if they are routed to misc
+    def filter(self, files):
+        for f in files:
+            reason = self.check(f)
+            if reason is None:
+                yield f
+                continue
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+            if self.metrics is not None:
+                self.metrics.count("files_rejected", reason=reason)
+            if self.action == "misc":
+                self.routed[os.fspath(f)] = MetaRecord("misc")
+                yield f
+
+    # A short summary of the rejected files
+    def report(self) -> str | None:
+        total = sum(self.rejected.values())
+        if not total:
+            return None
+        reasons = ", ".join(f"{reason}: {n}" for reason, n in sorted(self.rejected.items()))
+        where = "routed to misc" if self.action == "misc" else "skipped"
+        return f"{total} files were {where} by the discovery filter ({reasons})"
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+
+import hashlib
+import os
+import threading
+from transfer import DEFAULT_BUFFER_SIZE, hashFile
+
+# What to do with files that are already in the destination:
+# import: no duplicate detection, every file is imported
+# skip: duplicates are reported and left where they are
+# rename: duplicates are reported and imported under a suffixed name
+DUPLICATE_MODES = ("import", "skip", "rename")
+
+# The size of the blocks hashed at the start and the end of a file in the second tier
+BLOCK_SIZE = 64 * 1024
+
+
+# Hashes the first and the last block of a file. For files smaller than two blocks this covers the whole content
+def quickHash(path: str, size: int, block_size: int = BLOCK_SIZE) -> str:
+    digest = hashlib.blake2b(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(block_size, size - block_size))
+            digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+# Finds files that already exist in a directory tree (the destination library).
+# Candidates are compared in tiers: by size, then by the hash of their first and last blocks, and only
+# files that match in both are hashed fully. Most files have a unique size, so they cost no extra reads.
+# The hash functions can be replaced, e.g. by ones running in other processes (see offload.Offload)
+class DuplicateIndex:
+    def __init__(
+        self,
+        block_size: int = BLOCK_SIZE,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        quick_hash=quickHash,
+        hash_file=hashFile,
+    ) -> None:
+        self.block_size = block_size
+        self.buffer_size = buffer_size
+        self.quick_hash = quick_hash
+        self.hash_file = hash_file
+        self.quick_hashes = 0
+        self.full_hashes = 0
+        self.matches = 0
+        self._sizes = {}
+        self._sources = {}
+        self._quick = {}
+        self._full = {}
+        self._lock = threading.Lock()
+        # One lock per file size, only files of the same size can be duplicates of each other (see findOrAdd)
+        self._sizeLocks = {}
+
+    # Adds every file of a directory tree to the index, except the ones named in exclude. Returns the number of files added
+    def build(self, root: str, exclude: tuple[str, ...] = ()) -> int:
+        count = 0
+        dirs = [root]
+        while dirs:
+            try:
+                with os.scandir(dirs.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False) and entry.name not in exclude:
+                            self.add(entry.path, entry.stat(follow_symlinks=False).st_size)
+                            count += 1
+            except OSError:
+                continue
+        return count
+
+    # Adds a file to the index. A file that is about to be imported to path can be added with its source,
+    # its content is read from there for as long as the source exists
+    def add(self, path: str, size: int, source: str | None = None) -> None:
+        with self._lock:
+            self._sizes.setdefault(size, []).append(path)
+            if source is not None:
+                self._sources[path] = source
+
+    # Hashes a file with func, or returns the hash it already has in memo
+    def _hash(self, memo: dict, path: str, func) -> str:
+        with self._lock:
+            value = memo.get(path)
+            source = self._sources.get(path)
+        if value is not None:
+            return value
+        try:
+            value = func(source or path)
+        except OSError:
+            if source is None:
+                raise
+            # The source has been moved to its new path since
+            value = func(path)
+        with self._lock:
+            memo[path] = value
+        return value
+
+    def _quickHash(self, path: str, size: int) -> str:
+        def func(p):
+            with self._lock:
+                self.quick_hashes += 1
+            return self.quick_hash(p, size, self.block_size)
+
+        return self._hash(self._quick, path, func)
+
+    def _fullHash(self, path: str) -> str:
+        def func(p):
+            with self._lock:
+                self.full_hashes += 1
+            return self.hash_file(p, self.buffer_size)
+
+        return self._hash(self._full, path, func)
+
+    # Returns an indexed file with the same content as path, or None if there is none.
+    # A path that can not be read is not a duplicate, the import reports the error when moving it
+    def find(self, path: str, size: int) -> str | None:
+        with self._lock:
+            # A file added with path as its source is path itself, e.g. if its move failed and it is imported again
+            candidates = [c for c in self._sizes.get(size, ()) if c != path and self._sources.get(c) != path]
+        if not candidates:
+            return None
+        try:
+            quick = self._quickHash(path, size)
+        except OSError:
+            return None
+        full = None
+        for candidate in candidates:
+            try:
+                if self._quickHash(candidate, size) != quick:
+                    continue
+            except OSError:
+                # The candidate was moved or removed in the meantime
+                continue
+            # The quick hash already covered the whole content of small files
+            if size > 2 * self.block_size:
+                if full is None:
+                    try:
+                        full = self._fullHash(path)
+                    except OSError:
+                        return None
+                try:
+                    if self._fullHash(candidate) != full:
+                        continue
+                except OSError:
+                    continue
+            with self._lock:
+                self.matches += 1
+            return candidate
+        return None
+
+    # Returns an indexed file with the same content as path, or adds path under its new name dst if there is none.
+    # Finding and adding is a single step for files of the same size: two identical files imported at the same time
+    # can not both miss each other, the second one finds the first
+    def findOrAdd(self, path: str, size: int, dst: str) -> str | None:
+        with self._lock:
+            lock = self._sizeLocks.setdefault(size, threading.Lock())
+        with lock:
+            match = self.find(path, size)
+            if match is None:
+                self.add(dst, size, path)
+            return match
+
+
+# Returns a name that does not exist in directory yet, by appending _1, _2, ... to the stem of name
+def uniqueName(directory: str, name: str) -> str:
+    stem, ext = os.path.splitext(name)
+    i = 1
+    while os.path.lexists(os.path.join(directory, f"{stem}_{i}{ext}")):
+        i += 1
+    return f"{stem}_{i}{ext}"
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+import queue
+import threading
+from contextlib import contextmanager
+from exiftool import ExifToolHelper
+from exiftool.exceptions import ExifToolException, ExifToolExecuteError
+
+
+# A pool of persistent (-stay_open) exiftool processes that can be checked out by the importer threads.
+# Processes are started lazily, up to size, and are reused until the pool is shut down
+class ExifToolPool:
+    def __init__(self, size: int = 4, executable: str | None = None) -> None:
+        if size < 1:
+            raise ValueError(f"The exiftool pool needs at least one process, got: {size}")
+        self.size = size
+        self.executable = executable
+        self.restarts = 0
+        # The number of exiftool processes started and the number of times a process was lent out (one per batch of files)
+        self.started = 0
+        self.checkouts = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._spawned = 0
+
+    # Starts a new exiftool process in -stay_open mode
+    def _spawn(self) -> ExifToolHelper:
+        et = ExifToolHelper(executable=self.executable)
+        et.run()
+        with self._lock:
+            self.started += 1
+        return et
+
+    # Returns True if the exiftool process is still alive and able to take commands
+    def healthy(self, et: ExifToolHelper) -> bool:
+        try:
+            return et.running
+        except ExifToolException:
+            return False
+
+    # Takes an idle process from the pool. A new process is started if there are none idle and the pool is not full,
+    # otherwise waits for another thread to return one. Dead processes are replaced before being handed out
+    def _acquire(self) -> ExifToolHelper:
+        try:
+            et = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._spawned < self.size
+                if grow:
+                    self._spawned += 1
+            if grow:
+                try:
+                    return self._spawn()
+                except Exception:
+                    with self._lock:
+                        self._spawned -= 1
+                    raise
+            et = self._idle.get()
+        if not self.healthy(et):
+            with self._lock:
+                self.restarts += 1
+            try:
+                et = self._spawn()
+            except Exception:
+                # The slot of the dead process is freed, the next checkout starts a new one
+                with self._lock:
+                    self._spawned -= 1
+                raise
+        return et
+
+    # Returns a process to the pool. Processes that broke while in use are terminated and their slot is freed
+    def _release(self, et: ExifToolHelper, broken: bool) -> None:
+        if not broken:
+            self._idle.put(et)
+            return
+        try:
+            et.terminate()
+        except (ExifToolException, OSError):
+            pass
+        with self._lock:
+            self._spawned -= 1
+            self.restarts += 1
+
+    # Lends an exiftool process to the caller for the duration of the with block
+    @contextmanager
+    def checkout(self):
+        et = self._acquire()
+        with self._lock:
+            self.checkouts += 1
+        broken = False
+        try:
+            yield et
+        except ExifToolExecuteError:
+            # exiftool reported a problem with a file, the process itself is fine
+            raise
+        except (ExifToolException, OSError):
+            broken = True
+            raise
+        finally:
+            self._release(et, broken)
+
+    # Terminates the idle processes. The pool can still be used afterwards, processes are started again on demand
+    def shutdown(self) -> None:
+        while True:
+            try:
+                et = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                et.terminate()
+            except (ExifToolException, OSError):
+                pass
+            with self._lock:
+                self._spawned -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.shutdown()
+
+
+# Yields the given exiftool process, or a short lived one if None was given
+@contextmanager
+def session(et: ExifToolHelper | None = None):
+    if et is not None:
+        yield et
+        return
+    with ExifToolHelper() as et:
+        yield et
@@ -0,0 +1,444 @@
+#!/usr/bin/python
+
+import os
+import re
+import struct
+from datetime import datetime, timedelta, timezone
+from metadata import MetaRecord, format_date
+
+# The number of bytes read from the start of every file. The headers of the supported formats almost always fit into it
+HEAD_SIZE = 64 * 1024
+
+# EXIF/TIFF tags used to identify the file and find the capture date
+TAG_MAKE = 0x010F
+TAG_XMP = 0x02BC
+TAG_EXIF_IFD = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_CREATE_DATE = 0x9004
+TAG_DNG_VERSION = 0xC612
+
+# ISO base media (HEIF) major brands reported as HEIC by exiftool
+HEIC_BRANDS = {b"heic", b"heix", b"heim", b"heis"}
+# QuickTime/ISO base media video major brands and the filetype exiftool reports for them
+VIDEO_BRANDS = {
+    b"qt  ": "mov",
+    b"isom": "mp4",
+    b"iso2": "mp4",
+    b"mp41": "mp4",
+    b"mp42": "mp4",
+    b"avc1": "mp4",
+    b"M4V ": "m4v",
+    b"M4VH": "m4v",
+    b"M4VP": "m4v",
+    b"3gp4": "3gp",
+    b"3gp5": "3gp",
+    b"3gp6": "3gp",
+    b"3g2a": "3g2",
+}
+# Top level atoms old QuickTime files without an ftyp atom may start with
+QUICKTIME_ATOMS = {b"moov", b"mdat", b"wide", b"free", b"skip"}
+# The start of the QuickTime time scale
+QUICKTIME_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+# The key of the capture date in the QuickTime metadata (meta/keys) written by phones and most cameras
+KEY_CREATION_DATE = b"com.apple.quicktime.creationdate"
+ISO_DATE = re.compile(rb"(\d{4})-(\d{2})-(\d{2})")
+
+
+class HeaderError(Exception):
+    pass
+
+
+# Reads parts of a file. The start of the file is kept in memory, reads outside of it seek in the file
+class _Reader:
+    def __init__(self, f) -> None:
+        self.f = f
+        self.head = f.read(HEAD_SIZE)
+        self.size = os.fstat(f.fileno()).st_size
+
+    def read(self, offset: int, length: int) -> bytes:
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise HeaderError(f"Read of {length} bytes at {offset} is out of the file")
+        if offset + length <= len(self.head):
+            return self.head[offset : offset + length]
+        self.f.seek(offset)
+        data = self.f.read(length)
+        if len(data) != length:
+            raise HeaderError(f"Short read of {length} bytes at {offset}")
+        return data
+
+    def unpack(self, fmt: str, offset: int):
+        return struct.unpack(fmt, self.read(offset, struct.calcsize(fmt)))
+
+
+# The tags of a TIFF structure (TIFF files, TIFF based RAWs and EXIF blocks) that are relevant for sorting
+class _Tiff:
+    def __init__(self, make=None, dng=False, xmp=False, original=None, created=None):
+        self.make = make
+        self.dng = dng
+        self.xmp = xmp
+        self.original = original
+        self.created = created
+
+    # The capture date in the YYYY.MM.DD format, None if the structure has no date
+    def date(self) -> str | None:
+        for value in (self.original, self.created):
+            if value:
+                return format_date(value)
+        return None
+
+
+# Reads the entries of an IFD as a tag -> (type, count, value or offset field position) dict
+def _read_ifd(r: _Reader, base: int, offset: int, bo: str) -> dict:
+    (count,) = r.unpack(bo + "H", base + offset)
+    if count > 1000:
+        raise HeaderError(f"Implausible IFD entry count: {count}")
+    entries = {}
+    data = r.read(base + offset + 2, count * 12)
+    for i in range(count):
+        tag, tp, n = struct.unpack(bo + "HHI", data[i * 12 : i * 12 + 8])
+        entries[tag] = (tp, n, base + offset + 2 + i * 12 + 8)
+    return entries
+
+
+# Reads an ASCII or LONG value of an IFD entry
+def _ifd_value(r: _Reader, base: int, entry, bo: str):
+    tp, n, pos = entry
+    if tp == 2:
+        if n <= 4:
+            raw = r.read(pos, n)
+        else:
+            (offset,) = r.unpack(bo + "I", pos)
+            raw = r.read(base + offset, n)
+        return raw.split(b"\0", 1)[0].decode("ascii", "replace").strip()
+    if tp == 4 or tp == 13:
+        return r.unpack(bo + "I", pos)[0]
+    if tp == 3:
+        return r.unpack(bo + "H", pos)[0]
+    return None
+
+
+# Parses a TIFF structure starting at base
+def _parse_tiff(r: _Reader, base: int) -> _Tiff:
+    order = r.read(base, 2)
+    if order == b"II":
+        bo = "<"
+    elif order == b"MM":
+        bo = ">"
+    else:
+        raise HeaderError("Not a TIFF structure")
+    magic, ifd0 = r.unpack(bo + "HI", base + 2)
+    if magic != 42:
+        raise HeaderError(f"Unsupported TIFF variant: {magic}")
+    entries = _read_ifd(r, base, ifd0, bo)
+    tiff = _Tiff(
+        make=_ifd_value(r, base, entries[TAG_MAKE], bo) if TAG_MAKE in entries else None,
+        dng=TAG_DNG_VERSION in entries,
+        xmp=TAG_XMP in entries,
+    )
+    if TAG_EXIF_IFD in entries:
+        exif = _read_ifd(r, base, _ifd_value(r, base, entries[TAG_EXIF_IFD], bo), bo)
+        if TAG_DATE_TIME_ORIGINAL in exif:
+            tiff.original = _ifd_value(r, base, exif[TAG_DATE_TIME_ORIGINAL], bo)
+        if TAG_CREATE_DATE in exif:
+            tiff.created = _ifd_value(r, base, exif[TAG_CREATE_DATE], bo)
+    return tiff
+
+
+# Builds the record from the parsed EXIF. If DateTimeOriginal is missing but the file has metadata this reader
+# does not parse (e.g. XMP), exiftool could still find a date there, so the file is left to exiftool
+def _record(filetype: str, tiff: _Tiff | None, other_metadata: bool) -> MetaRecord | None:
+    if tiff is not None and tiff.original:
+        return MetaRecord(filetype, tiff.date())
+    if other_metadata:
+        return None
+    return MetaRecord(filetype, tiff.date() if tiff is not None else None)
+
+
+def _read_jpeg(r: _Reader, path: str) -> MetaRecord | None:
+    tiff = None
+    other = False
+    pos = 2
+    while True:
+        marker = r.read(pos, 2)
+        if marker[0] != 0xFF:
+            raise HeaderError("Invalid JPEG marker")
+        if marker[1] == 0xFF:
+            pos += 1
+            continue
+        if marker[1] in (0xD9, 0xDA):
+            # End of image or start of the scan, there are no more headers
+            break
+        if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+            pos += 2
+            continue
+        (length,) = r.unpack(">H", pos + 2)
+        if marker[1] == 0xE1:
+            ident = r.read(pos + 4, min(length - 2, 29))
+            if ident.startswith(b"Exif\0") and tiff is None:
+                tiff = _parse_tiff(r, pos + 10)
+            elif ident.startswith(b"http://ns.adobe.com/xap/1.0/"):
+                other = True
+        elif marker[1] == 0xE2 and r.read(pos + 4, min(length - 2, 4)) == b"MPF\0":
+            # exiftool reports multi picture JPEGs as MPO
+            return None
+        pos += 2 + length
+    return _record("jpeg", tiff, other)
+
+
+def _read_png(r: _Reader, path: str) -> MetaRecord | None:
+    tiff = None
+    other = False
+    pos = 8
+    while pos + 8 <= r.size:
+        length, ctype = r.unpack(">I4s", pos)
+        if ctype in (b"IDAT", b"IEND"):
+            break
+        if ctype == b"eXIf":
+            tiff = _parse_tiff(r, pos + 8)
+        elif ctype in (b"iTXt", b"zTXt", b"tEXt"):
+            keyword = r.read(pos + 8, min(length, 40)).split(b"\0", 1)[0]
+            if keyword == b"XML:com.adobe.xmp" or keyword.startswith(b"Raw profile type"):
+                other = True
+        pos += 12 + length
+    return _record("png", tiff, other)
+
+
+# Walks the boxes of an ISO base media structure between start and end, yielding (type, payload start, box end)
+def _boxes(r: _Reader, start: int, end: int):
+    pos = start
+    while pos + 8 <= end:
+        size, btype = r.unpack(">I4s", pos)
+        header = 8
+        if size == 1:
+            (size,) = r.unpack(">Q", pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise HeaderError(f"Invalid box size of {btype}")
+        yield btype, pos + header, pos + size
+        pos += size
+
+
+# Reads an unsigned big endian integer of the given byte size
+def _uint(r: _Reader, offset: int, size: int) -> int:
+    if size == 0:
+        return 0
+    return int.from_bytes(r.read(offset, size), "big")
+
+
+# Finds the file offset of the Exif item of a HEIF meta box, None if it has none
+def _heif_exif(r: _Reader, start: int, end: int):
+    exif_id = None
+    other = False
+    locations = {}
+    for btype, pstart, pend in _boxes(r, start + 4, end):
+        if btype == b"iinf":
+            version = r.read(pstart, 1)[0]
+            count_size = 2 if version == 0 else 4
+            first = pstart + 4 + count_size
+            for itype, istart, _ in _boxes(r, first, pend):
+                if itype != b"infe":
+                    continue
+                iversion = r.read(istart, 1)[0]
+                if iversion < 2:
+                    continue
+                id_size = 2 if iversion == 2 else 4
+                item_id = _uint(r, istart + 4, id_size)
+                item_type = r.read(istart + 4 + id_size + 2, 4)
+                if item_type == b"Exif":
+                    exif_id = item_id
+                elif item_type == b"mime":
+                    other = True
+        elif btype == b"iloc":
+            version = r.read(pstart, 1)[0]
+            sizes = r.read(pstart + 4, 2)
+            offset_size, length_size = sizes[0] >> 4, sizes[0] & 0xF
+            base_size = sizes[1] >> 4
+            index_size = sizes[1] & 0xF if version in (1, 2) else 0
+            id_size = 2 if version < 2 else 4
+            count = _uint(r, pstart + 6, id_size)
+            pos = pstart + 6 + id_size
+            for _ in range(count):
+                item_id = _uint(r, pos, id_size)
+                pos += id_size
+                method = 0
+                if version in (1, 2):
+                    method = _uint(r, pos, 2) & 0xF
+                    pos += 2
+                pos += 2  # data reference index
+                base = _uint(r, pos, base_size)
+                pos += base_size
+                extents = _uint(r, pos, 2)
+                pos += 2
+                first = None
+                for _ in range(extents):
+                    pos += index_size
+                    offset = _uint(r, pos, offset_size)
+                    pos += offset_size + length_size
+                    if first is None:
+                        first = offset
+                if method == 0 and first is not None:
+                    locations[item_id] = base + first
+    if exif_id is None or exif_id not in locations:
+        return None, other
+    return locations[exif_id], other
+
+
+def _read_heic(r: _Reader, path: str) -> MetaRecord | None:
+    tiff = None
+    other = False
+    for btype, pstart, pend in _boxes(r, 0, r.size):
+        if btype == b"meta":
+            offset, other = _heif_exif(r, pstart, pend)
+            if offset is not None:
+                # The Exif item starts with the offset of the TIFF header from the end of this field
+                (skip,) = r.unpack(">I", offset)
+                tiff = _parse_tiff(r, offset + 4 + skip)
+            break
+    return _record("heic", tiff, other)
+
+
+# Finds the child box of the given type, returns its (payload start, end) or None
+def _child(r: _Reader, start: int, end: int, btype: bytes):
+    for ctype, cstart, cend in _boxes(r, start, end):
+        if ctype == btype:
+            return cstart, cend
+    return None
+
+
+# Reads the creation date of a meta atom's keys/ilst pair, None if it has none
+def _quicktime_keys_date(r: _Reader, start: int, end: int) -> str | None:
+    # In QuickTime files the meta atom is a plain container, in ISO files it is a full box with a version and flags
+    if r.read(start + 4, 4) != b"hdlr":
+        start += 4
+    keys = _child(r, start, end, b"keys")
+    items = _child(r, start, end, b"ilst")
+    if keys is None or items is None:
+        return None
+    (count,) = r.unpack(">I", keys[0] + 4)
+    pos = keys[0] + 8
+    index = None
+    for i in range(1, count + 1):
+        (size,) = r.unpack(">I", pos)
+        if size < 8:
+            return None
+        if r.read(pos + 8, size - 8) == KEY_CREATION_DATE:
+            index = i
+            break
+        pos += size
+    if index is None:
+        return None
+    for itype, istart, iend in _boxes(r, items[0], items[1]):
+        if int.from_bytes(itype, "big") != index:
+            continue
+        data = _child(r, istart, iend, b"data")
+        if data is None:
+            return None
+        # The value follows the type indicator and the locale
+        match = ISO_DATE.match(r.read(data[0] + 8, min(data[1] - data[0] - 8, 32)))
+        if match is None:
+            return None
+        return b".".join(match.groups()).decode()
+    return None
+
+
+# Reads the creation time of the movie header (mvhd), None if it is not set. A time beyond the year 9999 raises HeaderError
+def _mvhd_date(r: _Reader, start: int) -> str | None:
+    if r.read(start, 1)[0] == 1:
+        (seconds,) = r.unpack(">Q", start + 4)
+    else:
+        (seconds,) = r.unpack(">I", start + 4)
+    if seconds == 0:
+        return None
+    try:
+        return datetime.strftime(QUICKTIME_EPOCH + timedelta(seconds=seconds), "%Y.%m.%d")
+    except (OverflowError, ValueError):
+        # A corrupt header, exiftool may still find a date elsewhere
+        raise HeaderError(f"Invalid movie header creation time: {seconds}")
+
+
+# Reads QuickTime/MP4 videos. Only the atom headers on the way to moov are read, the media data (mdat) is skipped by seeking.
+# The date recorded in the metadata keys is local time and is preferred, the movie header's creation time (UTC) is used otherwise
+def _read_quicktime(r: _Reader, path: str) -> MetaRecord | None:
+    if r.head[4:8] == b"ftyp":
+        filetype = VIDEO_BRANDS[r.head[8:12]]
+    elif os.path.splitext(path)[1].lower() == ".mov":
+        filetype = "mov"
+    else:
+        return None
+    moov = _child(r, 0, r.size, b"moov")
+    if moov is None:
+        return MetaRecord(filetype)
+    created = None
+    for btype, start, end in _boxes(r, moov[0], moov[1]):
+        if btype == b"meta":
+            date = _quicktime_keys_date(r, start, end)
+        elif btype == b"udta":
+            meta = _child(r, start, end, b"meta")
+            date = None if meta is None else _quicktime_keys_date(r, *meta)
+        elif btype == b"mvhd":
+            created = _mvhd_date(r, start)
+            continue
+        else:
+            continue
+        if date is not None:
+            return MetaRecord(filetype, date)
+    return MetaRecord(filetype, created)
+
+
+# Identifies TIFF based files. Only the formats exiftool is known to report the same way are handled,
+# the rest (other RAW formats) are left to exiftool
+def _read_tiff(r: _Reader, path: str) -> MetaRecord | None:
+    tiff = _parse_tiff(r, 0)
+    ext = os.path.splitext(path)[1].lower()
+    make = (tiff.make or "").upper()
+    if r.read(8, 2) == b"CR":
+        filetype = "cr2"
+    elif tiff.dng:
+        filetype = "dng"
+    elif make.startswith("NIKON") and ext == ".nef":
+        filetype = "nef"
+    elif make.startswith("SONY") and ext == ".arw":
+        filetype = "arw"
+    elif ext in (".tif", ".tiff"):
+        filetype = "tiff"
+    else:
+        return None
+    return _record(filetype, tiff, tiff.xmp)
+
+
+# Selects the parser of a file by its first bytes
+def _parser(head: bytes):
+    if head[:3] == b"\xff\xd8\xff":
+        return _read_jpeg
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return _read_png
+    if head[:4] in (b"II*\0", b"MM\0*"):
+        return _read_tiff
+    if head[4:8] == b"ftyp" and head[8:12] in HEIC_BRANDS:
+        return _read_heic
+    if head[4:8] == b"ftyp" and head[8:12] in VIDEO_BRANDS:
+        return _read_quicktime
+    if head[4:8] in QUICKTIME_ATOMS:
+        return _read_quicktime
+    return None
+
+
+# Reads the filetype and capture date of an image or video from its headers, without exiftool.
+# Returns the same values as whatType and getExifDate would, or None if the file has to be read by exiftool
+def read_header(path: str) -> MetaRecord | None:
+    try:
+        with open(path, "rb") as f:
+            r = _Reader(f)
+            parser = _parser(r.head[:16])
+            if parser is None:
+                return None
+            return parser(r, path)
+    except (OSError, HeaderError, struct.error, KeyError, TypeError, IndexError, OverflowError, ValueError):
+        return None
+
+
+# Reads the headers of multiple files. Files that could not be handled are mapped to None
+def read_headers(files: list[str]) -> dict[str, MetaRecord | None]:
+    return {f: read_header(f) for f in files}
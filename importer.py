@@ -1,25 +1,127 @@
 #!/usr/bin/python
 
 import os
-from more_itertools import grouper
-from datetime import datetime
 import shutil
-import concurrent.futures
-from exiftool import ExifToolHelper
+from aio import importAsync
+import sqlite3
+import threading
+import time
+from collections import ChainMap
 from exiftool.exceptions import ExifToolExecuteError
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+from discovery import REJECT_ACTIONS, DiscoveryFilter
+from duplicates import DUPLICATE_MODES, DuplicateIndex, uniqueName
+from exifpool import ExifToolPool, session
+from instrumentation import Metrics
+from journal import JOURNAL_NAME, Journal, journalPath, recover, replay
+from metacache import DEFAULT_CACHE_PATH, MetadataCache
+from offload import BACKENDS, Offload
+from metadata import (
+    DATE_TAGS,
+    METADATA_MODES,
+    MetaRecord,
+    date_from_tags,
+    extension_type,
+    read_batch,
+    today,
+)
+from pipeline import AdaptiveController, Pipeline, Stage
+from resolvers import DATE_SOURCES, MODE_CHAINS, DateResolver
+from scheduler import SCHEDULE_POLICIES, DeviceLimiter, schedule
+from sidecars import groupFiles
+from plan import PlanEntry, PlanError, PlanWriter, readPlan, readPlanHeader
+from transfer import DEFAULT_BUFFER_SIZE, PARTIAL_SUFFIX, TransferEngine, VerificationError
+from watcher import WATCH_BACKENDS, WatchError, Watcher
 
 
 class NotFoundException(Exception):
     pass
 
 
+# The size of a file given as a path or an os.DirEntry, 0 if it can not be read
+def fileSize(f) -> int:
+    try:
+        return f.stat().st_size if isinstance(f, os.DirEntry) else os.stat(f).st_size
+    except OSError:
+        return 0
+
+
 @dataclass
 class Options:
     source: str
     destination: str
     recursive: bool = field(default=False)
     force_overwrite: bool = field(default=False)
+    exiftool_workers: int = field(default=4)
+    metadata_batch_size: int = field(default=200)
+    # Where the metadata is read from, one of metadata.METADATA_MODES
+    metadata_mode: str = field(default="hybrid")
+    # The location of the persistent metadata cache, None disables the cache
+    cache_path: str | None = field(default=DEFAULT_CACHE_PATH)
+    cache_max_entries: int = field(default=1_000_000)
+    # The number of worker threads of the import stages and the size of the queues between them
+    metadata_workers: int = field(default=4)
+    plan_workers: int = field(default=1)
+    move_workers: int = field(default=4)
+    queue_size: int = field(default=256)
+    # If set, the number of metadata and move workers is tuned while importing, within min_workers and max_workers
+    auto_tune: bool = field(default=False)
+    min_workers: int = field(default=1)
+    max_workers: int = field(default=16)
+    # The buffer used when files have to be copied to another device, and the number of copies synced to the disk at once (0 disables syncing)
+    copy_buffer_size: int = field(default=DEFAULT_BUFFER_SIZE)
+    fsync_batch: int = field(default=64)
+    # If set the files are copied and the sources are left untouched
+    keep_source: bool = field(default=False)
+    # If set every copy is checksummed while written and read back to check that it is intact
+    verify: bool = field(default=False)
+    # What to do with files that are already in the destination, one of duplicates.DUPLICATE_MODES
+    duplicates: str = field(default="import")
+    duplicate_workers: int = field(default=2)
+    # If set the import is journaled into the destination, so that it can be resumed if it is interrupted
+    journal: bool = field(default=True)
+    # If set only the files an interrupted import left behind are imported (see journal.recover)
+    resume: bool = field(default=False)
+    # If set nothing is moved, the planned moves are written to this file instead (see plan.py)
+    plan_path: str | None = field(default=None)
+    # If set the moves of this plan file are executed instead of searching the source
+    execute_plan: str | None = field(default=None)
+    # The order the source files are processed in, one of scheduler.SCHEDULE_POLICIES, and the number of files ordered at a time
+    schedule: str = field(default="walk")
+    schedule_window: int = field(default=10_000)
+    # The number of files of the same source device moved at the same time, 0 means no limit (only move_workers)
+    device_workers: int = field(default=0)
+    # Where header parsing and hashing run, one of offload.BACKENDS, and the number of worker processes (0 means one per CPU)
+    backend: str = field(default="thread")
+    process_workers: int = field(default=0)
+    # The number of metadata reads and moves in flight at the same time in import_async
+    async_concurrency: int = field(default=8)
+    # If set a summary of the metrics collected during the import (see instrumentation.py) is reported at the end
+    profile: bool = field(default=False)
+    # If set the metrics are written to this file as JSON, or in the Prometheus text format (for the textfile collector of the node exporter)
+    metrics_json: str | None = field(default=None)
+    metrics_textfile: str | None = field(default=None)
+    # If set the source is watched and new files are imported once they did not change for settle seconds (see watcher.py).
+    # The import runs until it is stopped
+    watch: bool = field(default=False)
+    settle: float = field(default=5.0)
+    # The longest time between two checks of the source, and how its changes are noticed, one of watcher.WATCH_BACKENDS
+    watch_interval: float = field(default=1.0)
+    watch_backend: str = field(default="auto")
+    # The files discovery accepts (see discovery.DiscoveryFilter): globs the file names must (include) or must not (exclude) match,
+    # size limits in bytes (0 means no limit), and whether the first bytes of the files must look like media
+    include: tuple[str, ...] = field(default=())
+    exclude: tuple[str, ...] = field(default=())
+    min_size: int = field(default=0)
+    max_size: int = field(default=0)
+    sniff: bool = field(default=False)
+    # What happens with the rejected files, one of discovery.REJECT_ACTIONS
+    rejected: str = field(default="skip")
+    # The sources the capture dates are resolved from, in order (see resolvers.DATE_SOURCES). None means the chain of metadata_mode
+    date_chain: tuple[str, ...] | None = field(default=None)
+    # If set files of the same directory and name (IMG_0001.CR3, IMG_0001.JPG, IMG_0001.xmp) are imported as a group (see sidecars.py):
+    # the date is resolved once for the group and all of its files go under the same date, the sidecars next to the RAW
+    group_sidecars: bool = field(default=False)
 
 
 class Importer:
@@ -28,8 +130,23 @@ class Importer:
         self.new_copied_event = MsgEvent()
         self.copy_failed_event = MsgEvent()
         self.copy_done_event = MsgEvent()
+        # Called with the list of the paths found, once searching for files has finished
         self.collected_files_event = MsgEvent()
+        # Called with the number of files found so far while searching for files
+        self.found_files_event = MsgEvent()
+        # Called with the source and the file it is a duplicate of
+        self.duplicate_event = MsgEvent()
         self.completed_event = MsgEvent()
+        self.exiftool_pool = ExifToolPool()
+        self.offload = Offload()
+        self.metadata_cache = None
+        self.journal = None
+        # The metrics of the last import
+        self.metrics = Metrics()
+        # The filter the discovered files go through, if any
+        self.discovery = None
+        # The date resolver of the running import. If None the chain of the metadata mode passed to readMetadata is used
+        self.resolver = None
         self.stop = False
 
     dataclass(slots=True, frozen=True)
@@ -52,31 +169,80 @@ class Importer:
             self.copy_failed_event = copy_failed_event
             self.copy_done_event = copy_done_event
             self.collected_files_event = collected_files_event
+            # The size of the source file in bytes, if known. Used for the throughput statistics
+            self.size = 0
+            # The name of the file in the destination
+            self.name = os.path.basename(src)
+            # The journal the progress of the file is written to, if any
+            self.journal = None
+            # The metadata the destination was planned with
+            self.record = None
+            # The metrics the duration and outcome of the move are recorded in, if any
+            self.metrics = None
 
         # Moves a file from self.src to a previously calculated self.dst.
-        def Move(self, force):
+        # If a TransferEngine is given it moves the file (renaming it on the same device, copying it otherwise) or copies it, if it keeps the sources.
+        # Returns True if the file was moved
+        def Move(self, force, transfer: TransferEngine | None = None):
+            start = time.perf_counter()
+            moved = False
             newname = self.dst
-            if force:
-                newname = os.path.join(self.dst, os.path.basename(self.src))
+            if force or transfer is not None or self.name != os.path.basename(self.src):
+                newname = os.path.join(self.dst, self.name)
             try:
                 self.new_copied_event.__call__(self.src, newname)
-                shutil.move(self.src, newname)
+                if self.journal is not None:
+                    self.journal.started(self.src, newname)
+                self.relocate(newname, force, transfer)
                 self.copy_done_event.__call__(self.src, newname)
+                self.journaled(newname)
+                moved = True
+            except FileExistsError as e:
+                self.events.__call__(2, f"\33[1;31m{e}\33[1;0m")
+                self.copy_failed_event.__call__(self.src, str(e))
+                # The name stays taken, resuming the import could not move the file either
+                if self.journal is not None:
+                    self.journal.skipped(self.src, str(e))
+            except VerificationError as e:
+                self.verificationFailed(e)
             except IOError as e:
-                self.events.__call__(2, str(e))
-                if e.strerror == "Not a directory":
-                    self.events.__call__(2, f"\33[1;31m{e}\33[1;0m")
-                    self.copy_failed_event.__call__(self.dst, str(e))
-                    return
-                self.events.__call__(
-                    2,
-                    f'\33[1;32m"{self.dst}" directory not found.\33[1;0m Creating directory by the same name',
-                )
-                self.copy_failed_event.__call__(e.args[0], "")
-                os.makedirs(self.dst)
+                self.events.__call__(2, f"\33[1;31m{e}\33[1;0m")
+                self.copy_failed_event.__call__(self.src, str(e))
+                self.journaled(newname, e)
+            if self.metrics is not None:
+                self.metrics.observe("move_seconds", time.perf_counter() - start)
+                if moved:
+                    self.metrics.count("moved_files")
+                    self.metrics.count("moved_bytes", self.size)
+                else:
+                    self.metrics.count("failed_files")
+            return moved
+
+        # Reports a copy that did not match its source
+        def verificationFailed(self, e: VerificationError):
+            self.events.__call__(3, str(e))
+            self.copy_failed_event.__call__(self.src, str(e))
+            self.journaled(e.dst, e)
+
+        # Writes the outcome of the move to the journal: completed, or failed if an error is given
+        def journaled(self, newname, error: Exception | None = None):
+            if self.journal is None:
+                return
+            if error is None:
+                self.journal.completed(self.src, newname)
+            else:
+                self.journal.failed(self.src, str(error))
+
+        # Moves the file to newname. The directory it goes to is created first, if it does not exist yet
+        def relocate(self, newname, force, transfer: TransferEngine | None):
+            if transfer is None:
+                os.makedirs(self.dst, exist_ok=True)
                 shutil.move(self.src, newname)
+            else:
+                transfer.place(self.src, newname, force)
 
         # Initialises a FromTo instance and returns it. It is used to convert arguments to formats expected by __init__
+        # If the metadata of the file was already read (see metadata.read_batch) it can be passed as record, otherwise it is read here
         def initExif(
             src,
             dst,
@@ -85,31 +251,63 @@ class Importer:
             copy_failed_event,
             copy_done_event,
             collected_files_event,
+            et=None,
+            record: MetaRecord | None = None,
         ):
-            return Importer.FromTo(
+            if record is None:
+                filetype = Importer.FromTo.whatType(src, et)
+                date = Importer.FromTo.getExifDate(src, et)
+            else:
+                filetype = record.filetype
+                date = record.dateDir()
+            fromTo = Importer.FromTo(
                 src,
-                os.path.join(
-                    dst,
-                    Importer.FromTo.whatType(src),
-                    f"{Importer.FromTo.getExifDate(src)}/",
-                ),
+                os.path.join(dst, filetype, f"{date}/"),
                 events,
                 new_copied_event,
                 copy_failed_event,
                 copy_done_event,
                 collected_files_event,
             )
+            fromTo.record = MetaRecord(filetype, date)
+            return fromTo
 
-        # Gets the filetype. It is used to get the filetype directory name
-        def whatType(img):
+        # Initialises a FromTo instance from an entry of an import plan
+        def fromPlan(
+            entry: PlanEntry,
+            events,
+            new_copied_event,
+            copy_failed_event,
+            copy_done_event,
+            collected_files_event,
+        ):
+            fromTo = Importer.FromTo(
+                entry.src,
+                entry.dst,
+                events,
+                new_copied_event,
+                copy_failed_event,
+                copy_done_event,
+                collected_files_event,
+            )
+            fromTo.name = entry.name
+            fromTo.size = entry.size
+            fromTo.record = MetaRecord(entry.filetype, entry.date)
+            return fromTo
+
+        # The plan entry of the move
+        def planEntry(self) -> PlanEntry:
+            return PlanEntry(
+                self.src, self.dst, self.name, self.record.filetype, self.record.dateDir(), self.size
+            )
+
+        # Gets the filetype. It is used to get the filetype directory name. If et is not given a new exiftool process is started
+        def whatType(img, et=None):
             try:
-                with ExifToolHelper() as et:
+                with session(et) as et:
                     return et.get_metadata(img)[0]["File:FileType"].lower()
             except (KeyError, ExifToolExecuteError):
-                tp = img.split(".")
-                if len(tp) and len(tp[-1]) < 6:
-                    return tp[-1].lower()
-                return "misc"
+                return extension_type(img)
 
         # Gets the tag value (specified by the rag argument) of a meta exiftool metadata object
         def getTagVal(meta, tag):
@@ -120,101 +318,688 @@ class Importer:
             raise NotFoundException(tag + " was not found")
 
         # Gets the date the file was created on using exiftool. If a suitable tag is not found, the current date is returned in the YYYY.MM.DD format
-        def getExifDate(img):
+        def getExifDate(img, et=None):
             try:
-                with ExifToolHelper() as et:
-                    out = et.get_tags(
-                        files=[img], tags=["DateTimeOriginal", "CreateDate"]
-                    )
-                    return Importer.FromTo.getTagVal(out, "DateTimeOriginal")[
-                        0:10
-                    ].replace(":", ".")
+                with session(et) as et:
+                    out = et.get_tags(files=[img], tags=DATE_TAGS)
             except ExifToolExecuteError:
-                return datetime.strftime(datetime.now(), "%Y.%m.%d")
-
-    # Moves a collection of images to the specified directory. The new path of the files will be: destination/filetype/file creation date/ original file name
-    def moveImages(self, srcImg, dst: str, force: bool):
-        for img in srcImg:
-            if self.stop:
-                break
-            Importer.FromTo.initExif(
-                img,
-                dst,
-                self.events,
-                self.new_copied_event,
-                self.copy_failed_event,
-                self.copy_done_event,
-                self.collected_files_event,
-            ).Move(force)
+                return today()
+            date = date_from_tags(out[0])
+            if date is None:
+                return today()
+            return date
+
+    # Reads the metadata of a collection of files, given as paths or os.DirEntry objects. The records are keyed by path.
+    # Files that are in the metadata cache unchanged are not read again.
+    # The capture dates are resolved by the sources of the date resolution chain (see resolvers.py), the cheapest first.
+    # Unless a chain is configured it follows the mode: the fast and hybrid modes parse the headers of the common formats in python,
+    # the hybrid and exiftool modes use exiftool for the rest
+    def readMetadata(self, files, mode: str = "hybrid"):
+        resolution, stats, missing = self.readKnownMetadata(files, mode)
+        if missing:
+            # The metadata of the rest of the collection is read with a single exiftool call
+            # The exiftool process is only held while reading the metadata, not while the files are moved
+            with self.metrics.timer("metadata_seconds", source="exiftool"):
+                with self.exiftool_pool.checkout() as et:
+                    resolution.add(read_batch(et, missing), "exiftool")
+            self.metrics.count("exiftool_calls")
+            self.metrics.count("metadata_files", len(missing), source="exiftool")
+        return self.completeMetadata(resolution, stats)
+
+    # The first half of readMetadata: looks the files up in the cache and runs the sources of the chain before exiftool.
+    # Returns the resolution (see resolvers.Resolution), the stats of the files and the paths that still need exiftool
+    def readKnownMetadata(self, files, mode: str = "hybrid"):
+        if mode not in METADATA_MODES:
+            raise ValueError(f"Unknown metadata mode: {mode}")
+        paths = [os.fspath(f) for f in files]
+        cached = {}
+        stats = {}
+        if self.metadata_cache is not None:
+            for f in files:
+                try:
+                    # DirEntry objects coming from discovery already know their stat on most platforms
+                    st = f.stat() if isinstance(f, os.DirEntry) else os.stat(f)
+                except OSError:
+                    continue
+                stats[os.fspath(f)] = st
+            cached = self.metadata_cache.get_many(stats)
+            self.metrics.count("metadata_files", len(cached), source="cache")
+        resolver = self.resolver
+        if resolver is None:
+            resolver = DateResolver(MODE_CHAINS[mode], self.metrics)
+        resolution, missing = resolver.start(paths, self.readHeaders, cached)
+        return resolution, stats, missing
+
+    # Parses the headers of files (see headers.read_headers)
+    def readHeaders(self, paths):
+        with self.metrics.timer("metadata_seconds", source="headers"):
+            records = self.offload.readHeaders(paths)
+        self.metrics.count("metadata_files", sum(1 for r in records.values() if r is not None), source="headers")
+        return records
+
+    # The second half of readMetadata: caches the records that were read and runs the sources of the chain after exiftool
+    def completeMetadata(self, resolution, stats):
+        if self.metadata_cache is not None:
+            # Dates from the other sources are not cached, they are cheap to resolve again and a later run with another chain may date the files differently
+            self.metadata_cache.put_many(resolution.read, stats)
+        return resolution.resolver.finish(resolution)
 
     # Moves a collection of images concurrently to the specified directory. The new path follows the destination/filetype/file creation data/original filename  pattern
-    def importImages(self, destination: str, files: list[str], force):
+    # files can be any iterable (e.g. the generator returned by GetFiles), the first files are moved while the rest are still being collected.
+    # The files go through a pipeline of stages: metadata -> plan -> (duplicates) -> move. Every stage has its own workers (set in options),
+    # so reading metadata and moving files overlap and a slow file only holds up a single worker.
+    # known maps the paths of files whose metadata is already known (e.g. from a journal) to their records, those are not read again.
+    # If a PlanWriter is given as plan nothing is moved, the planned moves are written to it instead.
+    # The destination is indexed for duplicate detection unless an index is given as duplicates (see duplicateIndex)
+    def importImages(
+        self,
+        destination: str,
+        files,
+        force,
+        options: Options | None = None,
+        known: dict[str, MetaRecord] | None = None,
+        plan: PlanWriter | None = None,
+        duplicates: DuplicateIndex | None = None,
+    ):
+        if options is None:
+            options = Options(source="", destination=destination, force_overwrite=force)
+        if options.duplicates not in DUPLICATE_MODES:
+            raise ValueError(f"Unknown duplicate mode: {options.duplicates}")
+        if options.schedule not in SCHEDULE_POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {options.schedule}")
         if destination[-1] != "/":
             destination += "/"
-        try:
-            if not files:
-                raise ValueError("No files selected for import")
-            # Create concurrent threads
-            executor = concurrent.futures.ThreadPoolExecutor(10)
-            futures = [
-                executor.submit(self.moveImages, group, destination, force)
-                # Divides the collection into groups of 5 (at most)
-                for group in grouper(files, 5)
+        if options.duplicates == "import":
+            duplicates = None
+        elif duplicates is None:
+            duplicates = self.duplicateIndex(destination, options)
+        if duplicates is not None:
+            # The index may be shared by several imports, only the work of this one is reported
+            counted = (duplicates.matches, duplicates.quick_hashes, duplicates.full_hashes)
+
+        known = known or {}
+        if self.discovery is not None and self.discovery.action == "misc":
+            # The records of the rejected files are added while the files are discovered
+            known = ChainMap(known, self.discovery.routed)
+
+        def recordsOf(files):
+            unknown = [f for f in files if os.fspath(f) not in known]
+            records = self.readMetadata(unknown, options.metadata_mode) if unknown else {}
+            records.update((os.fspath(f), known[os.fspath(f)]) for f in files if os.fspath(f) in known)
+            return records
+
+        def readStage(batch):
+            records = recordsOf(batch)
+            return [(os.fspath(f), records[os.fspath(f)], fileSize(f)) for f in batch]
+
+        # The metadata of a group is read from its probe only. The other media files of a group are only read if the probe has no date
+        def readGroupStage(batch):
+            records = recordsOf([group.probe for group in batch])
+            undated = [f for group in batch if records[os.fspath(group)].date is None for f in group.others()]
+            fallback = recordsOf(undated) if undated else {}
+            read = []
+            for group in batch:
+                record = records[os.fspath(group)]
+                date = record.date
+                for f in group.others() if date is None else ():
+                    date = fallback[os.fspath(f)].date
+                    if date is not None:
+                        break
+                for f, (src, member) in zip(group.members, group.records(record, date)):
+                    read.append((src, member, fileSize(f)))
+            self.metrics.count("files_grouped", sum(len(group.members) - 1 for group in batch))
+            return read
+
+        def planStage(batch):
+            planned = []
+            for src, record, size in batch:
+                fromTo = Importer.FromTo.initExif(
+                    src,
+                    destination,
+                    self.events,
+                    self.new_copied_event,
+                    self.copy_failed_event,
+                    self.copy_done_event,
+                    self.collected_files_event,
+                    record=record,
+                )
+                fromTo.size = size
+                fromTo.journal = self.journal
+                fromTo.metrics = self.metrics
+                if self.journal is not None:
+                    self.journal.planned(src, fromTo.record)
+                planned.append(fromTo)
+            return planned
+
+        def duplicateStage(batch):
+            kept = []
+            for fromTo in batch:
+                # Later files of this import with the same content are duplicates of this one
+                match = duplicates.findOrAdd(fromTo.src, fromTo.size, os.path.join(fromTo.dst, fromTo.name))
+                if match is None:
+                    kept.append(fromTo)
+                    continue
+                self.duplicate_event.__call__(fromTo.src, match)
+                if options.duplicates == "skip":
+                    self.events.__call__(2, f"Skipping '{fromTo.src}', it is a duplicate of '{match}'")
+                    continue
+                fromTo.name = uniqueName(fromTo.dst, fromTo.name)
+                self.events.__call__(
+                    2, f"'{fromTo.src}' is a duplicate of '{match}', importing it as '{fromTo.name}'"
+                )
+                kept.append(fromTo)
+            return kept
+
+        def writeStage(batch):
+            for fromTo in batch:
+                plan.add(fromTo.planEntry())
+
+        stages = [
+            Stage(
+                "metadata",
+                readGroupStage if options.group_sidecars else readStage,
+                options.metadata_workers,
+                options.metadata_batch_size,
+                options.queue_size,
+            ),
+            Stage("plan", planStage, options.plan_workers, 64, options.queue_size),
+        ]
+        if duplicates is not None:
+            stages.append(
+                Stage(
+                    "duplicates",
+                    duplicateStage,
+                    options.duplicate_workers,
+                    16,
+                    options.queue_size,
+                )
+            )
+        if options.group_sidecars:
+            # Files whose record is known (routed to misc, or planned before the import was interrupted) are not grouped
+            files = groupFiles(files, single=lambda f: os.fspath(f) in known)
+        if options.schedule != "walk":
+            self.events.__call__(1, f"Ordering the source files by {options.schedule}")
+        files = schedule(files, options.schedule, options.schedule_window)
+        if plan is not None:
+            stages.append(Stage("write", writeStage, 1, 64, options.queue_size))
+            result = self.runStages(files, stages, options)
+            self.events.__call__(1, f"Planned {plan.count} moves into '{plan.path}'")
+        else:
+            result = self.runStages(files, stages, options, destination, force)
+        if duplicates is not None:
+            matches, quick_hashes, full_hashes = (
+                duplicates.matches - counted[0],
+                duplicates.quick_hashes - counted[1],
+                duplicates.full_hashes - counted[2],
+            )
+            self.events.__call__(
+                1,
+                f"Found {matches} duplicates ({quick_hashes} quick hashes, {full_hashes} full hashes)",
+            )
+        return result
+
+    # Indexes the files of the destination for duplicate detection
+    def duplicateIndex(self, destination: str, options: Options) -> DuplicateIndex:
+        start = time.perf_counter()
+        duplicates = DuplicateIndex(
+            buffer_size=options.copy_buffer_size,
+            quick_hash=self.offload.quickHash,
+            hash_file=self.offload.hashFile,
+        )
+        indexed = duplicates.build(destination, exclude=(JOURNAL_NAME,))
+        self.events.__call__(
+            1,
+            f"Indexed {indexed} files of the destination in {time.perf_counter() - start:.2f}s",
+        )
+        return duplicates
+
+    # Executes the moves of an import plan written by importImages. Files that changed or disappeared since they were planned are skipped
+    def executePlan(self, path: str, force, options: Options, done: set[str] | None = None):
+        done = done or set()
+        destination = options.destination
+        if destination[-1] != "/":
+            destination += "/"
+
+        def entries():
+            count = 0
+            collected = [] if self.collected_files_event.eventSubs else None
+            for entry in readPlan(path):
+                count += 1
+                if collected is not None:
+                    collected.append(entry.src)
+                if entry.src not in done:
+                    yield entry
+            self.found_files_event.__call__(count)
+            if collected is not None:
+                self.collected_files_event.__call__(collected)
+
+        def checkStage(batch):
+            checked = []
+            for entry in batch:
+                size = fileSize(entry.src) if os.path.lexists(entry.src) else None
+                if size != entry.size:
+                    reason = "it no longer exists" if size is None else "it changed since it was planned"
+                    self.events.__call__(2, f"Skipping '{entry.src}', {reason}")
+                    self.copy_failed_event.__call__(entry.src, reason)
+                    continue
+                fromTo = Importer.FromTo.fromPlan(
+                    entry,
+                    self.events,
+                    self.new_copied_event,
+                    self.copy_failed_event,
+                    self.copy_done_event,
+                    self.collected_files_event,
+                )
+                fromTo.journal = self.journal
+                fromTo.metrics = self.metrics
+                if self.journal is not None:
+                    self.journal.planned(entry.src, fromTo.record)
+                checked.append(fromTo)
+            return checked
+
+        stages = [Stage("check", checkStage, options.plan_workers, 64, options.queue_size)]
+        return self.runStages(entries(), stages, options, destination, force, source_name="plan")
+
+    # Runs files through stages followed by a move stage (unless destination is None) and reports the statistics.
+    # Returns 0 on success, 1 if a stage reported errors and 2 if there were no files
+    def runStages(
+        self,
+        files,
+        stages: list[Stage],
+        options: Options,
+        destination: str | None = None,
+        force=False,
+        source_name: str = "discover",
+    ):
+        transfer = None
+        if destination is not None:
+            transfer = TransferEngine(
+                destination,
+                options.copy_buffer_size,
+                options.fsync_batch,
+                options.keep_source,
+                options.verify,
+                self.offload.hashFile,
+            )
+
+            limiter = DeviceLimiter(options.device_workers)
+
+            def moveStage(batch):
+                for fromTo in batch:
+                    with limiter.slot(fromTo.src):
+                        fromTo.Move(force, transfer)
+
+            stages = stages + [
+                Stage(
+                    "move",
+                    moveStage,
+                    options.move_workers,
+                    1,
+                    options.queue_size,
+                    weigh=lambda fromTo: fromTo.size,
+                )
             ]
-            concurrent.futures.wait(futures)
-            # self.moveImages(files, destination, force)
-        except NotFoundException:
-            return 1
-        except ValueError as e:
-            self.events.__call__(2, str(e))
+
+        def onError(stage, batch, e):
+            self.events.__call__(3, f"{stage} failed for {len(batch)} files: {e}")
+
+        pipeline = Pipeline(
+            files,
+            stages,
+            should_stop=lambda: self.stop,
+            on_error=onError,
+            source_name=source_name,
+            metrics=self.metrics,
+        )
+        controller = None
+        tuned = [stage.name for stage in stages if stage.name in ("metadata", "move")]
+        if options.auto_tune and tuned:
+            controller = AdaptiveController(tuned, options.min_workers, options.max_workers)
+        try:
+            stats = pipeline.run(controller)
+        finally:
+            # Copies that are not synced yet still have their source
+            if transfer is not None:
+                transfer.flush()
+        for s in stats:
+            self.events.__call__(1, str(s))
+        if controller is not None:
+            for line in controller.report(pipeline):
+                self.events.__call__(1, f"Auto-tuning {line}")
+        if transfer is not None:
+            self.events.__call__(1, str(transfer.stats))
+        if stats[0].items == 0:
+            self.events.__call__(2, "No files selected for import")
             return 2
+        if any(s.errors for s in stats):
+            return 1
         return 0
 
-    # Collects the files both in the parent and in the subdirectories and returns them as a list of strings that are the paths to those files
+    # Collects the files both in the parent and in the subdirectories. Yields them as os.DirEntry objects, directory by directory
     def GetFilesRecursively(self, src):
-        return [
-            t
-            for f in [
-                [os.path.join(root, f) for f in files]
-                for root, dir, files in os.walk(src)
-            ]
-            for t in f
-        ]
+        dirs = [src]
+        while dirs:
+            try:
+                files, subdirs = self.readDirectory(dirs.pop())
+            except OSError as e:
+                self.events.__call__(2, f"Could not read directory: {e}")
+                continue
+            yield from files
+            # Reversed, so that subdirectories are visited in the order they were listed
+            dirs.extend(reversed(subdirs))
 
-    # Collects the files in the specified directory and returns them as a collection of strings that are paths to those fles
+    # Collects the files in the specified directory. Yields them as os.DirEntry objects
     def GetFilesNonRecursively(self, src):
-        return [
-            os.path.join(src, f)
-            for f in os.listdir(src)
-            if os.path.isfile(os.path.join(src, f))
-        ]
+        files, _ = self.readDirectory(src)
+        yield from files
 
-    # Collects the files to be processed
-    def GetFiles(self, src: str, isRecursive: bool):
+    # Lists a directory, returns its files and the paths of its subdirectories. The time it took is recorded in the metrics
+    def readDirectory(self, path):
+        start = time.perf_counter()
+        files = []
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry)
+        self.metrics.observe("discover_seconds", time.perf_counter() - start)
+        self.metrics.count("files_found", len(files))
+        return files, subdirs
+
+    # Collects the files to be processed. This is a generator, the found_files_event is called with the number of files found so far
+    # (every report_every files) and the collected_files_event with the paths of all the files once the search has finished.
+    # The list of paths is only built if the collected_files_event has subscribers
+    def GetFiles(self, src: str, isRecursive: bool, report_every: int = 500):
         if isRecursive:
             self.events.__call__(1, "Getting files recursively")
             files = self.GetFilesRecursively(src)
         else:
             self.events.__call__(1, "Getting files non recursively")
             files = self.GetFilesNonRecursively(src)
+        if self.discovery is not None:
+            files = self.discovery.filter(files)
+        count = 0
+        collected = [] if self.collected_files_event.eventSubs else None
+        for f in files:
+            yield f
+            count += 1
+            if collected is not None:
+                collected.append(os.fspath(f))
+            if count % report_every == 0:
+                self.found_files_event.__call__(count)
+        self.found_files_event.__call__(count)
+        if collected is not None:
+            self.collected_files_event.__call__(collected)
         self.events.__call__(
-            1, f"Searching for files has finished. Found {len(files)} files."
+            1, f"Searching for files has finished. Found {count} files."
+        )
+        if self.discovery is not None and (report := self.discovery.report()) is not None:
+            self.events.__call__(1, report)
+
+    # The date resolver configured by the options
+    def dateResolver(self, options: Options):
+        if options.metadata_mode not in METADATA_MODES:
+            raise ValueError(f"Unknown metadata mode: {options.metadata_mode}")
+        chain = options.date_chain or MODE_CHAINS[options.metadata_mode]
+        return DateResolver(chain, self.metrics)
+
+    # The discovery filter configured by the options, None if they do not filter anything
+    def discoveryFilter(self, options: Options):
+        discovery = DiscoveryFilter(
+            options.include,
+            options.exclude,
+            options.min_size,
+            options.max_size,
+            options.sniff,
+            options.rejected,
+            self.metrics,
         )
-        self.collected_files_event.__call__(files)
-        return files
+        return discovery if discovery.active() else None
 
     # Wrapper for the whole import procvess
     def Import(self, options: Options):
         self.events.__call__(1, "Starting import")
         self.stop = False
-        self.importImages(
-            files=self.GetFiles(src=options.source, isRecursive=options.recursive),
-            destination=options.destination,
-            force=options.force_overwrite,
-        )
+        self.metrics = Metrics()
+        self.discovery = self.discoveryFilter(options)
+        self.resolver = self.dateResolver(options)
+        if options.plan_path is not None:
+            # Plans may be executed from another working directory
+            options = replace(
+                options,
+                source=os.path.abspath(options.source),
+                destination=os.path.abspath(options.destination),
+            )
+        if options.execute_plan is not None:
+            try:
+                header = readPlanHeader(options.execute_plan)
+            except (OSError, PlanError) as e:
+                self.events.__call__(3, f"The plan could not be read: {e}")
+                self.completed_event.__call__()
+                return
+            options = replace(
+                options,
+                source=options.source or header["source"],
+                destination=options.destination or header["destination"],
+            )
+        pool_size = options.exiftool_workers
+        if options.auto_tune:
+            # Every metadata worker may need its own exiftool process, they are only started when needed
+            pool_size = max(pool_size, options.max_workers)
+        self.exiftool_pool = ExifToolPool(pool_size)
+        if options.backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {options.backend}")
+        self.offload = Offload(options.backend, options.process_workers)
+        files, known, done = None, {}, set()
+        if options.plan_path is None and not options.watch:
+            files, known, done = self.openJournal(options)
+        if files is None and options.execute_plan is None and not options.watch:
+            files = self.GetFiles(src=options.source, isRecursive=options.recursive)
+        if options.cache_path is not None:
+            try:
+                self.metadata_cache = MetadataCache(
+                    options.cache_path, options.cache_max_entries
+                )
+            except (OSError, sqlite3.Error) as e:
+                self.events.__call__(
+                    2, f"The metadata cache could not be opened, continuing without it: {e}"
+                )
+        finished = False
+        plan = None
+        try:
+            if options.execute_plan is not None:
+                result = self.executePlan(
+                    options.execute_plan, options.force_overwrite, options, done
+                )
+            elif options.watch:
+                result = self.watchSource(options)
+            else:
+                if options.plan_path is not None:
+                    plan = PlanWriter(options.plan_path, options.source, options.destination)
+                result = self.importImages(
+                    files=files,
+                    destination=options.destination,
+                    force=options.force_overwrite,
+                    options=options,
+                    known=known,
+                    plan=plan,
+                )
+            finished = result != 1
+        except (OSError, PlanError) as e:
+            self.events.__call__(3, f"The import failed: {e}")
+        finally:
+            if plan is not None:
+                plan.close()
+            self.exiftool_pool.shutdown()
+            self.offload.shutdown()
+            self.offload = Offload()
+            self.closeJournal(finished)
+            if self.metadata_cache is not None:
+                self.events.__call__(
+                    1,
+                    f"Metadata cache: {self.metadata_cache.hits} hits, {self.metadata_cache.misses} misses",
+                )
+                self.metadata_cache.close()
+                self.metadata_cache = None
+        if self.exiftool_pool.restarts:
+            self.events.__call__(
+                2, f"{self.exiftool_pool.restarts} exiftool processes had to be restarted"
+            )
+        self.events.__call__(1, self.resolver.report())
+        self.resolver = None
+        self.reportMetrics(options)
         self.events.__call__(1, "Finished")
         self.completed_event.__call__()
 
+    # Reports the metrics of the import (if options.profile is set) and writes them to the files given in the options
+    def reportMetrics(self, options: Options):
+        self.metrics.count("exiftool_processes", self.exiftool_pool.started)
+        self.metrics.count("exiftool_restarts", self.exiftool_pool.restarts)
+        if options.profile:
+            self.events.__call__(1, "Profile:")
+            for line in self.metrics.summary():
+                self.events.__call__(1, f"  {line}")
+        self.writeMetrics(options)
+
+    # Writes the metrics to the files given in the options
+    def writeMetrics(self, options: Options):
+        for path, write in (
+            (options.metrics_json, self.metrics.writeJSON),
+            (options.metrics_textfile, self.metrics.writeTextfile),
+        ):
+            if path is None:
+                continue
+            try:
+                write(path)
+            except OSError as e:
+                self.events.__call__(2, f"The metrics could not be written to '{path}': {e}")
+
+    # Imports the files of the source as they appear, until the import is stopped (see cancel) or interrupted.
+    # The exiftool processes, the metadata cache, the worker processes and the duplicate index of the destination are kept between the batches.
+    # Nothing is journaled: a file whose import was interrupted is still in the source and is imported when the source is watched again
+    def watchSource(self, options: Options):
+        if options.watch_backend not in WATCH_BACKENDS:
+            raise ValueError(f"Unknown watch backend: {options.watch_backend}")
+        try:
+            watcher = Watcher(
+                options.source,
+                options.recursive,
+                options.settle,
+                options.watch_interval,
+                options.watch_backend,
+                # The destination may be inside the source
+                skip=(os.path.abspath(options.destination),),
+                ignore_suffixes=(PARTIAL_SUFFIX,),
+            )
+        except WatchError as e:
+            self.events.__call__(3, f"The source can not be watched: {e}")
+            return 1
+        self.events.__call__(
+            1, f"Watching '{options.source}' for new files ({watcher.backend.name})"
+        )
+        result = 0
+        # Built once, the files imported by every batch are added to it by the duplicate stage
+        duplicates = None
+        if options.duplicates != "import":
+            duplicates = self.duplicateIndex(options.destination, options)
+        with watcher:
+            try:
+                while not self.stop:
+                    ready = watcher.poll()
+                    if self.discovery is not None:
+                        ready = list(self.discovery.filter(ready))
+                    if not ready:
+                        continue
+                    self.events.__call__(1, f"Importing {len(ready)} new files")
+                    self.found_files_event.__call__(len(ready))
+                    self.collected_files_event.__call__(ready)
+                    if self.importImages(
+                        options.destination, ready, options.force_overwrite, options, duplicates=duplicates
+                    ) == 1:
+                        result = 1
+                    watcher.imported(ready)
+                    if self.discovery is not None:
+                        for path in ready:
+                            self.discovery.routed.pop(path, None)
+                    self.writeMetrics(options)
+            except KeyboardInterrupt:
+                self.events.__call__(1, "Stopped watching")
+        return result
+
+    # Opens the journal of the destination (if journaling is enabled). When resuming, the journal of the interrupted import is replayed first.
+    # Returns the files to be imported (None if the source has to be searched), the records of the files that were already planned
+    # and the files that were already imported
+    def openJournal(self, options: Options):
+        self.journal = None
+        if not options.journal and not options.resume:
+            return None, {}, set()
+        path = journalPath(options.destination)
+        files = None
+        known = {}
+        done = set()
+        if options.resume and os.path.exists(path):
+            state = replay(path)
+            outstanding = recover(state, lambda message: self.events.__call__(2, message))
+            known = {src: r for src, entry in outstanding.items() if (r := entry.record()) is not None}
+            done = set(state.entries) - set(outstanding)
+            if state.scanned:
+                # Every file of the source was planned before, the source does not have to be searched again
+                files = list(outstanding)
+                self.found_files_event.__call__(len(files))
+                self.collected_files_event.__call__(files)
+                self.events.__call__(1, f"Resuming the import, {len(files)} files are left")
+            else:
+                self.events.__call__(
+                    1, f"Resuming the import, {len(done)} files were already imported"
+                )
+                files = (
+                    f
+                    for f in self.GetFiles(src=options.source, isRecursive=options.recursive)
+                    if os.fspath(f) not in done
+                )
+        elif options.resume:
+            self.events.__call__(2, "There is no interrupted import to resume, starting a new one")
+        elif os.path.exists(path):
+            self.events.__call__(
+                2, "An earlier import into this destination did not finish, it can be continued with --resume"
+            )
+        try:
+            # The destination is only created by the first move, the journal has to be opened before
+            os.makedirs(options.destination, exist_ok=True)
+            self.journal = Journal(path, options.fsync_batch)
+            self.journal.begin(options.source, options.keep_source)
+        except OSError as e:
+            self.events.__call__(2, f"The journal could not be opened, continuing without it: {e}")
+            self.journal = None
+        return files, known, done
+
+    # Closes the journal. It is removed if the import finished and every file was imported, otherwise it is kept for --resume
+    def closeJournal(self, finished: bool):
+        if self.journal is None:
+            return
+        journal, self.journal = self.journal, None
+        finished = finished and not self.stop
+        if not finished or journal.failures:
+            if finished:
+                # Every file has been planned, a resumed import does not have to search the source again
+                journal.scanned()
+            journal.close()
+            self.events.__call__(
+                2, f"The import did not finish, it can be continued with --resume ({journal.path})"
+            )
+            return
+        journal.remove()
+
+    # Runs an import on the running asyncio event loop. Returns an async iterator of aio.ImportProgress reports:
+    #     async for report in importer.import_async(options): ...
+    # The metadata is read with asynchronous exiftool subprocesses and at most options.async_concurrency reads and moves run at a time.
+    # The import is stopped by cancelling the task iterating it (self.stop is not used), files being moved are finished first.
+    # The journal, plans, duplicate detection, the scheduling policies and sidecar grouping are only supported by Import
+    def import_async(self, options: Options):
+        return importAsync(self, options)
+
     # Stop the importing
     def cancel(self):
         self.stop = True
@@ -231,6 +1016,15 @@ class MsgEvent(object):
     def __iunsub__(self, Ehandler):
         self.eventSubs.remove(Ehandler)
 
+    # Subscribes a handler that is not called right away, but when the queue is drained (see EventQueue).
+    # If coalesce is set the calls are aggregated (see EventQueue.put). Returns the subscribed wrapper, it can be unsubscribed with __iunsub__
+    def subscribeQueued(self, Ehandler, queue, coalesce: bool = False):
+        def queued(args, kwds):
+            queue.put(Ehandler, args, kwds, coalesce)
+
+        self.__isub__(queued)
+        return queued
+
     def __call__(self, *args, **kwds):
         for Ehandler in self.eventSubs:
             Ehandler(args, kwds)
@@ -255,8 +1049,50 @@ class Msges(MsgEvent):
         lvl -= 1
         self.lvls[lvl].__iunsub__(Ehandler)
 
+    def subscribeQueued(self, Ehandler, queue, lvl: int = 1, coalesce: bool = False):
+        if lvl < 1 or lvl > len(self.lvls):
+            raise ValueError(f"There is no level with level: {lvl}")
+        return self.lvls[lvl - 1].subscribeQueued(Ehandler, queue, coalesce)
+
     def __call__(self, lvl: int = 1, *args, **kwds):
         if lvl < 1 or lvl > len(self.lvls):
             raise ValueError(f"There is no level with level: {lvl}")
         lvl -= 1
         self.lvls[lvl].__call__(args=args, kwds=kwds)
+
+
+# Collects event calls made by any thread, so that they can be delivered by the thread that owns the handlers (e.g. the Tk main loop).
+# Delivery is rate limited: drain delivers the collected calls at most max_rate times per second.
+# Calls of coalesced handlers are aggregated: only the last call since the previous delivery is delivered, with the number of calls as kwds["count"]
+class EventQueue:
+    def __init__(self, max_rate: float = 10) -> None:
+        self.min_interval = 1 / max_rate if max_rate > 0 else 0
+        self._lock = threading.Lock()
+        self._calls = []
+        self._coalesced = {}
+        self._last = 0.0
+
+    def put(self, Ehandler, args, kwds, coalesce: bool = False) -> None:
+        with self._lock:
+            if not coalesce:
+                self._calls.append((Ehandler, args, kwds))
+                return
+            last = self._coalesced.get(Ehandler)
+            count = last[2] + 1 if last is not None else 1
+            self._coalesced[Ehandler] = (args, kwds, count)
+
+    # Calls the handlers with the collected calls: the coalesced ones first, then the rest in the order they were made.
+    # Returns the number of delivered calls, 0 if the last delivery was too recent (unless force is set)
+    def drain(self, force: bool = False) -> int:
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last < self.min_interval:
+                return 0
+            self._last = now
+            calls, self._calls = self._calls, []
+            coalesced, self._coalesced = self._coalesced, {}
+        for Ehandler, (args, kwds, count) in coalesced.items():
+            Ehandler(args, dict(kwds, count=count))
+        for Ehandler, args, kwds in calls:
+            Ehandler(args, kwds)
+        return len(calls) + len(coalesced)
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# The upper bounds of the latency histogram buckets in seconds, from 0.1 ms to a minute
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+# The prefix of the metric names in the Prometheus output
+PROMETHEUS_PREFIX = "exif_import_"
+
+
+# A histogram with fixed buckets, the same kind Prometheus uses. counts[i] is the number of values in (buckets[i - 1], buckets[i]],
+# the last count is the number of values above the last bucket
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # The upper bound of the bucket the q quantile falls into (the largest value for the last bucket)
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.max)
+        return self.max
+
+    def asdict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+# Counters, latency histograms and gauges collected during an import. Every metric has a name and optional labels
+# (e.g. the stage it belongs to). Recording a value takes a lock and a few additions, so the metrics are always collected
+class Metrics:
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        # name -> [last value, largest value]
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def count(self, name: str, n: int = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            gauge = self.gauges.get(key)
+            if gauge is None:
+                self.gauges[key] = [value, value]
+            else:
+                gauge[0] = value
+                if value > gauge[1]:
+                    gauge[1] = value
+
+    # Observes the seconds the with block took in the histogram name
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # The metrics as a JSON serializable dict
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "seconds": time.time() - self.started,
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **h.asdict()}
+                    for (name, labels), h in sorted(self.histograms.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "last": g[0], "max": g[1]}
+                    for (name, labels), g in sorted(self.gauges.items())
+                ],
+            }
+
+    # A human readable summary, one line per metric
+    def summary(self) -> list[str]:
+        lines = []
+        with self._lock:
+            for (name, labels), h in sorted(self.histograms.items()):
+                if not h.count:
+                    continue
+                lines.append(
+                    f"{_title(name, labels)}: {h.count} in {h.sum:.2f}s, mean {h.sum / h.count * 1000:.2f} ms, "
+                    f"p50 <= {h.quantile(0.5) * 1000:.2f} ms, p95 <= {h.quantile(0.95) * 1000:.2f} ms, "
+                    f"max {h.max * 1000:.2f} ms"
+                )
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{_title(name, labels)}: {value}")
+            for (name, labels), (last, peak) in sorted(self.gauges.items()):
+                lines.append(f"{_title(name, labels)}: max {peak}")
+        return lines
+
+    # The metrics in the Prometheus text exposition format
+    def prometheus(self) -> str:
+        out = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}{name}_total"
+                if metric not in typed:
+                    typed.add(metric)
+                    out.append(f"# TYPE {metric} counter")
+                out.append(f"{metric}{_labels(labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                metric = PROMETHEUS_PREFIX + name
+                if metric not in typed:
+                    typed.add(metric)
+                    out.append(f"# TYPE {metric} histogram")
+                seen = 0
+                for bound, n in zip([repr(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    seen += n
+                    out.append(f"{metric}_bucket{_labels(labels + (('le', bound),))} {seen}")
+                out.append(f"{metric}_sum{_labels(labels)} {h.sum}")
+                out.append(f"{metric}_count{_labels(labels)} {h.count}")
+            for (name, labels), (last, peak) in sorted(self.gauges.items()):
+                for metric, value in ((PROMETHEUS_PREFIX + name, last), (f"{PROMETHEUS_PREFIX}{name}_max", peak)):
+                    if metric not in typed:
+                        typed.add(metric)
+                        out.append(f"# TYPE {metric} gauge")
+                    out.append(f"{metric}{_labels(labels)} {value}")
+        return "\n".join(out) + "\n"
+
+    def writeJSON(self, path: str) -> None:
+        _replace(path, json.dumps(self.snapshot(), indent=2) + "\n")
+
+    # Writes the metrics for the textfile collector of the node exporter. The file is replaced atomically,
+    # so the collector never reads a half written file
+    def writeTextfile(self, path: str) -> None:
+        _replace(path, self.prometheus())
+
+
+def _title(name: str, labels: tuple) -> str:
+    if not labels:
+        return name
+    return f"{name}[{', '.join(str(v) for _, v in labels)}]"
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _replace(path: str, text: str) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from metadata import MetaRecord
+from transfer import PARTIAL_SUFFIX, hashFile
+
+# The name of the journal file, it is written into the destination directory
+JOURNAL_NAME = ".exif-image-sorter-journal.jsonl"
+
+
+# The last known state of a file in the journal
+@dataclass(slots=True)
+class JournalEntry:
+    src: str
+    # planned, started, completed, skipped or failed
+    state: str
+    filetype: str | None = field(default=None)
+    date: str | None = field(default=None)
+    # The full new path, known once the file was started
+    dst: str | None = field(default=None)
+
+    # The metadata recorded when the file was planned, None if it was not planned in the journal
+    def record(self) -> MetaRecord | None:
+        if self.filetype is None:
+            return None
+        return MetaRecord(self.filetype, self.date)
+
+
+# The result of replaying a journal
+@dataclass
+class JournalState:
+    entries: dict[str, JournalEntry] = field(default_factory=dict)
+    # Whether the files of the source were all discovered in the last run, so they do not have to be searched again
+    scanned: bool = field(default=False)
+    keep_source: bool = field(default=False)
+
+
+# An append-only log of the files of an import: when they were planned, started, and completed (or skipped or failed).
+# Every record is a line of JSON, written right away and synced to the disk fsync_batch records at a time (0 disables syncing).
+# A crashed or cancelled import can be resumed by replaying it (see replay and recover)
+class Journal:
+    def __init__(self, path: str, fsync_batch: int = 64) -> None:
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        # The number of files that failed in this run
+        self.failures = 0
+        self._file = open(path, "a", encoding="utf-8")
+        if not endsWithNewline(path):
+            # The last record was cut off by a crash, the next one starts on a line of its own
+            self._file.write("\n")
+
+    def _write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if self.fsync_batch > 0 and self._unsynced >= self.fsync_batch:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    # Marks the start of an import run
+    def begin(self, source: str, keep_source: bool) -> None:
+        self._write({"op": "begin", "source": source, "keep_source": keep_source})
+
+    # Marks that every file of the source has been discovered and planned
+    def scanned(self) -> None:
+        self._write({"op": "scanned"})
+
+    def planned(self, src: str, record: MetaRecord) -> None:
+        self._write({"op": "planned", "src": src, "filetype": record.filetype, "date": record.dateDir()})
+
+    def started(self, src: str, dst: str) -> None:
+        self._write({"op": "started", "src": src, "dst": dst})
+
+    def completed(self, src: str, dst: str) -> None:
+        self._write({"op": "completed", "src": src, "dst": dst})
+
+    # Records a file that was left in the source for good, e.g. because its new path was taken.
+    # Unlike a failure this does not keep the journal, resuming would not import it either
+    def skipped(self, src: str, reason: str) -> None:
+        self._write({"op": "skipped", "src": src, "reason": reason})
+
+    def failed(self, src: str, reason: str) -> None:
+        with self._lock:
+            self.failures += 1
+        self._write({"op": "failed", "src": src, "reason": reason})
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    # Closes and deletes the journal, used once an import finished without leaving anything behind
+    def remove(self) -> None:
+        self.close()
+        os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+# Returns False if the file does not end with a line break. An empty file does
+def endsWithNewline(path: str) -> bool:
+    with open(path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+# Returns the path of the journal of a destination
+def journalPath(destination: str) -> str:
+    return os.path.join(destination, JOURNAL_NAME)
+
+
+# Reads a journal and returns the last state of every file in it. A line cut off by a crash is ignored
+def replay(path: str) -> JournalState:
+    state = JournalState()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            op = record.get("op")
+            if op == "begin":
+                state.scanned = False
+                state.keep_source = bool(record.get("keep_source"))
+                continue
+            if op == "scanned":
+                state.scanned = True
+                continue
+            src = record.get("src")
+            if src is None:
+                continue
+            entry = state.entries.get(src)
+            if entry is None:
+                entry = state.entries[src] = JournalEntry(src, op)
+            entry.state = op
+            if op == "planned":
+                entry.filetype = record.get("filetype")
+                entry.date = record.get("date")
+            elif op in ("started", "completed"):
+                entry.dst = record.get("dst")
+    return state
+
+
+# Checks whether two files have the same content, False if either can not be read
+def sameContent(a: str, b: str) -> bool:
+    try:
+        return os.path.getsize(a) == os.path.getsize(b) and hashFile(a) == hashFile(b)
+    except OSError:
+        return False
+
+
+# Brings the files of a replayed journal into a consistent state and returns the ones that still have to be imported.
+# Partial copies are removed. A copy that is complete but whose source was not removed yet (the import stopped
+# before the copies were synced) is finished by removing the source. Messages about what was done are passed to report
+def recover(state: JournalState, report=lambda message: None) -> dict[str, JournalEntry]:
+    outstanding = {}
+    for src, entry in state.entries.items():
+        if entry.dst is not None and os.path.lexists(entry.dst + PARTIAL_SUFFIX):
+            os.unlink(entry.dst + PARTIAL_SUFFIX)
+            report(f"Removed the partial copy '{entry.dst + PARTIAL_SUFFIX}'")
+        if entry.state == "skipped":
+            continue
+        if not os.path.lexists(src):
+            if entry.state not in ("started", "completed"):
+                report(f"'{src}' is no longer in the source, it is skipped")
+            continue
+        if entry.state == "completed" and state.keep_source:
+            # The sources of copies are left in place
+            continue
+        if entry.state in ("started", "completed") and entry.dst is not None and os.path.lexists(entry.dst):
+            if sameContent(src, entry.dst):
+                if not state.keep_source:
+                    os.unlink(src)
+                    report(f"Finished moving '{src}' to '{entry.dst}'")
+                continue
+            report(f"'{entry.dst}' is not a complete copy of '{src}', it was left in place")
+        outstanding[src] = entry
+    return outstanding
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+# The severities of the log lines, from the least to the most severe
+SEVERITIES = ("info", "warning", "error")
+
+
+@dataclass(slots=True, frozen=True)
+class LogLine:
+    time: float
+    severity: str
+    text: str
+
+    def __str__(self) -> str:
+        return f"{time.strftime('%H:%M:%S', time.localtime(self.time))} [{self.severity.upper()}] {self.text}"
+
+
+# The log shown by the GUI. Only the last max_lines lines are kept in memory, every line is also spooled to a
+# temporary file, so that the full log can still be exported (see export). Lines can be appended from any thread
+class LogBuffer:
+    def __init__(self, max_lines: int = 5000) -> None:
+        if max_lines < 1:
+            raise ValueError(f"The log must keep at least one line, got: {max_lines}")
+        self.max_lines = max_lines
+        self.counts = dict.fromkeys(SEVERITIES, 0)
+        self._lines = deque(maxlen=max_lines)
+        self._new = []
+        self._lock = threading.Lock()
+        self._spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+
+    def append(self, severity: str, text: str) -> None:
+        if severity not in SEVERITIES:
+            raise ValueError(f"Unknown severity: {severity}")
+        line = LogLine(time.time(), severity, text.rstrip("\n"))
+        with self._lock:
+            self._lines.append(line)
+            self._new.append(line)
+            self.counts[severity] += 1
+            self._spool.write(f"{line}\n")
+
+    # The number of lines that are no longer kept in memory
+    def dropped(self) -> int:
+        return sum(self.counts.values()) - len(self._lines)
+
+    # The kept lines that are at least as severe as severity
+    def lines(self, severity: str = "info") -> list[LogLine]:
+        level = SEVERITIES.index(severity)
+        with self._lock:
+            return [line for line in self._lines if SEVERITIES.index(line.severity) >= level]
+
+    # The lines appended since the last call that are at least as severe as severity. At most max_lines are returned
+    def take(self, severity: str = "info") -> list[LogLine]:
+        level = SEVERITIES.index(severity)
+        with self._lock:
+            new, self._new = self._new[-self.max_lines :], []
+        return [line for line in new if SEVERITIES.index(line.severity) >= level]
+
+    # Writes every line logged so far to a file
+    def export(self, path: str) -> None:
+        with self._lock:
+            self._spool.flush()
+            self._spool.seek(0)
+            with open(path, "w", encoding="utf-8") as f:
+                shutil.copyfileobj(self._spool, f)
+            self._spool.seek(0, 2)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lines.clear()
+            self._new = []
+            self.counts = dict.fromkeys(SEVERITIES, 0)
+            self._spool.seek(0)
+            self._spool.truncate()
+
+    def close(self) -> None:
+        self._spool.close()
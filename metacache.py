@@ -0,0 +1,156 @@
+#!/usr/bin/python
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from metadata import MetaRecord
+
+# The default location of the cache, follows the XDG base directory specification
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(Path.home(), ".cache"),
+    "exif-image-sorter",
+    "metadata.sqlite",
+)
+
+
+# A persistent cache of the resolved metadata of files.
+# An entry is only used if the size, the modification time and the inode of the file are the same as when it was stored
+class MetadataCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 1_000_000) -> None:
+        if max_entries < 1:
+            raise ValueError(f"The cache must be able to hold at least one entry, got: {max_entries}")
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                filetype TEXT NOT NULL,
+                date TEXT,
+                used REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_used ON files (used)")
+        self._db.commit()
+
+    # Looks up the records of files. stats maps the paths to their os.stat_result, only matching entries are returned
+    def get_many(self, stats: dict[str, os.stat_result]) -> dict[str, MetaRecord]:
+        records = {}
+        if not stats:
+            return records
+        paths = list(stats)
+        with self._lock:
+            # SQLite limits the number of parameters of a statement
+            for i in range(0, len(paths), 500):
+                chunk = paths[i : i + 500]
+                rows = self._db.execute(
+                    f"SELECT path, size, mtime_ns, inode, filetype, date FROM files WHERE path IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for path, size, mtime_ns, inode, filetype, date in rows:
+                    st = stats[path]
+                    if (size, mtime_ns, inode) == (st.st_size, st.st_mtime_ns, st.st_ino):
+                        records[path] = MetaRecord(filetype, date)
+            if records:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE files SET used = ? WHERE path = ?",
+                    [(now, path) for path in records],
+                )
+                self._db.commit()
+            self.hits += len(records)
+            self.misses += len(paths) - len(records)
+        return records
+
+    # Stores the records of files, stats maps the paths to their os.stat_result
+    def put_many(self, records: dict[str, MetaRecord], stats: dict[str, os.stat_result]) -> None:
+        if not records:
+            return
+        now = time.time()
+        rows = [
+            (path, st.st_size, st.st_mtime_ns, st.st_ino, record.filetype, record.date, now)
+            for path, record in records.items()
+            if (st := stats.get(path)) is not None
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, filetype, date, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._db.commit()
+
+    # Removes the least recently used entries above max_entries
+    def _evict(self) -> None:
+        (count,) = self._db.execute("SELECT COUNT(*) FROM files").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM files WHERE path IN (SELECT path FROM files ORDER BY used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    # Removes the entries of files that no longer exist or have changed since they were cached. Returns the number of removed entries
+    def prune(self) -> int:
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, mtime_ns, inode FROM files").fetchall()
+        stale = []
+        for path, size, mtime_ns, inode in rows:
+            try:
+                st = os.stat(path)
+            except OSError:
+                stale.append((path,))
+                continue
+            if (size, mtime_ns, inode) != (st.st_size, st.st_mtime_ns, st.st_ino):
+                stale.append((path,))
+        with self._lock:
+            self._db.executemany("DELETE FROM files WHERE path = ?", stale)
+            self._db.commit()
+            self._db.execute("VACUUM")
+        return len(stale)
+
+    # Removes every entry
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM files")
+            self._db.commit()
+            self._db.execute("VACUUM")
+
+    # Describes the cache: its location, the number of entries, their age and the size of the database
+    def info(self) -> dict:
+        with self._lock:
+            count, oldest, newest = self._db.execute(
+                "SELECT COUNT(*), MIN(used), MAX(used) FROM files"
+            ).fetchone()
+            (page_count,) = self._db.execute("PRAGMA page_count").fetchone()
+            (page_size,) = self._db.execute("PRAGMA page_size").fetchone()
+        return {
+            "path": self.path,
+            "entries": count,
+            "max_entries": self.max_entries,
+            "size_bytes": page_count * page_size,
+            "oldest_use": oldest,
+            "newest_use": newest,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
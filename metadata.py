@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from exiftool import ExifToolHelper
+from exiftool.exceptions import ExifToolExecuteException
+
+# The tags needed to sort a file, requested from exiftool in a single pass
+TAGS = ["FileType", "DateTimeOriginal", "CreateDate"]
+# hybrid: headers are parsed in python, exiftool is used for the formats that are not supported
+# fast: only the python header parser is used, unsupported files are sorted by their extension
+# exiftool: every file is read by exiftool
+METADATA_MODES = ("hybrid", "fast", "exiftool")
+# The tags the capture date is taken from, in order of preference
+DATE_TAGS = ["DateTimeOriginal", "CreateDate"]
+
+
+# The compact result of the metadata lookup of a single file
+# date is in the YYYY.MM.DD format, None if the file does not have a suitable tag
+@dataclass(slots=True, frozen=True)
+class MetaRecord:
+    filetype: str
+    date: str | None = None
+
+    # The name of the date directory. Files without a date are placed in the directory of the current day
+    def dateDir(self) -> str:
+        if self.date is None:
+            return today()
+        return self.date
+
+
+# The current date in the YYYY.MM.DD format
+def today() -> str:
+    return datetime.strftime(datetime.now(), "%Y.%m.%d")
+
+
+# Guesses the filetype from the extension. Used when exiftool could not determine it
+def extension_type(path: str) -> str:
+    tp = path.split(".")
+    if len(tp) and len(tp[-1]) < 6:
+        return tp[-1].lower()
+    return "misc"
+
+
+# Converts an exif date (YYYY:MM:DD HH:MM:SS) to the YYYY.MM.DD format
+def format_date(value) -> str:
+    return str(value)[0:10].replace(":", ".")
+
+
+# Gets the value of tag from a group qualified (-G) exiftool output regardless of the group
+def tag_value(tags: dict, tag: str):
+    for k, v in tags.items():
+        splat = k.split(":")
+        if len(splat) > 1 and splat[1] == tag:
+            return v
+    return None
+
+
+# Gets the capture date from a group qualified exiftool output, None if none of DATE_TAGS is present
+def date_from_tags(tags: dict) -> str | None:
+    for tag in DATE_TAGS:
+        value = tag_value(tags, tag)
+        if value:
+            return format_date(value)
+    return None
+
+
+# Builds the record of a single file from its exiftool output
+def record_from_tags(path: str, tags: dict) -> MetaRecord:
+    filetype = tags.get("File:FileType")
+    return MetaRecord(
+        filetype.lower() if filetype else extension_type(path),
+        date_from_tags(tags),
+    )
+
+
+# Reads the tags of all files with a single exiftool invocation and returns the records keyed by the given paths.
+# Files exiftool could not read get a record based on their extension, same as whatType and getExifDate would return
+def read_batch(et: ExifToolHelper, files: list[str]) -> dict[str, MetaRecord]:
+    if not files:
+        return {}
+    # exiftool exits with a non-zero status if a single file of the batch failed, the rest of the output is still valid
+    check = et.check_execute
+    et.check_execute = False
+    try:
+        out = et.execute_json("-fast", *[f"-{tag}" for tag in TAGS], *files)
+    except ExifToolExecuteException:
+        out = []
+    finally:
+        et.check_execute = check
+    return records_from_json(files, out)
+
+
+# Maps the JSON output of exiftool (run with -G -n) to the records of files, keyed by the given paths.
+# Files missing from the output get a record based on their extension
+def records_from_json(files: list[str], out: list[dict]) -> dict[str, MetaRecord]:
+    records = {}
+    found = {os.path.normpath(tags["SourceFile"]): tags for tags in out}
+    for f in files:
+        tags = found.get(os.path.normpath(f))
+        if tags is None:
+            records[f] = MetaRecord(extension_type(f))
+        else:
+            records[f] = record_from_tags(f, tags)
+    return records
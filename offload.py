@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from duplicates import quickHash
+from headers import read_header
+from metadata import MetaRecord
+from transfer import DEFAULT_BUFFER_SIZE, hashFile
+
+# Where the CPU-heavy work (parsing headers in python, hashing) runs:
+# thread: in the worker thread of the stage that needs it, limited by the GIL
+# process: in a pool of worker processes, the stage's thread waits for the result without holding the GIL
+BACKENDS = ("thread", "process")
+
+
+# Runs in a worker process. Only the paths go in and compact (path, filetype, date) tuples come out, for the files that could be parsed
+def _headersJob(paths: list[str]) -> list[tuple]:
+    out = []
+    for path in paths:
+        record = read_header(path)
+        if record is not None:
+            out.append((path, record.filetype, record.date))
+    return out
+
+
+# Runs the CPU-heavy functions of an import on the chosen backend.
+# The jobs are plain functions of paths and numbers, they neither see FromTo objects nor fire events:
+# their results (and exceptions) are returned to the calling thread, which fires the events, so every MsgEvent subscriber still gets them
+class Offload:
+    def __init__(self, backend: str = "thread", workers: int = 0) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        self.backend = backend
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        if backend == "process":
+            # Worker processes are spawned, forking a process that runs threads is not safe
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def _call(self, func, *args):
+        if self._pool is None:
+            return func(*args)
+        return self._pool.submit(func, *args).result()
+
+    # The same as headers.read_headers
+    def readHeaders(self, paths: list[str]) -> dict[str, MetaRecord | None]:
+        records = dict.fromkeys(paths)
+        if not paths:
+            return records
+        if self._pool is None:
+            parsed = _headersJob(paths)
+        else:
+            # Split the batch, so that every worker process gets a share of it
+            size = max(1, -(-len(paths) // self.workers))
+            futures = [
+                self._pool.submit(_headersJob, paths[i : i + size])
+                for i in range(0, len(paths), size)
+            ]
+            parsed = [row for future in futures for row in future.result()]
+        for path, filetype, date in parsed:
+            records[path] = MetaRecord(filetype, date)
+        return records
+
+    def quickHash(self, path: str, size: int, block_size: int) -> str:
+        return self._call(quickHash, path, size, block_size)
+
+    def hashFile(self, path: str, buffer_size: int = DEFAULT_BUFFER_SIZE, drop_cache: bool = False) -> str:
+        return self._call(hashFile, path, buffer_size, drop_cache)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
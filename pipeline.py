@@ -0,0 +1,383 @@
+#!/usr/bin/python
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+# How long an idle worker waits for an item before checking whether the stage has finished
+POLL_INTERVAL = 0.05
+
+
+# Statistics collected about a stage while the pipeline runs
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    items: int = field(default=0)
+    batches: int = field(default=0)
+    errors: int = field(default=0)
+    # Seconds spent processing, summed over the workers
+    busy: float = field(default=0.0)
+    # Seconds spent waiting for the next stage to accept the results (back-pressure), summed over the workers
+    blocked: float = field(default=0.0)
+    max_queue: int = field(default=0)
+    # The size of the processed items (see Stage.weigh), 0 if the stage does not weigh its items
+    bytes: int = field(default=0)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.items} items in {self.batches} batches by {self.workers} workers, "
+            f"busy {self.busy:.2f}s, blocked {self.blocked:.2f}s, "
+            f"max queue {self.max_queue}, {self.errors} errors"
+        )
+
+
+# A step of the pipeline. func is called with a batch (a list of at most batch_size items) taken from the stage's queue
+# and returns the items to be passed to the next stage (or None if there are none).
+# weigh can be used to count the bytes processed by the stage, it is called with every item of a successful batch
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[list], Iterable | None],
+        workers: int = 1,
+        batch_size: int = 1,
+        queue_size: int = 256,
+        weigh: Callable[[object], int] | None = None,
+    ) -> None:
+        if workers < 1:
+            raise ValueError(f"The {name} stage needs at least one worker, got: {workers}")
+        if batch_size < 1:
+            raise ValueError(f"The batch size of the {name} stage must be at least 1, got: {batch_size}")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch_size = batch_size
+        self.weigh = weigh
+        self.queue = queue.Queue(queue_size)
+        self.stats = StageStats(name, workers)
+        self.upstream_done = threading.Event()
+        self.lock = threading.Lock()
+        self.alive = 0
+
+    # Lets a worker leave if the stage has more workers than it should. The last worker never retires,
+    # it has to signal the next stage once everything is processed
+    def retire(self) -> bool:
+        with self.lock:
+            if self.alive > self.workers and self.alive > 1:
+                self.alive -= 1
+                return True
+        return False
+
+    # Takes the next batch from the queue. Returns None once the previous stage has finished and the queue is empty
+    def take(self) -> list | None:
+        while True:
+            try:
+                first = self.queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self.upstream_done.is_set() and self.queue.empty():
+                    return None
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            return batch
+
+
+# Runs the items of source through the stages. Every stage has its own worker threads and a bounded input queue,
+# so a slow stage slows down the ones before it instead of letting the queues grow without bound.
+# If should_stop returns True the remaining items are discarded.
+# If metrics (an instrumentation.Metrics) are given, the latency of every batch and the depth of the queues are recorded in them
+class Pipeline:
+    def __init__(
+        self,
+        source: Iterable,
+        stages: list[Stage],
+        should_stop: Callable[[], bool] = lambda: False,
+        on_error: Callable[[str, list, Exception], None] | None = None,
+        source_name: str = "discover",
+        metrics=None,
+    ) -> None:
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.source = source
+        self.stages = stages
+        self.should_stop = should_stop
+        self.on_error = on_error
+        self.source_stats = StageStats(source_name, 1)
+        self.metrics = metrics
+        self._threads = []
+
+    # Passes an item to a stage, blocking while its queue is full. Returns the seconds spent waiting
+    def _put(self, stage: Stage, item) -> float:
+        start = time.perf_counter()
+        stage.queue.put(item)
+        waited = time.perf_counter() - start
+        depth = stage.queue.qsize()
+        if depth > stage.stats.max_queue:
+            stage.stats.max_queue = depth
+        if self.metrics is not None:
+            self.metrics.gauge("queue_depth", depth, stage=stage.name)
+        return waited
+
+    # Iterates the source and feeds the first stage
+    def _feed(self) -> None:
+        first = self.stages[0]
+        stats = self.source_stats
+        try:
+            start = time.perf_counter()
+            for item in self.source:
+                if self.should_stop():
+                    break
+                stats.busy += time.perf_counter() - start
+                stats.items += 1
+                stats.batches += 1
+                stats.blocked += self._put(first, item)
+                start = time.perf_counter()
+        except Exception as e:
+            stats.errors += 1
+            if self.on_error is not None:
+                self.on_error(stats.name, [], e)
+        finally:
+            first.upstream_done.set()
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        stats = stage.stats
+        try:
+            while True:
+                if stage.retire():
+                    return
+                batch = stage.take()
+                if batch is None:
+                    break
+                # Once stopped the queue is still drained, so that the previous stage is never blocked
+                if self.should_stop():
+                    continue
+                start = time.perf_counter()
+                try:
+                    out = stage.func(batch)
+                    if out is not None:
+                        out = list(out)
+                    weight = sum(stage.weigh(item) for item in batch) if stage.weigh else 0
+                except Exception as e:
+                    out = None
+                    weight = 0
+                    with stage.lock:
+                        stats.errors += len(batch)
+                    if self.on_error is not None:
+                        self.on_error(stage.name, batch, e)
+                elapsed = time.perf_counter() - start
+                if self.metrics is not None:
+                    self.metrics.observe("stage_seconds", elapsed, stage=stage.name)
+                with stage.lock:
+                    stats.busy += elapsed
+                    stats.items += len(batch)
+                    stats.batches += 1
+                    stats.bytes += weight
+                if out and following is not None:
+                    waited = sum(self._put(following, item) for item in out)
+                    with stage.lock:
+                        stats.blocked += waited
+        except BaseException:
+            self._leave(stage, following)
+            raise
+        self._leave(stage, following)
+
+    # Called when a worker finished, the last one signals the next stage that no more items will come
+    def _leave(self, stage: Stage, following: Stage | None) -> None:
+        with stage.lock:
+            stage.alive -= 1
+            last = stage.alive == 0
+        if last and following is not None:
+            following.upstream_done.set()
+
+    # Starts a worker thread for the stage at index
+    def _spawn(self, index: int) -> None:
+        stage = self.stages[index]
+        with stage.lock:
+            stage.alive += 1
+        self._start(index)
+
+    def _start(self, index: int) -> None:
+        stage = self.stages[index]
+        t = threading.Thread(
+            target=self._work, args=(index,), name=f"{stage.name}-worker", daemon=True
+        )
+        self._threads.append(t)
+        t.start()
+
+    # Finds a stage by its name
+    def stage(self, name: str) -> Stage:
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(f"There is no stage named: {name}")
+
+    # Changes the number of workers of a running stage. New workers are started right away,
+    # surplus workers leave after finishing their current batch. A finished stage is not restarted
+    def resize(self, name: str, workers: int) -> None:
+        if workers < 1:
+            raise ValueError(f"A stage needs at least one worker, got: {workers}")
+        index = self.stages.index(self.stage(name))
+        stage = self.stages[index]
+        with stage.lock:
+            stage.workers = workers
+            stage.stats.workers = workers
+            if stage.alive == 0:
+                return
+            grow = max(0, workers - stage.alive)
+            stage.alive += grow
+        for _ in range(grow):
+            self._start(index)
+
+    # Runs the pipeline until every item went through every stage (or it was stopped) and returns the statistics of the stages.
+    # If a controller is given it is running while the pipeline does
+    def run(self, controller=None) -> list[StageStats]:
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self._spawn(index)
+        if controller is not None:
+            controller.start(self)
+        try:
+            self._feed()
+            # Workers may be added while waiting, those are joined as well
+            i = 0
+            while i < len(self._threads):
+                self._threads[i].join()
+                i += 1
+        finally:
+            if controller is not None:
+                controller.stop()
+        return [self.source_stats] + [stage.stats for stage in self.stages]
+
+
+# A measurement of a stage over one sampling interval of the AdaptiveController
+@dataclass
+class StageSample:
+    workers: int
+    # Items and bytes processed per second
+    rate: float
+    byte_rate: float
+    # Average seconds a worker spent on an item
+    latency: float
+    queued: int
+
+
+# Tunes the number of workers of some stages of a running pipeline.
+# Every interval the throughput of each stage is measured (bytes/s if the stage weighs its items, items/s otherwise).
+# A stage with work waiting in its queue gets one more (or one less) worker, if that improved the throughput
+# it keeps going in the same direction, otherwise it turns back. Stages without queued work are left alone, more workers would not help them
+class AdaptiveController:
+    def __init__(
+        self,
+        stages: list[str],
+        min_workers: int = 1,
+        max_workers: int = 16,
+        interval: float = 2.0,
+        tolerance: float = 0.05,
+    ) -> None:
+        if min_workers < 1 or max_workers < min_workers:
+            raise ValueError(
+                f"Invalid worker bounds: min {min_workers}, max {max_workers}"
+            )
+        self.stages = stages
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.tolerance = tolerance
+        self.samples = {name: [] for name in stages}
+        self._direction = {name: 1 for name in stages}
+        self._last = {}
+        self._score = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, pipeline: Pipeline) -> None:
+        self._stopped.clear()
+        for name in self.stages:
+            stage = pipeline.stage(name)
+            workers = min(self.max_workers, max(self.min_workers, stage.workers))
+            if workers != stage.workers:
+                pipeline.resize(name, workers)
+            self._last[name] = (time.perf_counter(), 0, 0, 0.0)
+        self._thread = threading.Thread(
+            target=self._run, args=(pipeline,), name="concurrency-controller", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, pipeline: Pipeline) -> None:
+        while not self._stopped.wait(self.interval):
+            for name in self.stages:
+                self._tune(pipeline, pipeline.stage(name))
+
+    # Measures the stage since the last sample
+    def _measure(self, stage: Stage) -> StageSample | None:
+        now = time.perf_counter()
+        with stage.lock:
+            items, size, busy = stage.stats.items, stage.stats.bytes, stage.stats.busy
+        then, last_items, last_size, last_busy = self._last[stage.name]
+        self._last[stage.name] = (now, items, size, busy)
+        if items == last_items or now <= then:
+            return None
+        return StageSample(
+            stage.workers,
+            (items - last_items) / (now - then),
+            (size - last_size) / (now - then),
+            (busy - last_busy) / (items - last_items),
+            stage.queue.qsize(),
+        )
+
+    def _tune(self, pipeline: Pipeline, stage: Stage) -> None:
+        sample = self._measure(stage)
+        if sample is None:
+            return
+        self.samples[stage.name].append(sample)
+        score = sample.byte_rate if stage.weigh is not None and sample.byte_rate else sample.rate
+        if sample.queued < stage.workers:
+            # The stage keeps up with its input, the previous stages are the bottleneck
+            self._score[stage.name] = score
+            return
+        last = self._score.get(stage.name)
+        self._score[stage.name] = score
+        if last is not None and score < last * (1 - self.tolerance):
+            self._direction[stage.name] *= -1
+        elif last is not None and score <= last * (1 + self.tolerance):
+            # No significant change, the current number of workers is good enough
+            return
+        workers = stage.workers + self._direction[stage.name]
+        if workers < self.min_workers or workers > self.max_workers:
+            self._direction[stage.name] *= -1
+            return
+        pipeline.resize(stage.name, workers)
+
+    # The number of workers each tuned stage ended up with
+    def settled(self, pipeline: Pipeline) -> dict[str, int]:
+        return {name: pipeline.stage(name).workers for name in self.stages}
+
+    # A short summary of a stage's last measurements
+    def report(self, pipeline: Pipeline) -> list[str]:
+        lines = []
+        for name in self.stages:
+            samples = self.samples[name]
+            line = f"{name}: settled on {pipeline.stage(name).workers} workers"
+            if samples:
+                best = max(samples, key=lambda s: s.byte_rate or s.rate)
+                line += (
+                    f", best {best.rate:.1f} files/s, {best.byte_rate / 1024 / 1024:.1f} MiB/s"
+                    f" with {best.workers} workers, {best.latency * 1000:.1f} ms per file"
+                )
+            lines.append(line)
+        return lines
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+# The version of the plan format, written into the header of every plan
+PLAN_VERSION = 1
+
+
+# A planned move: src goes to dst (destination/filetype/date/) under name
+@dataclass(slots=True, frozen=True)
+class PlanEntry:
+    src: str
+    dst: str
+    name: str
+    filetype: str
+    date: str
+    # The size of the source when it was planned, used to detect files that changed since
+    size: int
+
+    def target(self) -> str:
+        return os.path.join(self.dst, self.name)
+
+
+# Writes an import plan as JSON Lines: a header with the source and the destination, then one line per file.
+# Entries can be written from several threads
+class PlanWriter:
+    def __init__(self, path: str, source: str, destination: str) -> None:
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+        self._write(
+            {
+                "version": PLAN_VERSION,
+                "source": source,
+                "destination": destination,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+        )
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def add(self, entry: PlanEntry) -> None:
+        with self._lock:
+            self._write(asdict(entry))
+            self.count += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+# Raised when a plan file can not be read
+class PlanError(Exception):
+    pass
+
+
+# Reads the header of a plan, returns it as a dict
+def readPlanHeader(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except json.JSONDecodeError as e:
+            raise PlanError(f"'{path}' is not an import plan: {e}")
+    if not isinstance(header, dict) or header.get("version") != PLAN_VERSION:
+        raise PlanError(f"'{path}' is not an import plan of version {PLAN_VERSION}")
+    return header
+
+
+# Yields the entries of a plan
+def readPlan(path: str):
+    readPlanHeader(path)
+    with open(path, encoding="utf-8") as f:
+        f.readline()
+        for number, line in enumerate(f, 2):
+            if not line.strip():
+                continue
+            try:
+                yield PlanEntry(**json.loads(line))
+            except (json.JSONDecodeError, TypeError) as e:
+                raise PlanError(f"Invalid entry on line {number} of '{path}': {e}")
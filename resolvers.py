@@ -0,0 +1,218 @@
+#!/usr/bin/python
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from metadata import MetaRecord, extension_type
+
+# The sources the capture date of a file can be resolved from, from the cheapest to the most expensive one:
+# header: the headers of the common formats, parsed in python (see headers.py)
+# filename: a date in the file name, as phones and messengers write them (IMG_20240512_..., PXL_..., VID_..., 2024-05-12 ...)
+# sidecar: the XMP sidecar of the file (IMG_0001.xmp or IMG_0001.CR3.xmp)
+# exiftool: exiftool, for every file none of the earlier sources could date
+# mtime: the modification time of the file, it always gives a date
+DATE_SOURCES = ("header", "filename", "sidecar", "exiftool", "mtime")
+# The chain of every metadata mode (see metadata.METADATA_MODES), used unless a chain is configured
+MODE_CHAINS = {
+    "fast": ("header",),
+    "hybrid": ("header", "exiftool"),
+    "exiftool": ("exiftool",),
+}
+# The filetypes exiftool reports for the extensions whose name differs. Used for files that were dated without exiftool
+EXTENSION_FILETYPES = {"jpg": "jpeg", "jpe": "jpeg", "jfif": "jpeg", "tif": "tiff", "mts": "m2ts", "m2t": "m2ts", "mpg": "mpeg"}
+# A date in a file name: YYYYMMDD or YYYY-MM-DD (any of - _ . as separators), not inside a longer number or word
+FILENAME_DATE = re.compile(
+    r"(?:^|(?<=[^0-9A-Za-z]))((?:19[7-9]|20\d)\d)[-_.]?(0[1-9]|1[0-2])[-_.]?(0[1-9]|[12]\d|3[01])(?![0-9])"
+)
+# The XMP properties holding the capture date, as attributes or as elements
+SIDECAR_DATE = re.compile(
+    rb"(?:exif:DateTimeOriginal|photoshop:DateCreated|xmp:CreateDate)(?:\s*=\s*[\"']|>)\s*(\d{4})-(\d{2})-(\d{2})"
+)
+# The number of bytes read from a sidecar, and the number of directory listings kept to find sidecars
+SIDECAR_READ = 256 * 1024
+LISTINGS = 256
+
+
+# The date in the name of a file in the YYYY.MM.DD format, None if it has none. Dates in the future are not trusted
+def filenameDate(path: str) -> str | None:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    match = FILENAME_DATE.search(stem)
+    if match is None:
+        return None
+    try:
+        date = datetime(*(int(g) for g in match.groups()))
+    except ValueError:
+        return None
+    if date > datetime.now():
+        return None
+    return date.strftime("%Y.%m.%d")
+
+
+# The capture date of an XMP file in the YYYY.MM.DD format, None if it has none
+def xmpDate(path: str) -> str | None:
+    try:
+        with open(path, "rb") as f:
+            match = SIDECAR_DATE.search(f.read(SIDECAR_READ))
+    except OSError:
+        return None
+    if match is None:
+        return None
+    return b".".join(match.groups()).decode()
+
+
+# The modification date of a file in the YYYY.MM.DD format
+def mtimeDate(path: str) -> str | None:
+    try:
+        return datetime.fromtimestamp(os.stat(path).st_mtime).strftime("%Y.%m.%d")
+    except (OSError, ValueError, OverflowError):
+        return None
+
+
+# The state of the resolution of a batch of files.
+# records are the records read from the headers, exiftool or the cache: they tell the filetype, and the date if they have one.
+# dates and sources are the dates found so far and the source each one came from
+class Resolution:
+    __slots__ = ("resolver", "paths", "records", "read", "dates", "sources")
+
+    def __init__(self, resolver, paths: list[str]) -> None:
+        # The DateResolver that started the resolution, it has to finish it
+        self.resolver = resolver
+        self.paths = paths
+        self.records = {}
+        # The records that were read (not taken from the cache), these can be cached
+        self.read = {}
+        self.dates = {}
+        self.sources = {}
+
+    # Adds records read from the headers or exiftool
+    def add(self, records: dict, source: str) -> None:
+        for path, record in records.items():
+            if record is None:
+                continue
+            self.records[path] = record
+            self.read[path] = record
+            if record.date is not None and path not in self.dates:
+                self.dates[path] = record.date
+                self.sources[path] = source
+
+
+# Resolves the capture dates of files by asking the sources of chain in order, every file only until one of them gave a date.
+# The header and exiftool sources also tell the filetype, files that were dated by the other sources get the filetype of their extension.
+# The number of files dated by each source (none: by no source, they go into the directory of the current day) is kept in counts
+class DateResolver:
+    def __init__(self, chain: tuple = MODE_CHAINS["hybrid"], metrics=None) -> None:
+        if not chain:
+            raise ValueError("The date resolution chain needs at least one source")
+        for source in chain:
+            if source not in DATE_SOURCES:
+                raise ValueError(f"Unknown date source: {source}")
+        if len(set(chain)) != len(chain):
+            raise ValueError(f"A date source is repeated in the chain: {', '.join(chain)}")
+        self.chain = tuple(chain)
+        self.metrics = metrics
+        self.counts = dict.fromkeys(("cache",) + self.chain + ("none",), 0)
+        self._lock = threading.Lock()
+        self._listings = OrderedDict()
+
+    # Runs the sources before exiftool. read_headers is called with the paths whose headers have to be parsed (see headers.read_headers),
+    # cached are the records of the files in the metadata cache. Returns the resolution and the paths that need exiftool
+    def start(self, paths: list[str], read_headers, cached: dict | None = None):
+        resolution = Resolution(self, paths)
+        for path, record in (cached or {}).items():
+            resolution.records[path] = record
+            if record.date is not None:
+                resolution.dates[path] = record.date
+                resolution.sources[path] = "cache"
+        for source in self.chain:
+            if source == "exiftool":
+                # Files whose headers were parsed have no date exiftool would find
+                return resolution, [p for p in paths if p not in resolution.dates and p not in resolution.records]
+            self._run(source, resolution, read_headers)
+        return resolution, []
+
+    # Runs the sources after exiftool and returns the records of the files.
+    # The records exiftool read have to be added to the resolution first (Resolution.add(records, "exiftool"))
+    def finish(self, resolution: Resolution) -> dict[str, MetaRecord]:
+        if "exiftool" in self.chain:
+            for source in self.chain[self.chain.index("exiftool") + 1 :]:
+                self._run(source, resolution, None)
+        records = {}
+        counts = {}
+        for path in resolution.paths:
+            record = resolution.records.get(path)
+            date = resolution.dates.get(path)
+            if record is None:
+                filetype = extension_type(path)
+                if date is not None:
+                    filetype = EXTENSION_FILETYPES.get(filetype, filetype)
+                record = MetaRecord(filetype, date)
+            elif record.date != date:
+                record = MetaRecord(record.filetype, date)
+            records[path] = record
+            source = resolution.sources.get(path, "none")
+            counts[source] = counts.get(source, 0) + 1
+        with self._lock:
+            for source, n in counts.items():
+                self.counts[source] += n
+        if self.metrics is not None:
+            for source, n in counts.items():
+                self.metrics.count("dates_resolved", n, source=source)
+        return records
+
+    def _run(self, source: str, resolution: Resolution, read_headers) -> None:
+        pending = [p for p in resolution.paths if p not in resolution.dates]
+        if not pending:
+            return
+        if source == "header":
+            unread = [p for p in pending if p not in resolution.records]
+            if unread:
+                resolution.add(read_headers(unread), "header")
+            return
+        for path in pending:
+            if source == "filename":
+                date = filenameDate(path)
+            elif source == "sidecar":
+                sidecar = self.sidecar(path)
+                date = None if sidecar is None else xmpDate(sidecar)
+            else:
+                date = mtimeDate(path)
+            if date is not None:
+                resolution.dates[path] = date
+                resolution.sources[path] = source
+
+    # Finds the XMP sidecar of a file: IMG_0001.xmp or IMG_0001.CR3.xmp, in any case.
+    # A directory is only listed again if it changed since it was last listed
+    def sidecar(self, path: str) -> str | None:
+        directory, name = os.path.split(path)
+        try:
+            mtime = os.stat(directory or ".").st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is not None:
+                self._listings.move_to_end(directory)
+        if listing is None or listing[0] != mtime:
+            try:
+                listing = (mtime, {n.lower(): n for n in os.listdir(directory or ".")})
+            except OSError:
+                return None
+            with self._lock:
+                self._listings[directory] = listing
+                if len(self._listings) > LISTINGS:
+                    self._listings.popitem(last=False)
+        names = listing[1]
+        lower = name.lower()
+        for candidate in (os.path.splitext(lower)[0] + ".xmp", lower + ".xmp"):
+            found = names.get(candidate)
+            if found is not None:
+                return os.path.join(directory, found)
+        return None
+
+    # A short summary of the sources the dates came from
+    def report(self) -> str:
+        with self._lock:
+            parts = [f"{source} {n}" for source, n in self.counts.items() if n or source in self.chain]
+        return f"Capture dates resolved by: {', '.join(parts)}"
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The order in which the files of the source are processed:
+# walk: the order they are discovered in (directory listing order)
+# inode: grouped by device, ordered by directory and inode number within a device
+# extent: grouped by device, ordered by the physical location of their data (FIEMAP, Linux only), falling back to inode order
+SCHEDULE_POLICIES = ("walk", "inode", "extent")
+
+# The ioctl that maps the extents of a file, and the sizes of struct fiemap and struct fiemap_extent
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_SIZE = 32
+FIEMAP_EXTENT_SIZE = 56
+
+
+# Returns the physical offset of the first extent of a file, None if it can not be determined
+def firstExtent(path: str) -> int | None:
+    if fcntl is None:
+        return None
+    request = bytearray(FIEMAP_SIZE + FIEMAP_EXTENT_SIZE)
+    # fm_start = 0, fm_length = the whole file, fm_flags = 0, fm_extent_count = 1
+    struct.pack_into("=QQLLLL", request, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request, True)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    (mapped,) = struct.unpack_from("=L", request, 20)
+    if mapped == 0:
+        return None
+    (physical,) = struct.unpack_from("=Q", request, FIEMAP_SIZE + 8)
+    return physical
+
+
+# Orders files (paths or os.DirEntry objects) for sequential reading. Files are grouped by the device they are on and
+# sorted within a device, then the devices take turns, so that every device is read in order while all of them are busy.
+# Only window files are ordered at a time, so that the first files can be processed before every file has been discovered
+def schedule(files, policy: str = "inode", window: int = 10_000):
+    if policy not in SCHEDULE_POLICIES:
+        raise ValueError(f"Unknown scheduling policy: {policy}")
+    if policy == "walk":
+        yield from files
+        return
+    pending = []
+    for f in files:
+        pending.append(f)
+        if len(pending) >= window:
+            yield from _ordered(pending, policy)
+            pending = []
+    yield from _ordered(pending, policy)
+
+
+def _ordered(files: list, policy: str) -> list:
+    devices = {}
+    for f in files:
+        path = os.fspath(f)
+        try:
+            st = f.stat() if isinstance(f, os.DirEntry) else os.stat(path)
+        except OSError:
+            devices.setdefault(None, []).append(((0, path), f))
+            continue
+        if policy == "extent":
+            extent = firstExtent(path)
+            # Files without a known extent (e.g. empty or inline ones) go after the rest, in inode order
+            key = (0, extent) if extent is not None else (1, st.st_ino)
+        else:
+            key = (os.path.dirname(path), st.st_ino)
+        devices.setdefault(st.st_dev, []).append((key, f))
+    queues = [sorted(entries, key=lambda e: e[0]) for entries in devices.values()]
+    ordered = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        for q in queues:
+            if i < len(q):
+                ordered.append(q[i][1])
+    return ordered
+
+
+# Limits the number of threads working on files of the same device at the same time. 0 means no limit
+class DeviceLimiter:
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._devices = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    # The device of a file, cached per directory
+    def device(self, path: str) -> int | None:
+        parent = os.path.dirname(path)
+        dev = self._devices.get(parent)
+        if dev is None:
+            try:
+                dev = os.stat(parent or ".").st_dev
+            except OSError:
+                return None
+            self._devices[parent] = dev
+        return dev
+
+    @contextmanager
+    def slot(self, path: str):
+        if self.limit <= 0:
+            yield
+            return
+        dev = self.device(path)
+        with self._lock:
+            semaphore = self._slots.get(dev)
+            if semaphore is None:
+                semaphore = self._slots[dev] = threading.Semaphore(self.limit)
+        with semaphore:
+            yield
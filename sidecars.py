@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+import os
+from metadata import MetaRecord, extension_type
+from resolvers import EXTENSION_FILETYPES
+
+# Files that describe another file of the same name instead of being media themselves: edits (XMP, RawTherapee, DxO),
+# iOS adjustments, camera thumbnails and GoPro low resolution proxies. They are placed next to the file they belong to
+SIDECAR_EXTENSIONS = {".xmp", ".pp3", ".dop", ".aae", ".thm", ".lrv"}
+# Members the header parser reads (see headers.py), so the date of their group can be resolved without exiftool
+HEADER_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".heic", ".heif", ".tif", ".tiff", ".dng", ".cr2", ".nef", ".arw",
+    ".mp4", ".m4v", ".mov", ".3gp",
+}
+# RAW formats. The RAW of a group is its lead: the sidecars are placed next to it
+RAW_EXTENSIONS = {
+    ".cr2", ".cr3", ".crw", ".nef", ".nrw", ".arw", ".srf", ".sr2", ".dng", ".raf", ".orf", ".rw2",
+    ".pef", ".srw", ".x3f", ".3fr", ".iiq", ".erf", ".mrw", ".rwl",
+}
+
+
+def _extension(f) -> str:
+    return os.path.splitext(os.fspath(f))[1].lower()
+
+
+def isSidecar(f) -> bool:
+    return _extension(f) in SIDECAR_EXTENSIONS
+
+
+# The key files are grouped by: their directory and their name without the extension, case-insensitively.
+# Sidecars named after the whole file name (IMG_0001.CR3.xmp) belong to IMG_0001 as well
+def groupKey(f) -> tuple[str, str]:
+    directory, name = os.path.split(os.fspath(f))
+    stem, ext = os.path.splitext(name.lower())
+    if ext in SIDECAR_EXTENSIONS:
+        inner, inner_ext = os.path.splitext(stem)
+        if inner and 1 < len(inner_ext) <= 5:
+            stem = inner
+    return directory, stem
+
+
+# The order the members of a group are probed in: the ones the header parser reads first, then the other media, the sidecars last
+def probeRank(f) -> int:
+    ext = _extension(f)
+    if ext in HEADER_EXTENSIONS:
+        return 0
+    if ext in SIDECAR_EXTENSIONS:
+        return 2
+    return 1
+
+
+# The filetype of a member that was not read, from its extension (see resolvers.EXTENSION_FILETYPES)
+def extensionFiletype(f) -> str:
+    filetype = extension_type(os.fspath(f))
+    return EXTENSION_FILETYPES.get(filetype, filetype)
+
+
+# Files of the same directory and name (IMG_0001.CR3, IMG_0001.JPG, IMG_0001.xmp). The metadata of the probe (the first member)
+# is read for the whole group. The group can be used as a path, it is the path of the probe
+class FileGroup:
+    __slots__ = ("members",)
+
+    def __init__(self, members: list) -> None:
+        self.members = sorted(members, key=lambda f: (probeRank(f), os.fspath(f)))
+
+    def __fspath__(self) -> str:
+        return os.fspath(self.members[0])
+
+    @property
+    def probe(self):
+        return self.members[0]
+
+    # The media members other than the probe, they are probed if the probe has no date
+    def others(self) -> list:
+        return [m for m in self.members[1:] if not isSidecar(m)]
+
+    # The member the sidecars are placed next to: the RAW if there is one, the probe otherwise
+    def lead(self):
+        for m in self.members:
+            if _extension(m) in RAW_EXTENSIONS:
+                return m
+        return self.probe
+
+    # The record of every member, given the record of the probe and the date of the group.
+    # Media members go into the directory of their own filetype, the sidecars into the one of the lead, all under the group's date
+    def records(self, record: MetaRecord, date: str | None) -> list[tuple[str, MetaRecord]]:
+        lead = self.lead()
+        lead_type = record.filetype if lead is self.probe else extensionFiletype(lead)
+        out = []
+        for m in self.members:
+            if m is self.probe:
+                filetype = record.filetype
+            elif isSidecar(m):
+                filetype = lead_type
+            else:
+                filetype = extensionFiletype(m)
+            out.append((os.fspath(m), MetaRecord(filetype, date)))
+        return out
+
+
+# Groups files (paths or os.DirEntry objects) by directory and name. Files are grouped while they come from the same directory,
+# discovery (GetFiles) yields the files directory by directory. Every file ends up in exactly one group, most groups have a single member.
+# Files for which single returns True get a group of their own
+def groupFiles(files, single=None):
+    directory = None
+    groups = {}
+    for f in files:
+        if single is not None and single(f):
+            yield FileGroup([f])
+            continue
+        key = groupKey(f)
+        if key[0] != directory:
+            yield from (FileGroup(members) for members in groups.values())
+            groups = {}
+            directory = key[0]
+        groups.setdefault(key[1], []).append(f)
+    yield from (FileGroup(members) for members in groups.values())
@@ -0,0 +1,106 @@
+import os
+import threading
+
+from duplicates import DuplicateIndex, uniqueName
+
+
+def write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def library(tmp_path):
+    root = tmp_path / "library"
+    root.mkdir()
+    return root
+
+
+# A file with a size no file of the library has is not hashed at all
+def test_unique_size_needs_no_hash(tmp_path):
+    root = library(tmp_path)
+    write(root / "a.jpg", b"a" * 100)
+    index = DuplicateIndex()
+    assert index.build(str(root)) == 1
+    assert index.find(write(tmp_path / "new.jpg", b"b" * 50), 50) is None
+    assert (index.quick_hashes, index.full_hashes) == (0, 0)
+
+
+def test_same_size_different_content_is_told_apart_by_the_quick_hash(tmp_path):
+    root = library(tmp_path)
+    write(root / "a.jpg", b"a" * 100)
+    index = DuplicateIndex()
+    index.build(str(root))
+    assert index.find(write(tmp_path / "new.jpg", b"b" * 100), 100) is None
+    assert (index.quick_hashes, index.full_hashes) == (2, 0)
+
+
+# The quick hash covers the whole content of small files, a match needs no full hash
+def test_small_duplicate_is_found_by_the_quick_hash(tmp_path):
+    root = library(tmp_path)
+    existing = write(root / "a.jpg", b"a" * 100)
+    index = DuplicateIndex()
+    index.build(str(root))
+    assert index.find(write(tmp_path / "new.jpg", b"a" * 100), 100) == existing
+    assert (index.quick_hashes, index.full_hashes, index.matches) == (2, 0, 1)
+
+
+# Large files with the same first and last blocks are compared by their full hash
+def test_large_files_are_compared_fully(tmp_path):
+    root = library(tmp_path)
+    block = 1024
+    head, middle, tail = os.urandom(block), os.urandom(4 * block), os.urandom(block)
+    existing = write(root / "a.mov", head + middle + tail)
+    index = DuplicateIndex(block_size=block)
+    index.build(str(root))
+    size = 6 * block
+    changed = write(tmp_path / "changed.mov", head + os.urandom(4 * block) + tail)
+    assert index.find(changed, size) is None
+    assert index.full_hashes == 2
+    same = write(tmp_path / "same.mov", head + middle + tail)
+    assert index.find(same, size) == existing
+
+
+# A file planned into the library is found through its source until it is moved
+def test_files_of_the_same_import_are_found_through_their_source(tmp_path):
+    index = DuplicateIndex()
+    first = write(tmp_path / "first.jpg", b"a" * 100)
+    index.add(str(tmp_path / "library" / "first.jpg"), 100, first)
+    assert index.find(write(tmp_path / "second.jpg", b"a" * 100), 100) == str(tmp_path / "library" / "first.jpg")
+
+
+def test_unique_name(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"")
+    (tmp_path / "a_1.jpg").write_bytes(b"")
+    assert uniqueName(str(tmp_path), "a.jpg") == "a_2.jpg"
+
+
+# A source that can not be read is not a duplicate, it does not fail the other files
+def test_unreadable_source_is_not_a_duplicate(tmp_path):
+    root = library(tmp_path)
+    write(root / "a.jpg", b"a" * 100)
+    index = DuplicateIndex()
+    index.build(str(root))
+    assert index.find(str(tmp_path / "gone.jpg"), 100) is None
+
+
+# Identical files imported at the same time: exactly one of them is kept, the others are its duplicates
+def test_concurrent_identical_files_are_kept_once(tmp_path):
+    index = DuplicateIndex()
+    sources = [write(tmp_path / f"{i}.jpg", b"a" * 100) for i in range(8)]
+    barrier = threading.Barrier(len(sources))
+    matches = {}
+
+    def check(i, src):
+        barrier.wait()
+        matches[src] = index.findOrAdd(src, 100, str(tmp_path / "library" / f"{i}.jpg"))
+
+    threads = [threading.Thread(target=check, args=(i, src)) for i, src in enumerate(sources)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    kept = [src for src, match in matches.items() if match is None]
+    assert len(kept) == 1
+    assert index.matches == len(sources) - 1
+    # Every file is hashed once, the kept one through its source
+    assert index.quick_hashes == len(sources)
@@ -0,0 +1,66 @@
+import threading
+
+from exifpool import ExifToolPool
+
+
+# A stand-in for an exiftool process, the pool only checks whether it is running
+class Process:
+    def __init__(self) -> None:
+        self.running = True
+
+    def terminate(self) -> None:
+        self.running = False
+
+
+# A pool whose processes can be made to fail to start
+class Pool(ExifToolPool):
+    def __init__(self, size: int) -> None:
+        super().__init__(size)
+        self.fail = False
+
+    def _spawn(self):
+        if self.fail:
+            raise OSError("exiftool could not be started")
+        self.started += 1
+        return Process()
+
+
+def test_processes_are_reused():
+    pool = Pool(2)
+    with pool.checkout() as first:
+        pass
+    with pool.checkout() as second:
+        assert second is first
+    assert (pool.started, pool.checkouts) == (1, 2)
+
+
+# Checks a process out in another thread, returns the exception it raised (None if it succeeded), or False if it is still waiting
+def checkoutWithin(pool: ExifToolPool, timeout: float = 5):
+    outcome = []
+
+    def checkout():
+        try:
+            with pool.checkout():
+                pass
+            outcome.append(None)
+        except Exception as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=checkout, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return outcome[0] if outcome else False
+
+
+# A process that died while idle is replaced. If the replacement can not be started its slot is freed,
+# so the pool does not shrink until checkouts wait forever
+def test_failed_respawns_free_their_slot():
+    pool = Pool(1)
+    with pool.checkout() as et:
+        pass
+    et.running = False
+    pool.fail = True
+    for _ in range(3):
+        assert isinstance(checkoutWithin(pool), OSError)
+    pool.fail = False
+    assert checkoutWithin(pool) is None
@@ -0,0 +1,198 @@
+import struct
+
+from headers import read_header
+from metadata import MetaRecord
+
+DATE = b"2021:03:04 12:30:00"
+
+
+# A TIFF structure with Make in IFD0 and DateTimeOriginal in the Exif IFD. prefix is placed between the header and IFD0 (e.g. the CR2 marker)
+def tiffBlock(date: bytes | None = DATE, make: bytes = b"Canon", bo: str = "<", prefix: bytes = b"") -> bytes:
+    ifd0 = 8 + len(prefix)
+    exif = ifd0 + 2 + 2 * 12 + 4
+    data = exif + 2 + 12 + 4
+    make = make + b"\0"
+    date = date + b"\0" if date is not None else None
+    out = (b"II" if bo == "<" else b"MM") + struct.pack(bo + "HI", 42, ifd0) + prefix
+    out += struct.pack(bo + "H", 2)
+    out += struct.pack(bo + "HHII", 0x010F, 2, len(make), data)
+    out += struct.pack(bo + "HHII", 0x8769, 4, 1, exif)
+    out += struct.pack(bo + "I", 0)
+    if date is None:
+        out += struct.pack(bo + "H", 0) + b"\0" * 16
+    else:
+        out += struct.pack(bo + "H", 1) + struct.pack(bo + "HHII", 0x9003, 2, len(date), data + len(make))
+        out += struct.pack(bo + "I", 0)
+    out += make + (date or b"")
+    return out
+
+
+def segment(marker: int, payload: bytes) -> bytes:
+    return struct.pack(">BBH", 0xFF, marker, len(payload) + 2) + payload
+
+
+def jpeg(*segments: bytes) -> bytes:
+    return b"\xff\xd8" + b"".join(segments) + segment(0xDA, b"\0" * 10) + b"\0" * 64 + b"\xff\xd9"
+
+
+def chunk(ctype: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload), ctype) + payload + b"\0\0\0\0"
+
+
+def box(btype: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), btype) + payload
+
+
+# A HEIC file whose Exif item is located by iloc in an mdat box after the meta box
+def heic(tiff: bytes) -> bytes:
+    ftyp = box(b"ftyp", b"heic" + b"\0\0\0\0" + b"mif1heic")
+    infe = box(b"infe", b"\x02\0\0\0" + struct.pack(">HH", 1, 0) + b"Exif" + b"\0")
+    iinf = box(b"iinf", b"\0\0\0\0" + struct.pack(">H", 1) + infe)
+    item = struct.pack(">I", 6) + b"Exif\0\0" + tiff
+
+    def meta(offset: int) -> bytes:
+        iloc = box(
+            b"iloc",
+            b"\0\0\0\0" + bytes([0x44, 0x00]) + struct.pack(">HHHHII", 1, 1, 0, 1, offset, len(item)),
+        )
+        return box(b"meta", b"\0\0\0\0" + iinf + iloc)
+
+    offset = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(offset) + box(b"mdat", item)
+
+
+def write(tmp_path, name: str, data: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_jpeg_exif_date(tmp_path):
+    path = write(tmp_path, "a.jpg", jpeg(segment(0xE1, b"Exif\0\0" + tiffBlock())))
+    assert read_header(path) == MetaRecord("jpeg", "2021.03.04")
+
+
+def test_jpeg_big_endian_exif(tmp_path):
+    path = write(tmp_path, "a.jpg", jpeg(segment(0xE1, b"Exif\0\0" + tiffBlock(bo=">"))))
+    assert read_header(path) == MetaRecord("jpeg", "2021.03.04")
+
+
+def test_jpeg_without_metadata_has_no_date(tmp_path):
+    path = write(tmp_path, "a.jpg", jpeg(segment(0xE0, b"JFIF\0\1\1\0\0\1\0\1\0\0")))
+    assert read_header(path) == MetaRecord("jpeg", None)
+
+
+# exiftool may find a date in the XMP the parser does not read
+def test_jpeg_with_xmp_and_no_exif_date_is_left_to_exiftool(tmp_path):
+    xmp = segment(0xE1, b"http://ns.adobe.com/xap/1.0/\0<x:xmpmeta/>")
+    path = write(tmp_path, "a.jpg", jpeg(segment(0xE1, b"Exif\0\0" + tiffBlock(date=None)), xmp))
+    assert read_header(path) is None
+
+
+# exiftool reports multi picture JPEGs as MPO
+def test_mpo_is_left_to_exiftool(tmp_path):
+    path = write(tmp_path, "a.jpg", jpeg(segment(0xE1, b"Exif\0\0" + tiffBlock()), segment(0xE2, b"MPF\0" + b"\0" * 8)))
+    assert read_header(path) is None
+
+
+def test_truncated_jpeg_is_left_to_exiftool(tmp_path):
+    data = jpeg(segment(0xE1, b"Exif\0\0" + tiffBlock()))
+    path = write(tmp_path, "a.jpg", data[:20])
+    assert read_header(path) is None
+
+
+def test_png_exif_chunk(tmp_path):
+    data = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", b"\0" * 13) + chunk(b"eXIf", tiffBlock()) + chunk(b"IEND", b"")
+    path = write(tmp_path, "a.png", data)
+    assert read_header(path) == MetaRecord("png", "2021.03.04")
+
+
+def test_png_without_exif_has_no_date(tmp_path):
+    data = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", b"\0" * 13) + chunk(b"IDAT", b"\0") + chunk(b"IEND", b"")
+    path = write(tmp_path, "a.png", data)
+    assert read_header(path) == MetaRecord("png", None)
+
+
+def test_heic_exif_item(tmp_path):
+    path = write(tmp_path, "a.heic", heic(tiffBlock()))
+    assert read_header(path) == MetaRecord("heic", "2021.03.04")
+
+
+def test_tiff(tmp_path):
+    path = write(tmp_path, "a.tif", tiffBlock())
+    assert read_header(path) == MetaRecord("tiff", "2021.03.04")
+
+
+def test_cr2(tmp_path):
+    path = write(tmp_path, "a.cr2", tiffBlock(prefix=b"CR\x02\0\0\0\0\0"))
+    assert read_header(path) == MetaRecord("cr2", "2021.03.04")
+
+
+# TIFF based RAWs exiftool may report differently are left to it
+def test_unknown_tiff_raw_is_left_to_exiftool(tmp_path):
+    path = write(tmp_path, "a.orf", tiffBlock(make=b"OLYMPUS"))
+    assert read_header(path) is None
+
+
+def test_unknown_format_is_left_to_exiftool(tmp_path):
+    path = write(tmp_path, "a.bin", b"not a media file at all")
+    assert read_header(path) is None
+
+
+def test_missing_file_is_left_to_exiftool(tmp_path):
+    assert read_header(str(tmp_path / "missing.jpg")) is None
+
+
+# The seconds between the QuickTime epoch (1904-01-01) and 2020-05-06 00:00 UTC
+MVHD_2020_05_06 = 3671568000
+
+
+def mvhd(seconds: int, version: int = 0) -> bytes:
+    if version == 1:
+        return box(b"mvhd", b"\x01\0\0\0" + struct.pack(">QQ", seconds, seconds) + b"\0" * 88)
+    return box(b"mvhd", b"\0\0\0\0" + struct.pack(">II", seconds, seconds) + b"\0" * 88)
+
+
+# A QuickTime meta atom with the creation date in its keys/ilst pair
+def keysMeta(date: bytes) -> bytes:
+    hdlr = box(b"hdlr", b"\0" * 24)
+    key = b"com.apple.quicktime.creationdate"
+    keys = box(b"keys", b"\0\0\0\0" + struct.pack(">I", 1) + struct.pack(">I4s", 8 + len(key), b"mdta") + key)
+    ilst = box(b"ilst", box(b"\0\0\0\x01", box(b"data", b"\0\0\0\x01" + b"\0\0\0\0" + date)))
+    return box(b"meta", hdlr + keys + ilst)
+
+
+def movie(brand: bytes, *moov: bytes) -> bytes:
+    return box(b"ftyp", brand + b"\0\0\0\0" + brand) + box(b"mdat", b"\0" * 256) + box(b"moov", b"".join(moov))
+
+
+def test_mp4_movie_header_date(tmp_path):
+    path = write(tmp_path, "a.mp4", movie(b"isom", mvhd(MVHD_2020_05_06)))
+    assert read_header(path) == MetaRecord("mp4", "2020.05.06")
+
+
+def test_mp4_version_1_movie_header_date(tmp_path):
+    path = write(tmp_path, "a.mp4", movie(b"mp42", mvhd(MVHD_2020_05_06, version=1)))
+    assert read_header(path) == MetaRecord("mp4", "2020.05.06")
+
+
+# The local date of the metadata keys is preferred over the UTC creation time of the movie header
+def test_mov_keys_date_is_preferred(tmp_path):
+    path = write(tmp_path, "a.mov", movie(b"qt  ", mvhd(MVHD_2020_05_06), keysMeta(b"2020-05-05T23:30:00-0200")))
+    assert read_header(path) == MetaRecord("mov", "2020.05.05")
+
+
+def test_unset_movie_header_date(tmp_path):
+    path = write(tmp_path, "a.mp4", movie(b"isom", mvhd(0)))
+    assert read_header(path) == MetaRecord("mp4", None)
+
+
+def test_mov_without_ftyp(tmp_path):
+    path = write(tmp_path, "a.mov", box(b"wide", b"") + box(b"moov", mvhd(MVHD_2020_05_06)))
+    assert read_header(path) == MetaRecord("mov", "2020.05.06")
+
+
+# A corrupt creation time does not fail the batch, the file is left to exiftool
+def test_corrupt_movie_header_date_is_left_to_exiftool(tmp_path):
+    path = write(tmp_path, "a.mp4", movie(b"isom", mvhd(2**64 - 1, version=1)))
+    assert read_header(path) is None
@@ -0,0 +1,63 @@
+import os
+import threading
+
+from importer import Importer, Options
+
+# The smallest JPEG the header parser reads
+JPEG = b"\xff\xd8\xff\xd9"
+
+
+# found_files_event reports the running count, collected_files_event the paths once the search has finished
+def test_discovery_events(tmp_path):
+    source = tmp_path / "src"
+    (source / "sub").mkdir(parents=True)
+    paths = sorted(str(source / name) for name in ("a.jpg", "b.jpg", "sub/c.jpg"))
+    for path in paths:
+        open(path, "wb").close()
+    importer = Importer()
+    found = []
+    collected = []
+    importer.found_files_event.__isub__(lambda args, kwds: found.append(args[0]))
+    importer.collected_files_event.__isub__(lambda args, kwds: collected.append(args[0]))
+    files = list(importer.GetFiles(str(source), isRecursive=True, report_every=2))
+    assert sorted(str(f.path) for f in files) == paths
+    assert found == [2, 3]
+    assert len(collected) == 1
+    assert sorted(collected[0]) == paths
+
+
+# A watch session indexes the destination once, the files imported by a batch are found as duplicates by the later ones
+def test_watch_keeps_the_duplicate_index_between_batches(tmp_path):
+    source = tmp_path / "src"
+    destination = tmp_path / "dst"
+    source.mkdir()
+    (source / "a.jpg").write_bytes(JPEG)
+    options = Options(
+        source=str(source),
+        destination=str(destination),
+        force_overwrite=False,
+        metadata_mode="fast",
+        cache_path=None,
+        duplicates="skip",
+        settle=0,
+        watch_interval=0.05,
+        watch_backend="poll",
+    )
+    importer = Importer()
+    messages = []
+    matches = []
+    importer.events.__isub__(lambda args, kwds: messages.append(kwds["args"][0]), 1)
+    # The second batch is only written once the first one was imported
+    importer.copy_done_event.__isub__(lambda args, kwds: (source / "b.jpg").write_bytes(JPEG))
+    importer.duplicate_event.__isub__(lambda args, kwds: (matches.append(args), importer.cancel()))
+    timeout = threading.Timer(10, importer.cancel)
+    timeout.start()
+    try:
+        importer.watchSource(options)
+    finally:
+        timeout.cancel()
+    assert len(matches) == 1
+    assert matches[0][0] == str(source / "b.jpg")
+    assert os.path.basename(matches[0][1]) == "a.jpg"
+    assert len([m for m in messages if m.startswith("Indexed")]) == 1
+    assert os.listdir(source) == ["b.jpg"]
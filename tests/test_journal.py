@@ -0,0 +1,190 @@
+import os
+
+from importer import Importer, Options
+from journal import Journal, journalPath, recover, replay
+from metadata import MetaRecord
+from transfer import PARTIAL_SUFFIX
+
+# The smallest JPEG the header parser reads: it has no metadata, so it is imported into the directory of the current day
+JPEG = b"\xff\xd8\xff\xd9"
+
+
+def test_replay_keeps_the_last_state_of_every_file(tmp_path):
+    path = str(tmp_path / "journal")
+    with Journal(path) as journal:
+        journal.begin("/src", keep_source=False)
+        journal.planned("/src/a.jpg", MetaRecord("jpeg", "2021.03.04"))
+        journal.planned("/src/b.jpg", MetaRecord("jpeg", None))
+        journal.started("/src/a.jpg", "/dst/jpeg/2021.03.04/a.jpg")
+        journal.completed("/src/a.jpg", "/dst/jpeg/2021.03.04/a.jpg")
+        journal.failed("/src/b.jpg", "broken")
+        journal.skipped("/src/d.jpg", "exists")
+        journal.scanned()
+    # A line cut off by a crash is ignored
+    with open(path, "a") as f:
+        f.write('{"op": "started", "src": "/src/c.j')
+    state = replay(path)
+    assert state.scanned
+    assert not state.keep_source
+    assert set(state.entries) == {"/src/a.jpg", "/src/b.jpg", "/src/d.jpg"}
+    a = state.entries["/src/a.jpg"]
+    assert (a.state, a.dst, a.record()) == ("completed", "/dst/jpeg/2021.03.04/a.jpg", MetaRecord("jpeg", "2021.03.04"))
+    assert state.entries["/src/b.jpg"].state == "failed"
+    assert state.entries["/src/d.jpg"].state == "skipped"
+
+
+# A run appended after a crash does not continue the line that was cut off
+def test_journal_reopened_after_a_crash(tmp_path):
+    path = str(tmp_path / "journal")
+    with Journal(path) as journal:
+        journal.begin("/src", keep_source=False)
+        journal.scanned()
+    with open(path, "a") as f:
+        f.write('{"op": "started", "src": "/src/c.j')
+    with Journal(path) as journal:
+        journal.begin("/src", keep_source=True)
+        journal.planned("/src/a.jpg", MetaRecord("jpeg", None))
+    state = replay(path)
+    assert not state.scanned
+    assert state.keep_source
+    assert list(state.entries) == ["/src/a.jpg"]
+
+
+# Every run starts with a new scan
+def test_replay_of_a_new_run(tmp_path):
+    path = str(tmp_path / "journal")
+    with Journal(path) as journal:
+        journal.begin("/src", keep_source=False)
+        journal.scanned()
+    with Journal(path) as journal:
+        journal.begin("/src", keep_source=True)
+    state = replay(path)
+    assert not state.scanned
+    assert state.keep_source
+
+
+def plannedState(tmp_path, *files):
+    path = str(tmp_path / "journal")
+    with Journal(path) as journal:
+        journal.begin(str(tmp_path / "src"), keep_source=False)
+        for src, dst, op in files:
+            journal.planned(src, MetaRecord("jpeg", None))
+            if op in ("started", "completed"):
+                journal.started(src, dst)
+            if op == "completed":
+                journal.completed(src, dst)
+            if op == "skipped":
+                journal.skipped(src, "exists")
+    return replay(path)
+
+
+# A copy that was cut off is removed and its file is imported again
+def test_recover_removes_partial_copies(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "dst").mkdir()
+    src = tmp_path / "src" / "a.jpg"
+    dst = tmp_path / "dst" / "a.jpg"
+    src.write_bytes(b"image")
+    (tmp_path / "dst" / ("a.jpg" + PARTIAL_SUFFIX)).write_bytes(b"ima")
+    messages = []
+    outstanding = recover(plannedState(tmp_path, (str(src), str(dst), "started")), messages.append)
+    assert list(outstanding) == [str(src)]
+    assert not os.path.exists(str(dst) + PARTIAL_SUFFIX)
+    assert src.exists()
+    assert messages
+
+
+# A complete copy whose source was not removed yet (the copies were not synced) is finished by removing the source,
+# a copy that differs from its source is left alone and the file is imported again. Skipped files stay in the source
+def test_recover_finishes_complete_copies(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "dst").mkdir()
+    done = tmp_path / "src" / "done.jpg"
+    differs = tmp_path / "src" / "differs.jpg"
+    planned = tmp_path / "src" / "planned.jpg"
+    gone = tmp_path / "src" / "gone.jpg"
+    skipped = tmp_path / "src" / "skipped.jpg"
+    for f in (done, differs, planned, skipped):
+        f.write_bytes(b"image")
+    (tmp_path / "dst" / "done.jpg").write_bytes(b"image")
+    (tmp_path / "dst" / "differs.jpg").write_bytes(b"other")
+    state = plannedState(
+        tmp_path,
+        (str(done), str(tmp_path / "dst" / "done.jpg"), "completed"),
+        (str(differs), str(tmp_path / "dst" / "differs.jpg"), "started"),
+        (str(planned), None, "planned"),
+        (str(gone), None, "planned"),
+        (str(skipped), None, "skipped"),
+    )
+    outstanding = recover(state)
+    assert set(outstanding) == {str(differs), str(planned)}
+    assert not done.exists()
+    assert (tmp_path / "dst" / "differs.jpg").read_bytes() == b"other"
+
+
+def options(source, destination, **kwds):
+    return Options(
+        source=str(source),
+        destination=str(destination),
+        force_overwrite=False,
+        metadata_mode="fast",
+        metadata_batch_size=1,
+        move_workers=1,
+        cache_path=None,
+        **kwds,
+    )
+
+
+def imported(destination):
+    return sorted(name for _, _, names in os.walk(destination) for name in names if name.endswith(".jpg"))
+
+
+# The journal is written on the first import into a destination that does not exist yet, and a cancelled import can be resumed from it
+def test_cancelled_import_into_missing_destination_resumes(tmp_path):
+    source = tmp_path / "src"
+    destination = tmp_path / "dst" / "library"
+    source.mkdir()
+    names = [f"IMG_{i:04}.jpg" for i in range(20)]
+    for name in names:
+        (source / name).write_bytes(JPEG)
+
+    messages = []
+    importer = Importer()
+    for lvl in (1, 2, 3):
+        importer.events.__isub__(lambda args, kwds: messages.append(kwds["args"][0]), lvl)
+    importer.copy_done_event.__isub__(lambda args, kwds: importer.cancel())
+    importer.Import(options(source, destination))
+
+    assert not any("journal could not be opened" in m for m in messages), messages
+    assert os.path.exists(journalPath(str(destination)))
+    first = imported(destination)
+    assert 0 < len(first) < len(names)
+
+    importer = Importer()
+    importer.Import(options(source, destination, resume=True))
+
+    assert imported(destination) == sorted(names)
+    assert os.listdir(source) == []
+    assert not os.path.exists(journalPath(str(destination)))
+
+
+# A file whose new path is taken is skipped for good: the import finished, so its journal is removed and no resume is suggested
+def test_collision_does_not_keep_the_journal(tmp_path):
+    source = tmp_path / "src"
+    destination = tmp_path / "dst"
+    source.mkdir()
+    (source / "IMG_0001.jpg").write_bytes(JPEG)
+    Importer().Import(options(source, destination))
+    (source / "IMG_0001.jpg").write_bytes(JPEG + b"\0")
+    (source / "IMG_0002.jpg").write_bytes(JPEG)
+
+    messages = []
+    importer = Importer()
+    for lvl in (1, 2, 3):
+        importer.events.__isub__(lambda args, kwds: messages.append(kwds["args"][0]), lvl)
+    importer.Import(options(source, destination))
+
+    assert imported(destination) == ["IMG_0001.jpg", "IMG_0002.jpg"]
+    assert os.listdir(source) == ["IMG_0001.jpg"]
+    assert not os.path.exists(journalPath(str(destination)))
+    assert not any("--resume" in m for m in messages), messages
@@ -0,0 +1,78 @@
+import os
+
+from metacache import MetadataCache
+from metadata import MetaRecord
+
+
+def stats(*paths) -> dict:
+    return {str(p): os.stat(p) for p in paths}
+
+
+def test_entries_are_found_while_the_file_is_unchanged(tmp_path):
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"image")
+    with MetadataCache(str(tmp_path / "cache.sqlite")) as cache:
+        cache.put_many({str(image): MetaRecord("jpeg", "2021.03.04")}, stats(image))
+        assert cache.get_many(stats(image)) == {str(image): MetaRecord("jpeg", "2021.03.04")}
+        assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_entries_survive_reopening(tmp_path):
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"image")
+    with MetadataCache(str(tmp_path / "cache.sqlite")) as cache:
+        cache.put_many({str(image): MetaRecord("jpeg", None)}, stats(image))
+    with MetadataCache(str(tmp_path / "cache.sqlite")) as cache:
+        assert cache.get_many(stats(image)) == {str(image): MetaRecord("jpeg", None)}
+
+
+# A file that was rewritten (new size and modification time) or replaced (new inode) is read again
+def test_changed_files_are_invalidated(tmp_path):
+    written = tmp_path / "written.jpg"
+    replaced = tmp_path / "replaced.jpg"
+    written.write_bytes(b"image")
+    replaced.write_bytes(b"image")
+    with MetadataCache(str(tmp_path / "cache.sqlite")) as cache:
+        cache.put_many(
+            {str(written): MetaRecord("jpeg", "2021.03.04"), str(replaced): MetaRecord("jpeg", "2021.03.04")},
+            stats(written, replaced),
+        )
+        written.write_bytes(b"another image")
+        os.utime(written, ns=(1, 1))
+        other = tmp_path / "other.jpg"
+        other.write_bytes(b"image")
+        os.utime(other, ns=(os.stat(replaced).st_atime_ns, os.stat(replaced).st_mtime_ns))
+        os.replace(other, replaced)
+        assert cache.get_many(stats(written, replaced)) == {}
+        assert cache.misses == 2
+
+
+# The least recently used entries are evicted above max_entries
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.jpg"
+        path.write_bytes(name.encode())
+        paths.append(path)
+    with MetadataCache(str(tmp_path / "cache.sqlite"), max_entries=2) as cache:
+        cache.put_many({str(paths[0]): MetaRecord("jpeg")}, stats(paths[0]))
+        cache.put_many({str(paths[1]): MetaRecord("jpeg")}, stats(paths[1]))
+        # Using a makes b the least recently used entry
+        assert cache.get_many(stats(paths[0]))
+        cache.put_many({str(paths[2]): MetaRecord("jpeg")}, stats(paths[2]))
+        assert set(cache.get_many(stats(*paths))) == {str(paths[0]), str(paths[2])}
+        assert cache.info()["entries"] == 2
+
+
+def test_prune_removes_missing_and_changed_files(tmp_path):
+    kept = tmp_path / "kept.jpg"
+    removed = tmp_path / "removed.jpg"
+    kept.write_bytes(b"image")
+    removed.write_bytes(b"image")
+    with MetadataCache(str(tmp_path / "cache.sqlite")) as cache:
+        cache.put_many({str(kept): MetaRecord("jpeg"), str(removed): MetaRecord("jpeg")}, stats(kept, removed))
+        removed.unlink()
+        assert cache.prune() == 1
+        assert cache.info()["entries"] == 1
+        cache.clear()
+        assert cache.info()["entries"] == 0
@@ -0,0 +1,57 @@
+import threading
+
+from pipeline import Pipeline, Stage
+
+
+def test_items_go_through_every_stage():
+    seen = []
+    lock = threading.Lock()
+
+    def collect(batch):
+        with lock:
+            seen.extend(batch)
+
+    stages = [
+        Stage("double", lambda batch: [2 * i for i in batch], workers=3, batch_size=4, queue_size=2),
+        Stage("increment", lambda batch: [i + 1 for i in batch], workers=2, batch_size=3, queue_size=2),
+        Stage("collect", collect, workers=1, batch_size=8, queue_size=2),
+    ]
+    stats = Pipeline(range(100), stages).run()
+    assert sorted(seen) == [2 * i + 1 for i in range(100)]
+    assert [s.name for s in stats] == ["discover", "double", "increment", "collect"]
+    assert [s.items for s in stats] == [100, 100, 100, 100]
+    # A stage never gets more items than its batch size at once
+    assert stats[1].batches >= 25
+
+
+# A failing batch is reported and counted, the other batches are still processed
+def test_errors_are_reported_per_batch():
+    errors = []
+
+    def fail_odd(batch):
+        if batch[0] % 2:
+            raise ValueError(f"odd {batch[0]}")
+        return batch
+
+    out = []
+    stages = [Stage("check", fail_odd, workers=2), Stage("collect", out.extend)]
+    stats = Pipeline(range(10), stages, on_error=lambda stage, batch, e: errors.append((stage, batch))).run()
+    assert sorted(out) == [0, 2, 4, 6, 8]
+    assert sorted(batch[0] for _, batch in errors) == [1, 3, 5, 7, 9]
+    assert stats[1].errors == 5
+
+
+# Once should_stop returns True the rest of the source is not read and the queued items are discarded
+def test_should_stop_discards_the_rest():
+    stop = threading.Event()
+    out = []
+
+    def source():
+        for i in range(1000):
+            if i == 10:
+                stop.set()
+            yield i
+
+    stats = Pipeline(source(), [Stage("collect", out.extend)], should_stop=stop.is_set).run()
+    assert stats[0].items == 10
+    assert set(out) <= set(range(10))
@@ -0,0 +1,134 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from metadata import MetaRecord
+from resolvers import DateResolver, filenameDate, xmpDate
+
+
+@pytest.mark.parametrize(
+    "name, date",
+    [
+        ("IMG_20240512_123456.jpg", "2024.05.12"),
+        ("PXL_20230101_000000123.jpg", "2023.01.01"),
+        ("VID-20220704-WA0001.mp4", "2022.07.04"),
+        ("2021-03-04 12.30.00.jpg", "2021.03.04"),
+        ("Screenshot_2020.12.31.png", "2020.12.31"),
+        ("IMG_0001.jpg", None),
+        # Not a valid day, or inside a longer number
+        ("IMG_20240231.jpg", None),
+        ("12024051299.jpg", None),
+        ("DSC20240512.jpg", None),
+    ],
+)
+def test_filename_date(name, date):
+    assert filenameDate(os.path.join("/photos", name)) == date
+
+
+def test_future_filename_dates_are_not_trusted():
+    assert filenameDate(f"IMG_{datetime.now().year + 1}0101.jpg") is None
+
+
+def test_xmp_date(tmp_path):
+    (tmp_path / "a.xmp").write_text('<rdf:Description exif:DateTimeOriginal="2019-08-07T10:00:00"/>')
+    (tmp_path / "b.xmp").write_text("<xmp:CreateDate>2018-01-02T00:00:00</xmp:CreateDate>")
+    (tmp_path / "c.xmp").write_text("<x:xmpmeta/>")
+    assert xmpDate(str(tmp_path / "a.xmp")) == "2019.08.07"
+    assert xmpDate(str(tmp_path / "b.xmp")) == "2018.01.02"
+    assert xmpDate(str(tmp_path / "c.xmp")) is None
+
+
+def files(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(b"")
+        os.utime(path, (datetime(2010, 6, 7, 12).timestamp(),) * 2)
+        paths.append(str(path))
+    return paths
+
+
+# Every file is only asked to the sources until one of them dated it, in the order of the chain
+def test_sources_are_asked_in_chain_order(tmp_path):
+    header, named, sidecar, plain = files(tmp_path, "a.jpg", "IMG_20240512.jpg", "c.cr3", "d.jpg")
+    (tmp_path / "c.CR3.xmp").write_text('<x exif:DateTimeOriginal="2019-08-07T10:00:00"/>')
+    headers = {header: MetaRecord("jpeg", "2021.03.04"), named: MetaRecord("jpeg", None)}
+    asked = []
+
+    def read_headers(paths):
+        asked.extend(paths)
+        return {p: headers.get(p) for p in paths}
+
+    resolver = DateResolver(("header", "filename", "sidecar", "mtime"))
+    resolution, missing = resolver.start([header, named, sidecar, plain], read_headers)
+    assert missing == []
+    records = resolver.finish(resolution)
+    assert sorted(asked) == sorted([header, named, sidecar, plain])
+    assert records == {
+        header: MetaRecord("jpeg", "2021.03.04"),
+        # The filetype read from the header is kept
+        named: MetaRecord("jpeg", "2024.05.12"),
+        sidecar: MetaRecord("cr3", "2019.08.07"),
+        # Files dated without reading them get the filetype exiftool reports for their extension
+        plain: MetaRecord("jpeg", "2010.06.07"),
+    }
+    assert resolver.counts == {"cache": 0, "header": 1, "filename": 1, "sidecar": 1, "mtime": 1, "none": 0}
+
+
+# The filename comes before the headers if it is first in the chain, the headers are then only read for the rest
+def test_a_cheaper_source_first_saves_the_later_ones(tmp_path):
+    named, plain = files(tmp_path, "IMG_20240512.jpg", "b.jpg")
+    asked = []
+
+    def read_headers(paths):
+        asked.extend(paths)
+        return {p: MetaRecord("jpeg", "2021.03.04") for p in paths}
+
+    resolver = DateResolver(("filename", "header"))
+    resolution, _ = resolver.start([named, plain], read_headers)
+    records = resolver.finish(resolution)
+    assert asked == [plain]
+    assert records[named] == MetaRecord("jpeg", "2024.05.12")
+    assert records[plain] == MetaRecord("jpeg", "2021.03.04")
+
+
+# Files the headers could not handle go to exiftool, the sources after it only get the files exiftool could not date
+def test_exiftool_runs_between_the_sources(tmp_path):
+    parsed, unknown, undated = files(tmp_path, "a.jpg", "b.nef", "c.nef")
+    resolver = DateResolver(("header", "exiftool", "mtime"))
+    resolution, missing = resolver.start(
+        [parsed, unknown, undated], lambda paths: {p: MetaRecord("jpeg") if p == parsed else None for p in paths}
+    )
+    # The headers of parsed were read, exiftool would not find a date there either
+    assert missing == [unknown, undated]
+    resolution.add({unknown: MetaRecord("nef", "2015.01.01"), undated: MetaRecord("nef")}, "exiftool")
+    records = resolver.finish(resolution)
+    assert records == {
+        parsed: MetaRecord("jpeg", "2010.06.07"),
+        unknown: MetaRecord("nef", "2015.01.01"),
+        undated: MetaRecord("nef", "2010.06.07"),
+    }
+
+
+def test_cached_records_are_not_read_again(tmp_path):
+    cached, other = files(tmp_path, "a.jpg", "b.jpg")
+    asked = []
+
+    def read_headers(paths):
+        asked.extend(paths)
+        return {p: MetaRecord("jpeg") for p in paths}
+
+    resolver = DateResolver(("header",))
+    resolution, _ = resolver.start([cached, other], read_headers, {cached: MetaRecord("jpeg", "2021.03.04")})
+    records = resolver.finish(resolution)
+    assert asked == [other]
+    assert records[cached] == MetaRecord("jpeg", "2021.03.04")
+    assert resolver.counts["cache"] == 1
+    assert resolver.counts["none"] == 1
+
+
+@pytest.mark.parametrize("chain", [(), ("header", "header"), ("header", "guess")])
+def test_invalid_chains(chain):
+    with pytest.raises(ValueError):
+        DateResolver(chain)
@@ -0,0 +1,61 @@
+import os
+
+from metadata import MetaRecord
+from sidecars import groupFiles, groupKey
+
+
+def test_group_key():
+    assert groupKey("/a/IMG_0001.CR3") == ("/a", "img_0001")
+    assert groupKey("/a/img_0001.xmp") == ("/a", "img_0001")
+    # Sidecars named after the whole file name
+    assert groupKey("/a/IMG_0001.CR3.xmp") == ("/a", "img_0001")
+    # Dots in the name of media files are part of the stem
+    assert groupKey("/a/2024-05-12 12.34.56.jpg") == ("/a", "2024-05-12 12.34.56")
+
+
+def test_files_are_grouped_by_directory_and_name():
+    files = [
+        "/a/IMG_0001.CR3",
+        "/a/IMG_0001.JPG",
+        "/a/IMG_0001.xmp",
+        "/a/IMG_0002.JPG",
+        "/b/IMG_0001.xmp",
+    ]
+    groups = list(groupFiles(files))
+    assert sorted(sorted(os.fspath(m) for m in g.members) for g in groups) == [
+        ["/a/IMG_0001.CR3", "/a/IMG_0001.JPG", "/a/IMG_0001.xmp"],
+        ["/a/IMG_0002.JPG"],
+        ["/b/IMG_0001.xmp"],
+    ]
+
+
+def test_single_files_are_not_grouped():
+    groups = list(groupFiles(["/a/x.jpg", "/a/x.xmp"], single=lambda f: f.endswith(".xmp")))
+    assert [g.members for g in groups] == [["/a/x.xmp"], ["/a/x.jpg"]]
+
+
+# The member the header parser reads is probed, RAWs exiftool has to read and sidecars come later
+def test_probe_order():
+    (group,) = groupFiles(["/a/IMG_0001.xmp", "/a/IMG_0001.CR3", "/a/IMG_0001.JPG"])
+    assert group.probe == "/a/IMG_0001.JPG"
+    assert os.fspath(group) == "/a/IMG_0001.JPG"
+    assert group.others() == ["/a/IMG_0001.CR3"]
+    assert group.lead() == "/a/IMG_0001.CR3"
+
+
+# Every member gets the date of the group, media keep their own filetype and the sidecars follow the RAW
+def test_records_of_the_members():
+    (group,) = groupFiles(["/a/IMG_0001.CR3", "/a/IMG_0001.JPG", "/a/IMG_0001.CR3.xmp", "/a/IMG_0001.aae"])
+    records = dict(group.records(MetaRecord("jpeg", "2021.03.04"), "2021.03.04"))
+    assert records == {
+        "/a/IMG_0001.JPG": MetaRecord("jpeg", "2021.03.04"),
+        "/a/IMG_0001.CR3": MetaRecord("cr3", "2021.03.04"),
+        "/a/IMG_0001.CR3.xmp": MetaRecord("cr3", "2021.03.04"),
+        "/a/IMG_0001.aae": MetaRecord("cr3", "2021.03.04"),
+    }
+
+
+def test_sidecars_without_a_raw_follow_the_probe():
+    (group,) = groupFiles(["/a/IMG_0001.HEIC", "/a/IMG_0001.AAE"])
+    records = dict(group.records(MetaRecord("heic", "2021.03.04"), "2021.03.04"))
+    assert records["/a/IMG_0001.AAE"] == MetaRecord("heic", "2021.03.04")
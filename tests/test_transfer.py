@@ -0,0 +1,121 @@
+import os
+import threading
+
+import pytest
+
+from transfer import TransferEngine, copyContent, renameNoReplace
+
+
+def test_move_on_the_same_device_renames(tmp_path):
+    src = tmp_path / "a.jpg"
+    src.write_bytes(b"image")
+    os.utime(src, (1_000_000, 1_000_000))
+    engine = TransferEngine(str(tmp_path))
+    engine.move(str(src), str(tmp_path / "b.jpg"))
+    assert not src.exists()
+    assert (tmp_path / "b.jpg").read_bytes() == b"image"
+    assert os.stat(tmp_path / "b.jpg").st_mtime == 1_000_000
+    assert (engine.stats.renamed, engine.stats.copied) == (1, 0)
+
+
+# An existing file is never replaced unless overwriting is requested
+def test_move_does_not_clobber(tmp_path):
+    src = tmp_path / "a.jpg"
+    dst = tmp_path / "b.jpg"
+    src.write_bytes(b"new")
+    dst.write_bytes(b"old")
+    engine = TransferEngine(str(tmp_path))
+    with pytest.raises(FileExistsError):
+        engine.move(str(src), str(dst))
+    assert src.read_bytes() == b"new"
+    assert dst.read_bytes() == b"old"
+    engine.move(str(src), str(dst), overwrite=True)
+    assert dst.read_bytes() == b"new"
+    assert not src.exists()
+
+
+def test_copy_keeps_content_and_timestamps(tmp_path):
+    src = tmp_path / "a.jpg"
+    src.write_bytes(os.urandom(300_000))
+    os.utime(src, (1_000_000, 1_000_000))
+    dst = tmp_path / "copy.jpg"
+    engine = TransferEngine(str(tmp_path), buffer_size=4096)
+    assert engine.copy(str(src), str(dst)) == 300_000
+    assert dst.read_bytes() == src.read_bytes()
+    assert os.stat(dst).st_mtime == 1_000_000
+    assert src.exists()
+    assert engine.stats.copied_bytes == 300_000
+    with pytest.raises(FileExistsError):
+        engine.copy(str(src), str(dst))
+
+
+def test_copy_content_with_a_small_buffer(tmp_path):
+    data = os.urandom(100_000)
+    (tmp_path / "a").write_bytes(data)
+    with open(tmp_path / "a", "rb") as fin, open(tmp_path / "b", "wb") as fout:
+        assert copyContent(fin, fout, 1000) == len(data)
+    assert (tmp_path / "b").read_bytes() == data
+
+
+# Copied sources are only removed once their copies were synced, at the latest by flush
+def test_sources_are_removed_after_flush(tmp_path):
+    engine = TransferEngine(str(tmp_path), fsync_batch=10)
+    engine.sameDevice = lambda src: False
+    sources = []
+    for i in range(3):
+        src = tmp_path / f"{i}.jpg"
+        src.write_bytes(b"image")
+        sources.append(src)
+        engine.move(str(src), str(tmp_path / f"{i}.copy"))
+    assert all(src.exists() for src in sources)
+    engine.flush()
+    assert not any(src.exists() for src in sources)
+    assert engine.stats.copied == 3
+
+
+# Threads moving different files to the same name: exactly one of them wins, the others keep their source
+def test_concurrent_moves_to_the_same_name(tmp_path):
+    engine = TransferEngine(str(tmp_path))
+    dst = str(tmp_path / "b.jpg")
+    sources = []
+    for i in range(8):
+        src = tmp_path / f"a{i}.jpg"
+        src.write_bytes(b"image %d" % i)
+        sources.append(str(src))
+    barrier = threading.Barrier(len(sources))
+    failed = []
+
+    def move(src):
+        barrier.wait()
+        try:
+            engine.move(src, dst)
+        except FileExistsError:
+            failed.append(src)
+
+    threads = [threading.Thread(target=move, args=(src,)) for src in sources]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(failed) == len(sources) - 1
+    moved = [src for src in sources if src not in failed]
+    assert open(dst, "rb").read() == b"image %d" % sources.index(moved[0])
+    assert all(os.path.exists(src) for src in failed)
+
+
+# Without hard links the destination is reserved before renaming, an existing one is still never replaced
+def test_rename_without_hard_links(tmp_path, monkeypatch):
+    def noLinks(*args, **kwds):
+        raise PermissionError(1, "Operation not permitted")
+
+    monkeypatch.setattr(os, "link", noLinks)
+    src = tmp_path / "a.jpg"
+    dst = tmp_path / "b.jpg"
+    src.write_bytes(b"new")
+    renameNoReplace(str(src), str(dst))
+    assert dst.read_bytes() == b"new"
+    assert not src.exists()
+    src.write_bytes(b"newer")
+    with pytest.raises(FileExistsError):
+        renameNoReplace(str(src), str(dst))
+    assert (src.read_bytes(), dst.read_bytes()) == (b"newer", b"new")
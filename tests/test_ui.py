@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+# Errors at the module level of UI.py (or of the modules it imports) break every entry point
+def test_help_runs():
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "UI.py"), "--help"],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "--src" in result.stdout or "-s SRC" in result.stdout
@@ -0,0 +1,318 @@
+#!/usr/bin/python
+
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Copies are written next to their destination with this suffix and renamed once complete,
+# so an interrupted copy never looks like an imported file
+PARTIAL_SUFFIX = ".importing"
+
+
+# Raised when the copy of a file does not have the same checksum as its source
+class VerificationError(Exception):
+    def __init__(self, src: str, dst: str, expected: str, actual: str) -> None:
+        super().__init__(
+            f"Checksum mismatch: '{dst}' ({actual}) is not an intact copy of '{src}' ({expected})"
+        )
+        self.src = src
+        self.dst = dst
+        self.expected = expected
+        self.actual = actual
+
+
+# Counts how the files were transferred
+@dataclass
+class TransferStats:
+    renamed: int = field(default=0)
+    copied: int = field(default=0)
+    copied_bytes: int = field(default=0)
+    # Seconds spent copying, summed over the threads
+    copy_seconds: float = field(default=0.0)
+    verified: int = field(default=0)
+    mismatches: int = field(default=0)
+
+    # The average copy speed of a single thread in bytes/s
+    def copyRate(self) -> float:
+        if self.copy_seconds == 0:
+            return 0.0
+        return self.copied_bytes / self.copy_seconds
+
+    def __str__(self) -> str:
+        text = (
+            f"Renamed {self.renamed} files, copied {self.copied} files "
+            f"({self.copied_bytes / 1024 / 1024:.1f} MiB at {self.copyRate() / 1024 / 1024:.1f} MiB/s)"
+        )
+        if self.verified or self.mismatches:
+            text += f", verified {self.verified} copies, {self.mismatches} checksum mismatches"
+        return text
+
+
+# Copies the content of an open file to another using the fastest method the platform supports:
+# copy_file_range (in kernel, may use reflinks), sendfile, then plain reads into a reused buffer
+def copyContent(fin, fout, buffer_size: int = DEFAULT_BUFFER_SIZE) -> int:
+    total = 0
+    infd, outfd = fin.fileno(), fout.fileno()
+    if hasattr(os, "copy_file_range"):
+        try:
+            while n := os.copy_file_range(infd, outfd, buffer_size):
+                total += n
+            return total
+        except OSError as e:
+            # Not supported between these filesystems, continue from where it stopped
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    if hasattr(os, "sendfile"):
+        try:
+            while n := os.sendfile(outfd, infd, total, buffer_size):
+                total += n
+            return total
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    fin.seek(total)
+    fout.seek(total)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while n := fin.readinto(buffer):
+        fout.write(view[:n])
+        total += n
+    return total
+
+
+# Copies the content of an open file to another while hashing it, so the source is only read once. Returns the size and the hex digest
+def copyHashed(fin, fout, buffer_size: int = DEFAULT_BUFFER_SIZE) -> tuple[int, str]:
+    total = 0
+    digest = hashlib.blake2b()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while n := fin.readinto(buffer):
+        digest.update(view[:n])
+        fout.write(view[:n])
+        total += n
+    return total, digest.hexdigest()
+
+
+# Hashes the content of a file. If drop_cache is set the file is first evicted from the page cache (where supported),
+# so that the data is read back from the disk and not from memory
+def hashFile(path: str, buffer_size: int = DEFAULT_BUFFER_SIZE, drop_cache: bool = False) -> str:
+    digest = hashlib.blake2b()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, "rb") as f:
+        if drop_cache and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        while n := f.readinto(buffer):
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+# Moves files into the destination. Files on the same device as the destination are renamed,
+# the rest are copied and their source is removed once the copies are synced to the disk.
+# Syncing is done for fsync_batch files at a time (0 disables syncing and removes the sources right away).
+# If keep_source is set every file is copied and the sources are left untouched.
+# If verify is set copies are hashed while they are written and read back from the disk to check that they are intact,
+# the read back is done by hash_file (see hashFile)
+class TransferEngine:
+    def __init__(
+        self,
+        destination: str,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        fsync_batch: int = 64,
+        keep_source: bool = False,
+        verify: bool = False,
+        hash_file=hashFile,
+    ) -> None:
+        self.buffer_size = buffer_size
+        self.hash_file = hash_file
+        self.fsync_batch = fsync_batch
+        self.keep_source = keep_source
+        self.verify = verify
+        self.stats = TransferStats()
+        self.directories = DirectoryCache()
+        self.dst_dev = os.stat(existingParent(destination)).st_dev
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._pending = []
+
+    # Checks whether the file is on the same device as the destination. The devices are cached per source directory
+    def sameDevice(self, src: str) -> bool:
+        parent = os.path.dirname(src)
+        dev = self._devices.get(parent)
+        if dev is None:
+            dev = os.stat(parent or ".").st_dev
+            self._devices[parent] = dev
+        return dev == self.dst_dev
+
+    # Moves or copies (if keep_source is set) src to dst, the full new path. The directory of dst is created if needed
+    def place(self, src: str, dst: str, overwrite: bool = False) -> None:
+        self.directories.ensure(os.path.dirname(dst))
+        if self.keep_source:
+            # Only saves copying a file that can not be placed, the copy itself never replaces dst (see commitPartial)
+            if not overwrite and os.path.lexists(dst):
+                raise FileExistsError(errno.EEXIST, "Destination path already exists", dst)
+            self.copy(src, dst, overwrite)
+        else:
+            self.move(src, dst, overwrite)
+
+    # Moves src to dst (the full new path). Raises FileExistsError if dst exists and overwrite is not set,
+    # also if another thread creates dst at the same time (see renameNoReplace)
+    def move(self, src: str, dst: str, overwrite: bool = False) -> None:
+        if not overwrite and os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, "Destination path already exists", dst)
+        if self.sameDevice(src):
+            try:
+                if overwrite:
+                    os.replace(src, dst)
+                else:
+                    renameNoReplace(src, dst)
+                with self._lock:
+                    self.stats.renamed += 1
+                return
+            except OSError as e:
+                # Bind mounts and the like share the device number but can not be renamed across
+                if e.errno != errno.EXDEV:
+                    raise
+        self.copy(src, dst, overwrite)
+        self._retire(src, dst)
+
+    # Copies src to dst, keeping the timestamps and permissions, returns the number of copied bytes.
+    # The copy is written to a partial file first (see PARTIAL_SUFFIX), which is renamed to dst once it is complete.
+    # When verifying, a copy that does not match its source is removed and VerificationError is raised
+    def copy(self, src: str, dst: str, overwrite: bool = False) -> int:
+        start = time.perf_counter()
+        digest = None
+        partial = dst + PARTIAL_SUFFIX
+        try:
+            with open(src, "rb") as fin, open(partial, "wb") as fout:
+                if self.verify:
+                    size, digest = copyHashed(fin, fout, self.buffer_size)
+                    fout.flush()
+                    os.fsync(fout.fileno())
+                else:
+                    size = copyContent(fin, fout, self.buffer_size)
+            shutil.copystat(src, partial)
+            if digest is not None:
+                actual = self.hash_file(partial, self.buffer_size, True)
+                if actual != digest:
+                    with self._lock:
+                        self.stats.mismatches += 1
+                    raise VerificationError(src, dst, digest, actual)
+            commitPartial(partial, dst, overwrite)
+        except BaseException:
+            if os.path.lexists(partial):
+                os.unlink(partial)
+            raise
+        with self._lock:
+            self.stats.copied += 1
+            self.stats.copied_bytes += size
+            self.stats.copy_seconds += time.perf_counter() - start
+            if digest is not None:
+                self.stats.verified += 1
+        return size
+
+    # Removes the source of a finished copy, after syncing a batch of copies to the disk
+    def _retire(self, src: str, dst: str) -> None:
+        if self.fsync_batch <= 0:
+            os.unlink(src)
+            return
+        with self._lock:
+            self._pending.append((src, dst))
+            if len(self._pending) < self.fsync_batch:
+                return
+            pending, self._pending = self._pending, []
+        self._sync(pending)
+
+    # Syncs the copies and the directories they are in, then removes their sources
+    def _sync(self, pending: list) -> None:
+        for _, dst in pending:
+            fsyncPath(dst)
+        for parent in {os.path.dirname(dst) for _, dst in pending}:
+            fsyncPath(parent)
+        for src, _ in pending:
+            os.unlink(src)
+
+    # Syncs and removes the sources of the copies that are still pending. Has to be called once all files are moved
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        self._sync(pending)
+
+
+# Renames a finished partial copy to dst. Unless overwrite is set an existing dst is never replaced (see renameNoReplace)
+def commitPartial(partial: str, dst: str, overwrite: bool) -> None:
+    if overwrite:
+        os.replace(partial, dst)
+    else:
+        renameNoReplace(partial, dst)
+
+
+# Renames src to dst, raising FileExistsError if dst exists. Checking for dst before renaming would let two threads
+# both pass the check and the second replace the file of the first, so the check and the rename have to be a single step:
+# src is hard linked to dst (which fails if dst exists) and then removed. On filesystems without hard links dst is
+# reserved by creating it exclusively, then replaced by src. A rename to another device raises the OSError (EXDEV) of the link
+def renameNoReplace(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            raise
+        os.close(os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        try:
+            os.replace(src, dst)
+        except BaseException:
+            os.unlink(dst)
+            raise
+        return
+    os.unlink(src)
+
+
+# Creates directories and remembers the ones that exist, so every directory is created (or found to exist) only once.
+# Safe to use from several threads, a directory needed by several of them is created by the first one
+class DirectoryCache:
+    def __init__(self) -> None:
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def ensure(self, path: str) -> None:
+        path = os.path.normpath(path)
+        if path in self._known:
+            return
+        with self._lock:
+            if path in self._known:
+                return
+            os.makedirs(path, exist_ok=True)
+            self._known.add(path)
+
+
+# Flushes a file or directory to the disk. Directories can not be synced on every platform, that is ignored
+def fsyncPath(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Returns path, or its closest parent that exists
+def existingParent(path: str) -> str:
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+# How changes of the watched directory are noticed:
+# inotify: the kernel reports them (Linux only)
+# poll: the directories are stat-ed every interval and only the ones whose modification time changed are listed again
+# auto: inotify where it is available, poll otherwise
+WATCH_BACKENDS = ("auto", "inotify", "poll")
+
+# The inotify events the watcher listens to (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# The header of an inotify event: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class WatchError(Exception):
+    pass
+
+
+# Lists a directory, returns the paths of its files and of its subdirectories that are not in skip
+def listDirectory(path: str, skip: tuple = ()) -> tuple[list[str], list[str]]:
+    files = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path not in skip:
+                    subdirs.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.path)
+    return files, subdirs
+
+
+# Yields the directories of a tree (only the top directory unless recursive) with their files. Directories in skip are not entered
+def scanTree(root: str, recursive: bool, skip: tuple = ()):
+    dirs = [root]
+    while dirs:
+        path = dirs.pop()
+        try:
+            files, subdirs = listDirectory(path, skip)
+        except OSError:
+            continue
+        if recursive:
+            dirs.extend(subdirs)
+        yield path, files
+
+
+# Notices changes by listing the directories whose modification time changed since the last poll.
+# A directory's modification time changes when entries are added, removed or renamed in it, but not when a file in it is written,
+# the files being written are followed by the Watcher itself
+class PollBackend:
+    name = "poll"
+
+    def __init__(self, root: str, recursive: bool, skip: tuple = ()) -> None:
+        self.root = root
+        self.recursive = recursive
+        self.skip = skip
+        # directory -> its modification time and its subdirectories when it was last listed
+        self._dirs = {}
+        # The files found by the first listing
+        self.existing = self.changes()
+
+    # Waits timeout seconds, then returns the files of the directories that changed
+    def wait(self, timeout: float) -> list[str]:
+        time.sleep(timeout)
+        return self.changes()
+
+    # Stats every known directory and lists the ones that changed (or are new). Returns the files found in them
+    def changes(self) -> list[str]:
+        found = []
+        dirs = [self.root]
+        while dirs:
+            path = dirs.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._dirs.pop(path, None)
+                continue
+            known = self._dirs.get(path)
+            if known is None or known[0] != mtime:
+                try:
+                    files, subdirs = listDirectory(path, self.skip)
+                except OSError:
+                    self._dirs.pop(path, None)
+                    continue
+                found.extend(files)
+                known = self._dirs[path] = (mtime, subdirs)
+            if self.recursive:
+                dirs.extend(known[1])
+        return found
+
+    def close(self) -> None:
+        pass
+
+
+# Notices changes with inotify. Every directory of the tree gets a watch, the ones created later are added as they appear
+class InotifyBackend:
+    name = "inotify"
+
+    def __init__(self, root: str, recursive: bool, skip: tuple = ()) -> None:
+        libc = _libc()
+        if libc is None:
+            raise WatchError("inotify is not available")
+        self._libc = libc
+        self.root = root
+        self.recursive = recursive
+        self.skip = skip
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatchError(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+        self._watches = {}
+        # The files found while the watches were added
+        self.existing = []
+        try:
+            for directory, files in scanTree(root, recursive, skip):
+                self._watch(directory)
+                self.existing.extend(files)
+        except WatchError:
+            self.close()
+            raise
+
+    def _watch(self, path: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise WatchError(f"The inotify watch limit was reached while watching '{path}' (see fs.inotify.max_user_watches)")
+            # The directory disappeared in the meantime
+            return
+        self._watches[wd] = path
+
+    # Waits at most timeout seconds for changes, returns the files that were created or written.
+    # If the kernel dropped events (the queue overflowed) every file of the tree is returned
+    def wait(self, timeout: float) -> list[str]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        found = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+                name = data[pos + EVENT_HEADER.size : pos + EVENT_HEADER.size + length].rstrip(b"\0")
+                pos += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    return [f for _, files in scanTree(self.root, self.recursive, self.skip) for f in files]
+                if mask & IN_IGNORED:
+                    # The directory was removed, its watch is gone
+                    self._watches.pop(wd, None)
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and path not in self.skip:
+                        # Files may have been written into the new directory before it was watched
+                        for sub, files in scanTree(path, True, self.skip):
+                            self._watch(sub)
+                            found.extend(files)
+                    continue
+                found.append(path)
+        return found
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+# Watches a directory for new files and hands them out once they stopped changing: a file is ready when its size and
+# modification time stayed the same for settle seconds, so files that are still being written are not imported half done.
+# Files are handed out once, unless they change afterwards (e.g. they are overwritten while the sources are kept).
+# The files that already exist when the watch starts are handed out as well
+class Watcher:
+    def __init__(
+        self,
+        root: str,
+        recursive: bool = True,
+        settle: float = 5.0,
+        interval: float = 1.0,
+        backend: str = "auto",
+        skip: tuple = (),
+        ignore_suffixes: tuple = (),
+    ) -> None:
+        if backend not in WATCH_BACKENDS:
+            raise ValueError(f"Unknown watch backend: {backend}")
+        self.root = root = os.path.abspath(root)
+        self.recursive = recursive
+        self.settle = settle
+        self.interval = interval
+        self.skip = tuple(os.path.abspath(p) for p in skip)
+        self.ignore_suffixes = ignore_suffixes
+        self.backend = None
+        if backend != "poll":
+            try:
+                self.backend = InotifyBackend(root, recursive, self.skip)
+            except WatchError:
+                if backend == "inotify":
+                    raise
+        if self.backend is None:
+            self.backend = PollBackend(root, recursive, self.skip)
+        # path -> ((size, mtime), the time it was first seen with that signature)
+        self.pending = {}
+        # path -> the signature it was handed out with
+        self.seen = {}
+        self._add(self.backend.existing)
+        self.backend.existing = []
+
+    def _add(self, paths) -> None:
+        for path in paths:
+            if not path.endswith(self.ignore_suffixes):
+                self.pending.setdefault(path, None)
+
+    # Waits for changes (at most interval seconds) and returns the files that settled
+    def poll(self) -> list[str]:
+        timeout = self.interval
+        if self.pending:
+            timeout = min(timeout, self.settle)
+        self._add(self.backend.wait(timeout))
+        now = time.monotonic()
+        ready = []
+        for path, last in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if self.seen.get(path) == signature:
+                del self.pending[path]
+            elif last is None or last[0] != signature:
+                self.pending[path] = (signature, now)
+            elif now - last[1] >= self.settle:
+                del self.pending[path]
+                self.seen[path] = signature
+                ready.append(path)
+        return ready
+
+    # Forgets the handed out files that no longer exist (e.g. they were moved to the destination)
+    def imported(self, paths) -> None:
+        for path in paths:
+            if not os.path.lexists(path):
+                self.seen.pop(path, None)
+
+    def close(self) -> None:
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()